@@ -2,6 +2,51 @@ import time
 from typing import Optional
 from langchain_neo4j import Neo4jGraph
 import environment
+from database.queries import param_shapes, query_name, query_text_stats, slow_query_log
+from services.profiling import compact_plan, current_profile
+
+
+class InstrumentedNeo4jGraph(Neo4jGraph):
+    """Neo4jGraph that records every query text it runs (see database.queries), logs slow
+    ones, and reports to the request profile when the request is being profiled."""
+
+    def query(self, query: str, params: Optional[dict] = None, *args, **kwargs):
+        query_text_stats.record(query)
+        profile = current_profile()
+        name = query_name(query)
+        plan = None
+        error = None
+        started = time.perf_counter()
+        try:
+            # Only registered templates run under PROFILE; schema commands and ad-hoc
+            # EXPLAIN/PROFILE text run as they are.
+            if profile is not None and profile.plans and name is not None:
+                rows, plan = self._profiled(query, params or {})
+                return rows
+            return super().query(query, params or {}, *args, **kwargs)
+        except Exception as e:
+            error = str(e)[:200]
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            slow_query_log.record(query, params, seconds, error)
+            if profile is not None:
+                entry = {
+                    "name": name or "<unregistered>",
+                    "seconds": round(seconds, 4),
+                    "params": param_shapes(params),
+                    "error": error,
+                }
+                if plan is not None:
+                    entry["plan"] = plan
+                profile.record_query(entry)
+
+    def _profiled(self, query: str, params: dict):
+        with self._driver.session(database=self._database) as session:
+            result = session.run("PROFILE " + query, params)
+            rows = [record.data() for record in result]
+            summary = result.consume()
+        return rows, compact_plan(summary.profile)
 
 
 def get_neo4j_connection(
@@ -21,7 +66,7 @@ def get_neo4j_connection(
     last_err: Optional[Exception] = None
     for attempt in range(1, max_retries + 1):
         try:
-            graph = Neo4jGraph(url=uri, username=user, password=pw)
+            graph = InstrumentedNeo4jGraph(url=uri, username=user, password=pw)
             # Simple test query
             graph.query("RETURN 1 AS ok")
             return graph
@@ -31,3 +76,12 @@ def get_neo4j_connection(
     raise RuntimeError(f"Failed to connect to Neo4j after {max_retries} retries: {last_err}")
 
 
+# Lazy, process-wide connection - only connect when needed
+_kg_connection: Optional[Neo4jGraph] = None
+
+
+def get_kg() -> Neo4jGraph:
+    global _kg_connection
+    if _kg_connection is None:
+        _kg_connection = get_neo4j_connection()
+    return _kg_connection
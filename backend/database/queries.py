@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Iterable, List
+
+import environment
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# Named Cypher templates. A template is either fixed text or a function of configuration
+# (e.g. the embedding space, passed as keyword arguments with defaults); user data is
+# always a $parameter, so each template renders to few stable texts and Neo4j can reuse
+# their cached plans.
+_TEMPLATES: Dict[str, Callable[..., str]] = {}
+_TEXT_NAMES: Dict[str, str] = {}
+_lock = threading.Lock()
+
+
+def register_query(name: str, template: str | Callable[..., str]) -> str:
+    if name in _TEMPLATES:
+        raise ValueError(f"Query template {name!r} is already registered")
+    _TEMPLATES[name] = template if callable(template) else (lambda: template)
+    return name
+
+
+def cypher(name: str, **template_args: Any) -> str:
+    text = _TEMPLATES[name](**template_args)
+    key = text.strip()
+    if key not in _TEXT_NAMES:
+        with _lock:
+            _TEXT_NAMES[key] = name
+    return text
+
+
+def _normalize(text: str) -> str:
+    stripped = text.strip()
+    for prefix in ("EXPLAIN", "PROFILE"):
+        if stripped.upper().startswith(prefix + " ") or stripped.upper().startswith(prefix + "\n"):
+            stripped = stripped[len(prefix):].strip()
+    return stripped
+
+
+def query_name(text: str) -> str | None:
+    return _TEXT_NAMES.get(_normalize(text))
+
+
+def registered_queries() -> List[str]:
+    return sorted(_TEMPLATES)
+
+
+def run_query(name: str, params: Dict[str, Any] | None = None, **template_args: Any) -> List[Dict[str, Any]]:
+    from database.neo import get_kg
+
+    return get_kg().query(cypher(name, **template_args), params=params or {})
+
+
+def prewarm(names: Iterable[str] | None = None) -> Dict[str, Any]:
+    """EXPLAIN every template so its plan is compiled and cached before real traffic."""
+    from database.neo import get_kg
+
+    warmed: List[str] = []
+    failed: Dict[str, str] = {}
+    for name in names or registered_queries():
+        try:
+            get_kg().query("EXPLAIN " + cypher(name))
+            warmed.append(name)
+        except Exception as e:
+            failed[name] = str(e)
+    if failed:
+        logger.warning(f"Could not pre-warm {len(failed)} queries: {sorted(failed)}")
+    return {"warmed": warmed, "failed": failed}
+
+
+class QueryTextStats:
+    """Client-side view of plan-cache reuse.
+
+    Neo4j caches plans keyed by query text (server.db.query_cache_size, 1000 by default).
+    A text seen for the first time, or evicted since, needs planning; a repeat can reuse
+    the plan. Tracking texts in an LRU of the same size estimates the hit rate.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._texts: OrderedDict = OrderedDict()
+        self._by_name: Dict[str, Dict[str, int]] = {}
+        self.executions = 0
+        self.hits = 0
+
+    def record(self, text: str) -> None:
+        stripped = _normalize(text)
+        name = _TEXT_NAMES.get(stripped, "<unregistered>")
+        with self._lock:
+            self.executions += 1
+            hit = stripped in self._texts
+            if hit:
+                self.hits += 1
+                self._texts.move_to_end(stripped)
+            else:
+                self._texts[stripped] = True
+                if len(self._texts) > self.capacity:
+                    self._texts.popitem(last=False)
+            entry = self._by_name.setdefault(name, {"executions": 0, "hits": 0, "distinct_texts": 0})
+            entry["executions"] += 1
+            entry["hits"] += int(hit)
+            entry["distinct_texts"] += int(not hit)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            by_name = {
+                name: {**entry, "hit_rate": round(entry["hits"] / entry["executions"], 4)}
+                for name, entry in sorted(self._by_name.items())
+            }
+            return {
+                "executions": self.executions,
+                "estimated_hits": self.hits,
+                "estimated_hit_rate": round(self.hits / self.executions, 4) if self.executions else None,
+                "tracked_texts": len(self._texts),
+                "registered_templates": len(_TEMPLATES),
+                "by_name": by_name,
+            }
+
+
+query_text_stats = QueryTextStats(environment.NEO4J_QUERY_CACHE_SIZE)
+
+
+def param_shapes(params: Dict[str, Any] | None) -> Dict[str, str]:
+    """Types and sizes of query parameters, without their values (which may be user data)."""
+
+    def shape(value: Any) -> str:
+        if isinstance(value, (list, tuple)):
+            inner = shape(value[0]) if value else "?"
+            return f"list[{len(value)}] of {inner}"
+        if isinstance(value, dict):
+            return "map{" + ", ".join(sorted(value)) + "}"
+        if isinstance(value, str):
+            return f"str({len(value)})"
+        return type(value).__name__
+
+    return {key: shape(value) for key, value in (params or {}).items()}
+
+
+class SlowQueryLog:
+    """The most recent queries that took at least threshold_ms, with their template name and
+    parameter shapes."""
+
+    def __init__(self, threshold_ms: float, capacity: int):
+        self.threshold_ms = threshold_ms
+        self._lock = threading.Lock()
+        self._entries: deque = deque(maxlen=capacity)
+        self.recorded = 0
+
+    def record(self, text: str, params: Dict[str, Any] | None, seconds: float, error: str | None = None) -> None:
+        if self.threshold_ms < 0 or seconds * 1000 < self.threshold_ms:
+            return
+        entry = {
+            "name": query_name(text) or "<unregistered>",
+            "ms": round(seconds * 1000, 1),
+            "at": time.time(),
+            "params": param_shapes(params),
+            "error": error,
+            "query": _normalize(text)[:300],
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+
+    def snapshot(self, limit: int = 100) -> Dict[str, Any]:
+        with self._lock:
+            entries = list(self._entries)[-limit:]
+        by_name: Dict[str, Dict[str, Any]] = {}
+        for e in entries:
+            agg = by_name.setdefault(e["name"], {"name": e["name"], "count": 0, "max_ms": 0.0, "total_ms": 0.0})
+            agg["count"] += 1
+            agg["max_ms"] = max(agg["max_ms"], e["ms"])
+            agg["total_ms"] = round(agg["total_ms"] + e["ms"], 1)
+        return {
+            "threshold_ms": self.threshold_ms,
+            "recorded": self.recorded,
+            "by_name": sorted(by_name.values(), key=lambda a: a["total_ms"], reverse=True),
+            "entries": list(reversed(entries)),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.recorded = 0
+
+
+slow_query_log = SlowQueryLog(environment.SLOW_QUERY_MS, environment.SLOW_QUERY_LOG_SIZE)
+
+
+def server_query_stats(min_invocations: int = 1) -> List[Dict[str, Any]]:
+    """Compile vs execution time per query text from db.stats (start it with collect_server_query_stats).
+
+    A compile time near zero on repeated invocations means the cached plan was reused.
+    """
+    from database.neo import get_kg
+
+    rows = get_kg().query("CALL db.stats.retrieve('QUERIES') YIELD data RETURN data")
+    report: List[Dict[str, Any]] = []
+    for row in rows or []:
+        data = row.get("data") or {}
+        summary = data.get("invocationSummary") or {}
+        count = summary.get("invocationCount", 0)
+        if count < min_invocations:
+            continue
+        text = data.get("query", "")
+        report.append(
+            {
+                "name": query_name(text) or "<unregistered>",
+                "invocations": count,
+                "compile_time_us": summary.get("compileTimeInUs"),
+                "execution_time_us": summary.get("executionTimeInUs"),
+                "query": text[:200],
+            }
+        )
+    return sorted(report, key=lambda r: r["invocations"], reverse=True)
+
+
+def collect_server_query_stats(duration_seconds: int = 300) -> Dict[str, Any]:
+    from database.neo import get_kg
+
+    rows = get_kg().query(
+        "CALL db.stats.collect('QUERIES', {durationSeconds: $duration}) YIELD section, success, message "
+        "RETURN section, success, message",
+        params={"duration": duration_seconds},
+    )
+    return rows[0] if rows else {}
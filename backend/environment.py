@@ -25,3 +25,103 @@ OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")
 
 # Chat LLM
 OLLAMA_CHAT_MODEL = os.getenv("OLLAMA_CHAT_MODEL", "phi4-mini:latest")
+
+# Embedding scheduler (batching, concurrency, retries, rate limits)
+EMBEDDINGS_MAX_IN_FLIGHT = int(os.getenv("EMBEDDINGS_MAX_IN_FLIGHT", "4"))
+EMBEDDINGS_MAX_RETRIES = int(os.getenv("EMBEDDINGS_MAX_RETRIES", "6"))
+EMBEDDINGS_BACKOFF_BASE_SECONDS = float(os.getenv("EMBEDDINGS_BACKOFF_BASE_SECONDS", "0.5"))
+EMBEDDINGS_BACKOFF_MAX_SECONDS = float(os.getenv("EMBEDDINGS_BACKOFF_MAX_SECONDS", "30"))
+# Optional: starting token budget per batch (defaults depend on provider)
+EMBEDDINGS_BATCH_TOKENS = os.getenv("EMBEDDINGS_BATCH_TOKENS")
+# Optional: client-side limits until the provider reports its own (0 = unlimited)
+EMBEDDINGS_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDINGS_REQUESTS_PER_MINUTE", "0"))
+EMBEDDINGS_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDINGS_TOKENS_PER_MINUTE", "0"))
+
+# Vector storage mode: "full" stores native vectors; "truncated" stores the leading
+# EMBEDDING_INDEX_DIM dimensions of Matryoshka-capable models for the vector index.
+EMBEDDING_STORAGE_MODE = os.getenv("EMBEDDING_STORAGE_MODE", "full")
+EMBEDDING_INDEX_DIM = os.getenv("EMBEDDING_INDEX_DIM")
+# Optional compact copy of the full vector for exact re-scoring: none | int8 | float16
+EMBEDDING_RESCORE_DTYPE = os.getenv("EMBEDDING_RESCORE_DTYPE", "none")
+EMBEDDING_RESCORE_OVERSAMPLE = int(os.getenv("EMBEDDING_RESCORE_OVERSAMPLE", "4"))
+
+# Retrieval: vector | hybrid (full-text + vector, rank fusion) | prefilter (full-text
+# candidates are vector-scored instead of scanning every chunk)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "50"))
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+RETRIEVAL_PREFILTER_CANDIDATES = int(os.getenv("RETRIEVAL_PREFILTER_CANDIDATES", "1000"))
+# Diversity: keep k of k * RETRIEVAL_MMR_OVERSAMPLE candidates by maximal marginal relevance;
+# RETRIEVAL_MMR_LAMBDA=1 is pure relevance, lower values favour chunks unlike those already picked
+RETRIEVAL_MMR = os.getenv("RETRIEVAL_MMR", "true").strip().lower() in ("1", "true", "yes")
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.7"))
+RETRIEVAL_MMR_OVERSAMPLE = int(os.getenv("RETRIEVAL_MMR_OVERSAMPLE", "4"))
+QA_TOP_K = int(os.getenv("QA_TOP_K", "5"))
+
+# QA context assembly
+QA_CONTEXT_TOKEN_BUDGET = int(os.getenv("QA_CONTEXT_TOKEN_BUDGET", "3000"))
+QA_CONTEXT_NEIGHBOR_HOPS = int(os.getenv("QA_CONTEXT_NEIGHBOR_HOPS", "2"))
+
+# Query plan cache: mirror of Neo4j's server.db.query_cache_size, used to estimate hit rates
+NEO4J_QUERY_CACHE_SIZE = int(os.getenv("NEO4J_QUERY_CACHE_SIZE", "1000"))
+PREWARM_QUERIES = os.getenv("PREWARM_QUERIES", "true").strip().lower() in ("1", "true", "yes")
+
+# Background re-embedding when the embedding space (provider/model/storage) changes
+REEMBED_AUTOSTART = os.getenv("REEMBED_AUTOSTART", "true").strip().lower() in ("1", "true", "yes")
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "100"))
+REEMBED_MAX_CHUNKS_PER_MINUTE = int(os.getenv("REEMBED_MAX_CHUNKS_PER_MINUTE", "600"))
+
+# Content-addressed chunks: identical chunk text is stored and embedded once, shared by every File
+CHUNK_DEDUP = os.getenv("CHUNK_DEDUP", "false").strip().lower() in ("1", "true", "yes")
+
+# Ingest pipeline: chunks per store/embed batch, and batches buffered between stages
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "50"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+
+# Ingest admission control: concurrent ingests, queued ingests, and how long one may queue
+INGEST_MAX_IN_FLIGHT = int(os.getenv("INGEST_MAX_IN_FLIGHT", "2"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "8"))
+INGEST_QUEUE_TIMEOUT_SECONDS = float(os.getenv("INGEST_QUEUE_TIMEOUT_SECONDS", "30"))
+
+# Batch QA
+QA_BATCH_MAX_QUESTIONS = int(os.getenv("QA_BATCH_MAX_QUESTIONS", "500"))
+QA_BATCH_RETRIEVAL_CONCURRENCY = int(os.getenv("QA_BATCH_RETRIEVAL_CONCURRENCY", "8"))
+QA_BATCH_LLM_CONCURRENCY = int(os.getenv("QA_BATCH_LLM_CONCURRENCY", "4"))
+
+# Precomputed SIMILAR_TO edges (GDS kNN over the serving vectors)
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "10"))
+SIMILARITY_CUTOFF = float(os.getenv("SIMILARITY_CUTOFF", "0.8"))
+
+# Deletes (files, users, retention) commit every DELETE_BATCH_SIZE rows
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "1000"))
+
+# Profiling: X-Profile header (1 or plans) or a sampled fraction of requests; slow Cypher log
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_CYPHER_PLANS = os.getenv("PROFILE_CYPHER_PLANS", "false").strip().lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+
+# Tenant export/import: rows per page on export and per UNWIND batch on import
+TRANSFER_BATCH_SIZE = int(os.getenv("TRANSFER_BATCH_SIZE", "1000"))
+
+# PDF extraction: text (text layer only), auto (OCR pages with a sparse text layer) or full
+PDF_EXTRACTION_MODE = os.getenv("PDF_EXTRACTION_MODE", "auto").strip().lower()
+PDF_SPARSE_TEXT_CHARS = int(os.getenv("PDF_SPARSE_TEXT_CHARS", "100"))
+PDF_SCAN_IMAGE_COVERAGE = float(os.getenv("PDF_SCAN_IMAGE_COVERAGE", "0.5"))
+
+# Image OCR: frames are decoded one at a time and reduced to at most IMAGE_MAX_PIXELS, then
+# OCR'd in strips of IMAGE_OCR_STRIP_HEIGHT rows. Frames still larger than IMAGE_MAX_DECODE_PIXELS
+# at the scale they decode at (JPEG can be decoded at up to 1/8 scale) are refused.
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "12000000"))
+IMAGE_OCR_STRIP_HEIGHT = int(os.getenv("IMAGE_OCR_STRIP_HEIGHT", "2000"))
+IMAGE_MAX_DECODE_PIXELS = int(os.getenv("IMAGE_MAX_DECODE_PIXELS", "100000000"))
+IMAGE_MAX_FRAMES = int(os.getenv("IMAGE_MAX_FRAMES", "200"))
+
+# File leases in Neo4j serialize ingest and deletion of a file across replicas: a lease expires
+# FILE_LEASE_TTL_SECONDS after its last renewal, and a request waits up to
+# FILE_LEASE_WAIT_SECONDS for a busy file before answering 409.
+FILE_LEASE_TTL_SECONDS = float(os.getenv("FILE_LEASE_TTL_SECONDS", "60"))
+FILE_LEASE_WAIT_SECONDS = float(os.getenv("FILE_LEASE_WAIT_SECONDS", "30"))
+FILE_LEASE_POLL_SECONDS = float(os.getenv("FILE_LEASE_POLL_SECONDS", "0.5"))
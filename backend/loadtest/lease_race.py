@@ -0,0 +1,298 @@
+"""Multi-process check of the file leases (services.leases).
+
+Lease mode starts worker processes that race for the lease on one file against the Neo4j in
+NEO4J_URI/NEO4J_USER/NEO4J_PASS. While holding it, each worker makes a fenced write and then
+releases the lease. Some rounds stall past the TTL without renewing, or abandon the lease
+without releasing it. The run then checks that:
+
+- every acquisition got a distinct token
+- no two live holders overlapped
+- a stalled holder's write was refused once a newer token existed
+- the probe saw exactly the accepted writes
+
+    python -m loadtest.lease_race --workers 8 --rounds 20 --ttl 2 --stall-every 7 --abandon-every 11
+
+Ingest mode sends concurrent uploads of different versions of one file to an app (e.g. uvicorn
+with --workers 4, or several replicas behind --base-url). It then checks that the file ended up
+with exactly one version's chunks, numbered 0..n-1:
+
+    python -m loadtest.lease_race --ingest --base-url http://127.0.0.1:8000 --uploads 8
+
+Exits non-zero when a check fails.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from loadtest.run import _VOCABULARY, _start, _wait_ready
+
+
+USER_ID = "lease-race"
+
+PROBE_QUERY = "lease_race_probe"
+CHUNKS_QUERY = "lease_race_chunks"
+CLEANUP_QUERY = "lease_race_cleanup"
+
+
+def _register() -> None:
+    from database.queries import register_query
+    from services.leases import LEASE_FENCE
+
+    register_query(
+        PROBE_QUERY,
+        """
+        WITH 1 AS ready
+        WHERE """
+        + LEASE_FENCE
+        + """
+        MERGE (p:LeaseRaceProbe {user_id: $user_id, filename: $filename})
+        SET p.token = $lease_token, p.writes = coalesce(p.writes, 0) + 1
+        RETURN p.writes AS writes
+        """,
+    )
+    register_query(
+        CHUNKS_QUERY,
+        """
+        MATCH (f:File {user_id: $user_id, filename: $filename})
+        OPTIONAL MATCH (f)-[:HAS_CHUNK]->(c:Chunk)
+        OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+        RETURN f.total_chunks AS total_chunks, c.chunk_index AS chunk_index,
+               coalesce(shared.text, c.text) AS text
+        """,
+    )
+    register_query(
+        CLEANUP_QUERY,
+        """
+        OPTIONAL MATCH (p:LeaseRaceProbe {user_id: $user_id, filename: $filename})
+        OPTIONAL MATCH (l:FileLease {user_id: $user_id, filename: $filename})
+        WITH collect(p) + collect(l) AS nodes, max(p.writes) AS writes
+        FOREACH (n IN nodes | DETACH DELETE n)
+        RETURN writes
+        """,
+    )
+
+
+def _worker(worker: int, args: argparse.Namespace, results: Any) -> None:
+    _register()
+    from database.queries import run_query
+    from services.leases import acquire_file_lease
+
+    for round_ in range(args.rounds):
+        n = worker * args.rounds + round_ + 1
+        stall = bool(args.stall_every) and n % args.stall_every == 0
+        abandon = bool(args.abandon_every) and n % args.abandon_every == 0
+        lease = acquire_file_lease(USER_ID, args.filename, ttl=args.ttl, wait=args.wait, heartbeat=not (stall or abandon))
+        started = time.time()
+        if stall:
+            time.sleep(args.ttl * 1.5)
+        wrote_at = time.time()
+        rows = run_query(
+            PROBE_QUERY,
+            {"user_id": USER_ID, "filename": args.filename, "lease_token": lease.token},
+        )
+        time.sleep(args.hold_ms / 1000)
+        ended = time.time()
+        if not abandon:
+            lease.release()
+        results.put(
+            {
+                "worker": worker,
+                "token": lease.token,
+                "started": started,
+                "wrote_at": wrote_at,
+                "ended": ended,
+                "accepted": bool(rows),
+                "stalled": stall,
+                "abandoned": abandon,
+            }
+        )
+
+
+def _check_leases(records: List[Dict[str, Any]], probe_writes: int) -> List[str]:
+    problems: List[str] = []
+    tokens = [r["token"] for r in records]
+    if len(set(tokens)) != len(tokens):
+        problems.append(f"duplicate tokens: {sorted(t for t in set(tokens) if tokens.count(t) > 1)}")
+
+    # Stalled holders are expected to overlap their successor; everyone else must not.
+    live = sorted((r for r in records if not r["stalled"]), key=lambda r: r["started"])
+    for previous, current in zip(live, live[1:]):
+        if current["started"] < previous["ended"]:
+            problems.append(f"tokens {previous['token']} and {current['token']} were held at the same time")
+
+    for r in records:
+        if not r["stalled"] or not r["accepted"]:
+            continue
+        newer = [o for o in records if o["token"] > r["token"] and o["started"] < r["wrote_at"]]
+        if newer:
+            problems.append(f"stalled token {r['token']} wrote after token {newer[0]['token']} was granted")
+
+    accepted = sum(r["accepted"] for r in records)
+    if probe_writes != accepted:
+        problems.append(f"probe saw {probe_writes} writes, workers report {accepted} accepted")
+    return problems
+
+
+def run_leases(args: argparse.Namespace) -> int:
+    _register()
+    from database.queries import run_query
+
+    run_query(CLEANUP_QUERY, {"user_id": USER_ID, "filename": args.filename})
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=_worker, args=(i, args, results)) for i in range(args.workers)]
+    started = time.monotonic()
+    for process in workers:
+        process.start()
+    expected = args.workers * args.rounds
+    records: List[Dict[str, Any]] = []
+    while len(records) < expected and (any(p.is_alive() for p in workers) or not results.empty()):
+        try:
+            records.append(results.get(timeout=1))
+        except queue.Empty:
+            pass
+    for process in workers:
+        process.join()
+    wall = time.monotonic() - started
+
+    rows = run_query(CLEANUP_QUERY, {"user_id": USER_ID, "filename": args.filename})
+    probe_writes = (rows[0]["writes"] if rows else 0) or 0
+    problems = _check_leases(records, probe_writes)
+    if len(records) != expected:
+        problems.append(f"{expected - len(records)} rounds did not finish (see worker output)")
+    print(
+        f"{len(records)} acquisitions by {args.workers} processes in {wall:.1f}s: "
+        f"{sum(r['accepted'] for r in records)} writes accepted, "
+        f"{sum(r['stalled'] and not r['accepted'] for r in records)} stalled writes fenced off, "
+        f"{sum(r['abandoned'] for r in records)} leases abandoned"
+    )
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    print("OK" if not problems else f"{len(problems)} problems")
+    return 1 if problems else 0
+
+
+def _versioned_document(version: int, size_bytes: int) -> bytes:
+    # Every sentence of version v carries its marker, so a mix of versions shows up in the chunks.
+    rng = random.Random(version)
+    sentences: List[str] = []
+    total = 0
+    while total < size_bytes:
+        sentence = " ".join(rng.choice(_VOCABULARY) for _ in range(12)).capitalize() + f" leaseversion{version}."
+        sentences.append(sentence)
+        total += len(sentence) + 1
+    return " ".join(sentences).encode("utf-8")
+
+
+async def _upload(client: httpx.AsyncClient, base_url: str, filename: str, version: int, size: int) -> str:
+    files = {"file": (filename, _versioned_document(version, size), "text/plain")}
+    try:
+        response = await client.post(f"{base_url}/knowledge-graph/ingest-text", files=files)
+        return str(response.status_code)
+    except httpx.HTTPError as e:
+        return type(e).__name__
+
+
+def run_ingest(args: argparse.Namespace) -> int:
+    _register()
+    from database.queries import run_query
+
+    base_url = args.base_url.rstrip("/")
+    filename = f"lease-race-{int(time.time())}.txt"
+
+    async def upload_all() -> List[str]:
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            return await asyncio.gather(
+                *(_upload(client, base_url, filename, v, int(args.doc_kb * 1024)) for v in range(args.uploads))
+            )
+
+    statuses = asyncio.run(upload_all())
+    rows = run_query(CHUNKS_QUERY, {"user_id": args.user_id, "filename": filename})
+    chunks = [r for r in rows if r["chunk_index"] is not None]
+    indexes = sorted(r["chunk_index"] for r in chunks)
+    versions = {
+        word.rstrip(".") for r in chunks for word in (r["text"] or "").split() if word.startswith("leaseversion")
+    }
+
+    problems: List[str] = []
+    if "200" not in statuses:
+        problems.append(f"no upload succeeded: {statuses}")
+    if indexes != list(range(len(indexes))):
+        problems.append(f"chunk indexes are not 0..{len(indexes) - 1}: duplicates or gaps")
+    if len(versions) > 1:
+        problems.append(f"chunks from several versions: {sorted(versions)}")
+    if rows and rows[0]["total_chunks"] != len(chunks):
+        problems.append(f"File.total_chunks is {rows[0]['total_chunks']}, found {len(chunks)} chunks")
+
+    print(f"{args.uploads} concurrent uploads of {filename}: statuses {sorted(statuses)}; {len(chunks)} chunks")
+    if not args.keep_data:
+        httpx.delete(f"{base_url}/knowledge-graph/files", params={"filename": filename}, timeout=args.timeout)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    print("OK" if not problems else f"{len(problems)} problems")
+    return 1 if problems else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=6, help="worker processes (lease mode)")
+    parser.add_argument("--rounds", type=int, default=20, help="acquisitions per worker")
+    parser.add_argument("--ttl", type=float, default=2.0, help="lease TTL in seconds")
+    parser.add_argument("--wait", type=float, default=120.0, help="how long a worker waits for the lease")
+    parser.add_argument("--hold-ms", type=float, default=20.0)
+    parser.add_argument("--stall-every", type=int, default=7, help="every Nth round stalls past the TTL (0: never)")
+    parser.add_argument("--abandon-every", type=int, default=11, help="every Nth round never releases (0: never)")
+    parser.add_argument("--filename", default="lease-race.txt")
+    parser.add_argument("--ingest", action="store_true", help="race concurrent uploads through the app instead")
+    parser.add_argument("--base-url", help="app to upload to (ingest mode); started with --app-workers when omitted")
+    parser.add_argument("--app-workers", type=int, default=4)
+    parser.add_argument("--app-port", type=int, default=8766)
+    parser.add_argument("--stub-port", type=int, default=11436)
+    parser.add_argument("--user-id", default="guest-user", help="user the app ingests as (ingest mode)")
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--doc-kb", type=float, default=40.0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--keep-data", action="store_true")
+    args = parser.parse_args()
+
+    if not args.ingest:
+        sys.exit(run_leases(args))
+
+    processes = []
+    try:
+        if not args.base_url:
+            stub_url = f"http://127.0.0.1:{args.stub_port}"
+            processes.append(_start([sys.executable, "-m", "loadtest.stub_ollama", "--port", str(args.stub_port)], {}))
+            _wait_ready(stub_url)
+            processes.append(
+                _start(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port),
+                     "--workers", str(args.app_workers)],
+                    {"EMBEDDINGS_PROVIDER": "ollama", "OLLAMA_BASE_URL": stub_url, "PREWARM_QUERIES": "false"},
+                )
+            )
+            args.base_url = f"http://127.0.0.1:{args.app_port}"
+            _wait_ready(f"{args.base_url}/health/db")
+        code = run_ingest(args)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
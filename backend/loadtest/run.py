@@ -0,0 +1,262 @@
+"""Load test: how many concurrent QA/ingest users can one backend replica take?
+
+Starts the Ollama stand-in and the FastAPI app (against the Neo4j in NEO4J_URI/NEO4J_USER/
+NEO4J_PASS), then runs closed-loop users issuing a weighted mix of /ingest-text, /qa and
+/graph requests at each concurrency level, and reports throughput, latency percentiles and
+error rates per level and operation.
+
+    python -m loadtest.run --levels 1,4,16,32 --duration 60 --mix ingest=1,qa=6,graph=3
+
+Use --base-url to drive an app that is already running (it must point at a stub or a real
+Ollama itself). Files ingested by the run are named loadtest-*.txt and deleted afterwards.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_VOCABULARY = (
+    "graph chunk vector index neo4j embedding retrieval query latency throughput replica "
+    "pipeline batch document section answer source model token context budget cache plan "
+    "ingest upload tenant user file page image text search score rank fusion keyword entity"
+).split()
+
+
+def _document(size_bytes: int, rng: random.Random) -> bytes:
+    words: List[str] = []
+    total = 0
+    while total < size_bytes:
+        sentence = " ".join(rng.choice(_VOCABULARY) for _ in range(rng.randint(8, 20))).capitalize() + "."
+        words.append(sentence)
+        total += len(sentence) + 1
+    return " ".join(words).encode("utf-8")
+
+
+def _question(rng: random.Random) -> str:
+    return "What does the document say about " + " and ".join(rng.sample(_VOCABULARY, 3)) + "?"
+
+
+def _percentile(values: List[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+
+    def record(self, op: str, seconds: float, status: str) -> None:
+        self.statuses.setdefault(op, {}).setdefault(status, 0)
+        self.statuses[op][status] += 1
+        if status == "ok":
+            self.latencies.setdefault(op, []).append(seconds)
+
+    def report(self, wall: float) -> Dict[str, Any]:
+        ops = {}
+        for op, statuses in sorted(self.statuses.items()):
+            total = sum(statuses.values())
+            latencies = self.latencies.get(op, [])
+            ops[op] = {
+                "requests": total,
+                "ok": statuses.get("ok", 0),
+                "throughput_rps": round(statuses.get("ok", 0) / wall, 2),
+                "error_rate": round(1 - statuses.get("ok", 0) / total, 4) if total else 0.0,
+                "statuses": statuses,
+            }
+            for p in (50, 90, 99):
+                value = _percentile(latencies, p)
+                ops[op][f"p{p}_ms"] = round(value * 1000, 1) if value is not None else None
+        total = sum(o["requests"] for o in ops.values())
+        ok = sum(o["ok"] for o in ops.values())
+        return {
+            "wall_seconds": round(wall, 2),
+            "requests": total,
+            "throughput_rps": round(ok / wall, 2),
+            "error_rate": round(1 - ok / total, 4) if total else 0.0,
+            "operations": ops,
+        }
+
+
+class LoadTest:
+    def __init__(self, base_url: str, mix: Dict[str, float], doc_bytes: int, timeout: float, seed: int):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.doc_bytes = doc_bytes
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.ingested: List[str] = []
+
+    async def _call(self, client: httpx.AsyncClient, op: str) -> httpx.Response:
+        kg = f"{self.base_url}/knowledge-graph"
+        if op == "ingest":
+            filename = f"loadtest-{self.rng.getrandbits(48):012x}.txt"
+            self.ingested.append(filename)
+            files = {"file": (filename, _document(self.doc_bytes, self.rng), "text/plain")}
+            return await client.post(f"{kg}/ingest-text", files=files)
+        if op == "qa":
+            return await client.post(f"{kg}/qa", params={"question": _question(self.rng)})
+        if op == "graph":
+            return await client.get(f"{kg}/graph")
+        raise ValueError(f"Unknown operation: {op}")
+
+    async def _user(self, client: httpx.AsyncClient, deadline: float, recorder: Recorder) -> None:
+        ops, weights = zip(*self.mix.items())
+        while time.monotonic() < deadline:
+            op = self.rng.choices(ops, weights)[0]
+            started = time.monotonic()
+            try:
+                response = await self._call(client, op)
+                status = "ok" if response.is_success else str(response.status_code)
+            except httpx.TimeoutException:
+                status = "timeout"
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            recorder.record(op, time.monotonic() - started, status)
+
+    async def run_level(self, concurrency: int, duration: float) -> Dict[str, Any]:
+        recorder = Recorder()
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            started = time.monotonic()
+            deadline = started + duration
+            await asyncio.gather(*(self._user(client, deadline, recorder) for _ in range(concurrency)))
+            wall = time.monotonic() - started
+        return {"concurrency": concurrency, **recorder.report(wall)}
+
+    async def seed(self, files: int) -> None:
+        # QA and graph requests need something to read before the first level starts.
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            for _ in range(files):
+                response = await self._call(client, "ingest")
+                response.raise_for_status()
+
+    async def cleanup(self) -> int:
+        deleted = 0
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            for filename in self.ingested:
+                try:
+                    response = await client.delete(f"{self.base_url}/knowledge-graph/files", params={"filename": filename})
+                    deleted += int(response.is_success)
+                except httpx.HTTPError:
+                    pass
+        return deleted
+
+
+def _start(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(args, cwd=BACKEND_DIR, env={**os.environ, **env})
+
+
+def _wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).is_success:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def _ms(value: float | None) -> str:
+    return "-" if value is None else f"{value:.0f}"
+
+
+def _print_level(result: Dict[str, Any]) -> None:
+    print(
+        f"\nconcurrency={result['concurrency']}  requests={result['requests']}  "
+        f"throughput={result['throughput_rps']}/s  errors={result['error_rate']:.2%}"
+    )
+    print(f"  {'op':<8}{'ok':>7}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'errors':>9}  statuses")
+    for op, o in result["operations"].items():
+        print(
+            f"  {op:<8}{o['ok']:>7}{o['throughput_rps']:>9}{_ms(o['p50_ms']):>10}{_ms(o['p90_ms']):>10}"
+            f"{_ms(o['p99_ms']):>10}{o['error_rate']:>9.2%}  {o['statuses']}"
+        )
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        op, _, weight = part.partition("=")
+        mix[op.strip()] = float(weight or 1)
+    unknown = set(mix) - {"ingest", "qa", "graph"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown operations: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,2,4,8,16", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per level")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("ingest=1,qa=6,graph=3"))
+    parser.add_argument("--doc-kb", type=float, default=20.0, help="size of each ingested document")
+    parser.add_argument("--seed-files", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--base-url", help="drive an already running app instead of starting one")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--stub-port", type=int, default=11435)
+    parser.add_argument("--stub-args", default="", help="extra arguments for loadtest.stub_ollama, e.g. '--embed-ms 50'")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep-data", action="store_true", help="do not delete the loadtest-* files afterwards")
+    parser.add_argument("--random-seed", type=int, default=0)
+    args = parser.parse_args()
+
+    processes: List[subprocess.Popen] = []
+    base_url = args.base_url
+    try:
+        if not base_url:
+            stub_url = f"http://127.0.0.1:{args.stub_port}"
+            processes.append(
+                _start([sys.executable, "-m", "loadtest.stub_ollama", "--port", str(args.stub_port), *args.stub_args.split()], {})
+            )
+            _wait_ready(stub_url)
+            processes.append(
+                _start(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port)],
+                    {"EMBEDDINGS_PROVIDER": "ollama", "OLLAMA_BASE_URL": stub_url, "PREWARM_QUERIES": "false"},
+                )
+            )
+            base_url = f"http://127.0.0.1:{args.app_port}"
+            _wait_ready(f"{base_url}/health/db")
+
+        test = LoadTest(base_url, args.mix, int(args.doc_kb * 1024), args.timeout, args.random_seed)
+        asyncio.run(test.seed(args.seed_files))
+        results = []
+        for level in [int(x) for x in args.levels.split(",") if x.strip()]:
+            result = asyncio.run(test.run_level(level, args.duration))
+            results.append(result)
+            _print_level(result)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"base_url": base_url, "mix": args.mix, "levels": results}, f, indent=2)
+        if not args.keep_data:
+            deleted = asyncio.run(test.cleanup())
+            print(f"\nDeleted {deleted} of {len(test.ingested)} loadtest files")
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Stand-in for an Ollama server, for load tests.
+
+Implements the endpoints the backend uses (/api/embed and /api/chat, streaming or not) with
+configurable latency, so the app runs unchanged with OLLAMA_BASE_URL pointing here.
+Embeddings are deterministic hashed bags of words: texts sharing words get similar vectors,
+which keeps retrieval and similarity thresholds meaningful.
+
+    python -m loadtest.stub_ollama --port 11435 --embed-ms 20 --chat-first-token-ms 300
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+_WORD = re.compile(r"\w+")
+
+settings: Dict[str, Any] = {
+    "dims": 768,
+    "embed_ms": 20.0,
+    "embed_ms_per_text": 2.0,
+    "chat_first_token_ms": 300.0,
+    "chat_token_ms": 15.0,
+    "chat_tokens": 60,
+    "jitter": 0.2,
+    "error_rate": 0.0,
+}
+stats: Dict[str, int] = {"embed_requests": 0, "embedded_texts": 0, "chat_requests": 0, "errors": 0}
+
+app = FastAPI()
+
+
+def _delay(ms: float) -> float:
+    jitter = settings["jitter"]
+    return max(0.0, ms * (1 + random.uniform(-jitter, jitter)) / 1000.0)
+
+
+def _fail() -> bool:
+    if settings["error_rate"] and random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        return True
+    return False
+
+
+def embed(text: str, dims: int) -> List[float]:
+    vector = [0.0] * dims
+    for word in _WORD.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dims
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+@app.get("/")
+async def root():
+    return "Ollama is running"
+
+
+@app.get("/api/version")
+async def version():
+    return {"version": "0.0.0-stub"}
+
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": []}
+
+
+@app.get("/stub/stats")
+async def stub_stats():
+    return {**stats, "settings": settings}
+
+
+@app.post("/api/embed")
+async def api_embed(request: Request):
+    body = await request.json()
+    texts = body.get("input") or []
+    if isinstance(texts, str):
+        texts = [texts]
+    await asyncio.sleep(_delay(settings["embed_ms"] + settings["embed_ms_per_text"] * len(texts)))
+    if _fail():
+        return JSONResponse({"error": "stub failure"}, status_code=500)
+    stats["embed_requests"] += 1
+    stats["embedded_texts"] += len(texts)
+    return {
+        "model": body.get("model", "stub"),
+        "embeddings": [embed(t, settings["dims"]) for t in texts],
+        "total_duration": 0,
+        "load_duration": 0,
+        "prompt_eval_count": sum(len(t) // 4 for t in texts),
+    }
+
+
+def _answer(messages: List[Dict[str, Any]]) -> List[str]:
+    prompt = " ".join(str(m.get("content", "")) for m in messages)
+    words = _WORD.findall(prompt)[-200:] or ["stub"]
+    rng = random.Random(len(prompt))
+    tokens = [rng.choice(words) + " " for _ in range(settings["chat_tokens"])]
+    return tokens + ["\nSOURCES: stub"]
+
+
+def _chunk(model: str, content: str, done: bool, count: int = 0) -> str:
+    message: Dict[str, Any] = {
+        "model": model,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "message": {"role": "assistant", "content": content},
+        "done": done,
+    }
+    if done:
+        message.update(done_reason="stop", total_duration=0, load_duration=0, prompt_eval_count=0, eval_count=count)
+    return json.dumps(message) + "\n"
+
+
+@app.post("/api/chat")
+async def api_chat(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub")
+    tokens = _answer(body.get("messages") or [])
+    stats["chat_requests"] += 1
+    await asyncio.sleep(_delay(settings["chat_first_token_ms"]))
+    if _fail():
+        return JSONResponse({"error": "stub failure"}, status_code=500)
+
+    if not body.get("stream", True):
+        await asyncio.sleep(_delay(settings["chat_token_ms"] * len(tokens)))
+        return JSONResponse(json.loads(_chunk(model, "".join(tokens), True, len(tokens))))
+
+    async def stream():
+        for token in tokens:
+            yield _chunk(model, token, False)
+            await asyncio.sleep(_delay(settings["chat_token_ms"]))
+        yield _chunk(model, "", True, len(tokens))
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dims", type=int, default=settings["dims"])
+    parser.add_argument("--embed-ms", type=float, default=settings["embed_ms"], help="latency per /api/embed call")
+    parser.add_argument("--embed-ms-per-text", type=float, default=settings["embed_ms_per_text"])
+    parser.add_argument("--chat-first-token-ms", type=float, default=settings["chat_first_token_ms"])
+    parser.add_argument("--chat-token-ms", type=float, default=settings["chat_token_ms"])
+    parser.add_argument("--chat-tokens", type=int, default=settings["chat_tokens"])
+    parser.add_argument("--jitter", type=float, default=settings["jitter"], help="relative latency jitter, e.g. 0.2")
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"])
+    args = parser.parse_args()
+    settings.update({k: v for k, v in vars(args).items() if k in settings})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
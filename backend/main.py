@@ -2,7 +2,7 @@
 from fastapi import FastAPI
 # import database.tables as tables
 # from database.postgres import engine
-from routers import notify, ping , knowledge_graph
+from routers import notify, ping , knowledge_graph, admin
 from routers import embeddings as embeddings_router
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
@@ -12,16 +12,50 @@ from environment import FRONTEND_URL
 from logger import setup_logger
 logger = setup_logger(__name__)
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from contextlib import asynccontextmanager
+import threading
+import environment
+from services.profiling import finish_profile, profile_decision, start_profile
+from database.queries import prewarm
+from services.reembedding import resume_migrations
 from routers.notify import bot, TOKEN
 
-app = FastAPI(host="0.0.0.0", port=8000)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if environment.PREWARM_QUERIES:
+        # Compile query plans in the background; startup must not wait for Neo4j.
+        threading.Thread(target=prewarm, name="prewarm-queries", daemon=True).start()
+    threading.Thread(target=resume_migrations, name="resume-reembedding", daemon=True).start()
+    yield
+
+
+app = FastAPI(host="0.0.0.0", port=8000, lifespan=lifespan)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    if request.url.path.startswith("/admin"):
+        return await call_next(request)
+    profiled, plans, reason = profile_decision(request.headers.get("x-profile"))
+    if not profiled:
+        return await call_next(request)
+    profile, token, sampler = start_profile(request.method, request.url.path, plans, reason)
+    status_code = None
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Profile-Id"] = profile.profile_id
+        return response
+    finally:
+        finish_profile(profile, token, sampler, status_code)
+
 
 app.include_router(ping.router, tags=["ping"])
 app.include_router(knowledge_graph.router, prefix=f"/knowledge-graph", tags=[f"knowledge-graph"])
 app.include_router(embeddings_router.router, prefix="/embeddings", tags=["embeddings"]) 
 app.include_router(notify.router, prefix="/notify", tags=["notify"])
+app.include_router(admin.router, prefix="/admin", tags=["admin"])
 
 origins = [
     FRONTEND_URL
@@ -33,4 +67,6 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Response headers the frontend reads; browsers hide non-safelisted ones cross-origin.
+    expose_headers=["X-Total-Count", "Retry-After", "X-Profile-Id"],
 )
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from database.queries import (
+    collect_server_query_stats,
+    prewarm,
+    query_text_stats,
+    registered_queries,
+    server_query_stats,
+    slow_query_log,
+)
+from services.admission import AdmissionRejected, ingest_admission, run_ingest
+from services.leases import LeaseBusy, active_leases
+from services.tenant_transfer import export_tenant, import_tenant
+from services.profiling import get_profile, recent_profiles
+from services.statistics import rebuild_statistics
+from services.retention import apply_retention, delete_user as svc_delete_user, deletion_job, deletion_jobs
+
+
+router = APIRouter()
+
+
+@router.get("/queries")
+async def list_queries():
+    return {"queries": registered_queries()}
+
+
+@router.post("/queries/prewarm")
+async def prewarm_queries():
+    try:
+        return await run_in_threadpool(prewarm)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prewarm error: {str(e)}")
+
+
+@router.get("/query-cache")
+async def query_cache(server: bool = Query(False), min_invocations: int = Query(2, ge=1)):
+    response = {"client": query_text_stats.snapshot()}
+    if server:
+        try:
+            response["server"] = await run_in_threadpool(server_query_stats, min_invocations)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Query stats error: {str(e)}")
+    return response
+
+
+@router.post("/query-cache/collect")
+async def collect_query_cache(duration_seconds: int = Query(300, ge=10, le=3600)):
+    try:
+        return await run_in_threadpool(collect_server_query_stats, duration_seconds)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query stats error: {str(e)}")
+
+
+@router.delete("/users/{user_id}", status_code=202)
+async def delete_user(user_id: str):
+    try:
+        return await run_in_threadpool(svc_delete_user, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Delete user error: {str(e)}")
+
+
+@router.post("/retention", status_code=202)
+async def retention(max_age_days: int = Query(..., ge=1), user_id: str = Query(None)):
+    try:
+        return await run_in_threadpool(apply_retention, max_age_days, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Retention error: {str(e)}")
+
+
+@router.get("/deletions")
+async def list_deletions():
+    return {"jobs": deletion_jobs()}
+
+
+@router.get("/deletions/{job_id}")
+async def get_deletion(job_id: str):
+    job = deletion_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Deletion job not found: {job_id}")
+    return job
+
+
+@router.post("/statistics/rebuild")
+async def statistics_rebuild(user_id: str = Query(None)):
+    try:
+        return await run_in_threadpool(rebuild_statistics, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Statistics rebuild error: {str(e)}")
+
+
+@router.get("/slow-queries")
+async def slow_queries(limit: int = Query(100, ge=1, le=1000)):
+    return slow_query_log.snapshot(limit)
+
+
+@router.delete("/slow-queries")
+async def clear_slow_queries():
+    slow_query_log.clear()
+    return {"status": "cleared"}
+
+
+@router.get("/leases")
+async def leases(user_id: str = Query(None)):
+    try:
+        return {"leases": await run_in_threadpool(active_leases, user_id)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Leases error: {str(e)}")
+
+
+@router.get("/profiles")
+async def list_profiles():
+    return {"profiles": recent_profiles()}
+
+
+@router.get("/profiles/{profile_id}")
+async def profile_detail(profile_id: str):
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return profile
+
+
+@router.get("/users/{user_id}/export")
+async def export_user(user_id: str):
+    fd, path = tempfile.mkstemp(prefix="tenant-", suffix=".tar")
+    os.close(fd)
+    try:
+        await run_in_threadpool(export_tenant, user_id, path)
+    except Exception as e:
+        os.remove(path)
+        raise HTTPException(status_code=500, detail=f"Export error: {str(e)}")
+    return FileResponse(
+        path,
+        media_type="application/x-tar",
+        filename=f"{user_id}.tenant.tar",
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+@router.post("/users/{user_id}/import")
+async def import_user(user_id: str, file: UploadFile = File(...)):
+    fd, path = tempfile.mkstemp(prefix="tenant-", suffix=".tar")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            await run_in_threadpool(shutil.copyfileobj, file.file, out)
+        async with ingest_admission.admit():
+            return await run_ingest(import_tenant, user_id, path)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except LeaseBusy as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Import error: {str(e)}")
+    finally:
+        os.remove(path)
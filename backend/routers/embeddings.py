@@ -1,6 +1,14 @@
 from fastapi import APIRouter, Body, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
 import environment
-from services.embeddings import embed_text, embedding_dimension
+from services.embeddings import (
+    embed_text,
+    embedding_dimension,
+    embedding_stats,
+    native_embedding_dimension,
+    storage_mode,
+)
+from services.reembedding import migration_status, pause_migration, start_migration
 
 
 router = APIRouter()
@@ -20,7 +28,7 @@ async def test_embedding(
         model = (
             environment.OLLAMA_EMBEDDING_MODEL if provider == "ollama" else environment.OPENAI_EMBEDDING_MODEL
         )
-        expected_dim = embedding_dimension()
+        expected_dim = native_embedding_dimension()
         actual_dim = len(vector) if vector else 0
 
         response = {
@@ -30,6 +38,8 @@ async def test_embedding(
             "expected_dimension": expected_dim,
             "actual_dimension": actual_dim,
             "dimension_matches": actual_dim == expected_dim,
+            "storage_mode": storage_mode(),
+            "index_dimension": embedding_dimension(),
             "sample": vector[:8] if vector else [],
         }
         if include_vector:
@@ -41,3 +51,36 @@ async def test_embedding(
         raise HTTPException(status_code=500, detail=f"Embedding generation failed: {str(e)}")
 
 
+@router.get("/stats")
+async def stats():
+    try:
+        return embedding_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Embedding stats error: {str(e)}")
+
+
+@router.get("/migration")
+async def migration():
+    try:
+        return await run_in_threadpool(migration_status)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Re-embedding status error: {str(e)}")
+
+
+@router.post("/migration/start")
+async def migration_start():
+    try:
+        return await run_in_threadpool(start_migration)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Re-embedding start error: {str(e)}")
+
+
+@router.post("/migration/pause")
+async def migration_pause():
+    try:
+        # Waits up to 30 s for the running batch to finish.
+        return await run_in_threadpool(pause_migration)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Re-embedding pause error: {str(e)}")
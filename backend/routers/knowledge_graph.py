@@ -1,22 +1,45 @@
-from fastapi import Query, APIRouter, HTTPException, UploadFile, File, Body
+from fastapi import Query, APIRouter, HTTPException, UploadFile, File, Body, Response
+from starlette.concurrency import run_in_threadpool
 from services.knowledge_graph import (
     list_files as svc_list_files,
     ingest_text_file as svc_ingest_text_file,
     ingest_url as svc_ingest_url,
     get_graph as svc_get_graph,
     ask_question as svc_ask_question,
+    ask_questions as svc_ask_questions,
+    embedding_storage_report as svc_embedding_storage_report,
 )
+from services.admission import AdmissionRejected, ingest_admission, run_ingest
+from services.leases import LeaseBusy
+from services.pipeline import recent_pipeline_runs
+from services.retention import delete_file as svc_delete_file
+from services.statistics import FILE_SORT_FIELDS, user_statistics
+from services.similarity import related_chunks as svc_related_chunks, schedule_similarity, similarity_status
 
 
 router = APIRouter()
 
 DEFAULT_USER_ID = "guest-user"
 
+
+def _rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _busy(e: LeaseBusy) -> HTTPException:
+    return HTTPException(status_code=409, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
 @router.post("/ingest-text")
 async def ingest_text(file: UploadFile = File(...)):
     try:
-        contents = await file.read()
-        return svc_ingest_text_file(DEFAULT_USER_ID, file.filename, contents)
+        async with ingest_admission.admit():
+            contents = await file.read()
+            return await run_ingest(svc_ingest_text_file, DEFAULT_USER_ID, file.filename, contents)
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except LeaseBusy as e:
+        raise _busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ingest error: {str(e)}")
 
@@ -24,34 +47,155 @@ async def ingest_text(file: UploadFile = File(...)):
 @router.post("/ingest-url")
 async def ingest_url(url: str = Body(..., embed=True)):
     try:
-        return await svc_ingest_url(DEFAULT_USER_ID, url)
+        async with ingest_admission.admit():
+            return await svc_ingest_url(DEFAULT_USER_ID, url)
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except LeaseBusy as e:
+        raise _busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ingest URL error: {str(e)}")
 
 
+@router.get("/ingest/admission")
+async def ingest_admission_stats():
+    return ingest_admission.stats()
+
+
+@router.get("/ingest/pipeline-stats")
+async def ingest_pipeline_stats():
+    try:
+        return {"runs": recent_pipeline_runs()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Pipeline stats error: {str(e)}")
+
+
 @router.post("/qa")
 async def qa_endpoint(
     question: str = Query(...),
     filenames: list = Query(None),
+    mode: str = Query(None, description="vector | hybrid | prefilter | entity"),
+    k: int = Query(None, ge=1, le=50, description="chunks kept for the answer (QA_TOP_K)"),
+    mmr_lambda: float = Query(None, ge=0, le=1, description="1 = relevance only, lower = more diverse"),
 ):
     if not question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty")
     try:
-        return svc_ask_question(user_id=DEFAULT_USER_ID, question=question, filenames=filenames)
+        return await run_in_threadpool(
+            svc_ask_question,
+            user_id=DEFAULT_USER_ID,
+            question=question,
+            filenames=filenames,
+            mode=mode,
+            k=k,
+            mmr_lambda=mmr_lambda,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"QA error: {str(e)}")
 
+@router.post("/qa/batch")
+async def qa_batch_endpoint(
+    questions: list = Body(..., embed=True),
+    filenames: list = Body(None, embed=True),
+):
+    if not questions:
+        raise HTTPException(status_code=400, detail="Questions cannot be empty")
+    try:
+        return await run_in_threadpool(
+            svc_ask_questions, user_id=DEFAULT_USER_ID, questions=questions, filenames=filenames
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch QA error: {str(e)}")
+
 @router.get("/files")
-async def list_files():
+async def list_files(
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    sort: str = Query("filename"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+):
+    if sort not in FILE_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(FILE_SORT_FIELDS)}")
     try:
-        return svc_list_files(DEFAULT_USER_ID)
+        files = await run_in_threadpool(svc_list_files, DEFAULT_USER_ID, offset, limit, sort, order == "desc")
+        stats = await run_in_threadpool(user_statistics, DEFAULT_USER_ID)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"List files error: {str(e)}")
+    # The body stays a plain list for existing clients; the total is a header.
+    response.headers["X-Total-Count"] = str(stats["file_count"])
+    return files
+
+
+@router.get("/statistics")
+async def statistics():
+    try:
+        return await run_in_threadpool(user_statistics, DEFAULT_USER_ID)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Statistics error: {str(e)}")
+
+
+@router.delete("/files", status_code=202)
+async def delete_file(filename: str = Query(...)):
+    try:
+        job = await run_in_threadpool(svc_delete_file, DEFAULT_USER_ID, filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Delete file error: {str(e)}")
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+    return job
 
 
 @router.get("/graph")
 async def get_graph():
     try:
-        return svc_get_graph(DEFAULT_USER_ID)
+        return await run_in_threadpool(svc_get_graph, DEFAULT_USER_ID)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Graph error: {str(e)}")
+
+
+@router.get("/chunks/{chunk_id}/related")
+async def related_chunks(chunk_id: str, limit: int = Query(10, ge=1, le=100)):
+    try:
+        related = await run_in_threadpool(svc_related_chunks, DEFAULT_USER_ID, chunk_id, limit)
+        return {"chunk_id": chunk_id, "related": related, "total": len(related)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Related chunks error: {str(e)}")
+
+
+@router.get("/similarity")
+async def similarity():
+    return similarity_status()
+
+
+@router.post("/similarity/rebuild")
+async def similarity_rebuild():
+    try:
+        scheduled = await run_in_threadpool(schedule_similarity, DEFAULT_USER_ID, None, True)
+        return {"status": "scheduled" if scheduled else "disabled", **similarity_status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Similarity rebuild error: {str(e)}")
+
+
+@router.post("/embedding-storage/report")
+async def embedding_storage_report(
+    questions: list = Body(None, embed=True),
+    sample_size: int = Query(500, ge=1, le=5000),
+    k: int = Query(10, ge=1, le=100),
+    dims: list = Query(None),
+):
+    try:
+        return await run_in_threadpool(
+            svc_embedding_storage_report,
+            DEFAULT_USER_ID,
+            questions=questions,
+            sample_size=sample_size,
+            k=k,
+            dims=[int(d) for d in dims] if dims else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Storage report error: {str(e)}")
@@ -1,18 +1,10 @@
 from fastapi import APIRouter, HTTPException
+from starlette.concurrency import run_in_threadpool
 import time
-from database.neo import get_neo4j_connection
+from database.neo import get_kg
 
 router = APIRouter()
 
-# Lazy connection - only connect when needed
-_kg_connection = None
-
-def get_kg():
-    global _kg_connection
-    if _kg_connection is None:
-        _kg_connection = get_neo4j_connection()
-    return _kg_connection
-
 @router.get("/")
 async def root():
     return {"message": "Hello! Goto /docs for swagger"}
@@ -25,7 +17,7 @@ async def root():
 async def health_db():
     start = time.time()
     try:
-        res = get_kg().query("RETURN 1 AS ok")
+        res = await run_in_threadpool(lambda: get_kg().query("RETURN 1 AS ok"))
         latency_ms = int((time.time() - start) * 1000)
         return {"status": "ok", "neo4j": "up", "latency_ms": latency_ms, "result": res}
     except Exception as e:
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict
+
+import environment
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted. status_code is 429 when the wait queue is
+    full and 503 when a queued request timed out; retry_after is in seconds."""
+
+    def __init__(self, status_code: int, retry_after: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Caps concurrent work of one kind, with a bounded wait queue.
+
+    Up to max_in_flight requests run at once and up to max_queue more wait, each for at most
+    queue_timeout seconds. Anything beyond that is rejected straight away, so callers get a
+    fast answer with a Retry-After estimate instead of piling up on the worker.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._semaphore: asyncio.Semaphore | None = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.avg_duration = 0.0
+
+    def _retry_after(self) -> int:
+        # Time for the work ahead of a new arrival to drain, from the average duration so far.
+        per_slot = self.avg_duration or 5.0
+        return max(1, math.ceil(per_slot * (self.waiting + 1) / self.max_in_flight))
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise AdmissionRejected(429, self._retry_after(), f"Too many {self.name} requests in progress")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise AdmissionRejected(503, self._retry_after(), f"Timed out waiting for a {self.name} slot")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            duration = time.monotonic() - started
+            self.avg_duration = duration if not self.avg_duration else 0.8 * self.avg_duration + 0.2 * duration
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_duration_seconds": round(self.avg_duration, 3),
+            "retry_after_seconds": self._retry_after(),
+        }
+
+
+ingest_admission = AdmissionController(
+    "ingest",
+    environment.INGEST_MAX_IN_FLIGHT,
+    environment.INGEST_MAX_QUEUE,
+    environment.INGEST_QUEUE_TIMEOUT_SECONDS,
+)
+
+# Parsing, OCR, splitting and the blocking Neo4j/embedding calls of an ingest run here, off
+# the event loop and off the shared threadpool that serves QA and health checks.
+_INGEST_EXECUTOR = ThreadPoolExecutor(
+    max_workers=max(1, environment.INGEST_MAX_IN_FLIGHT), thread_name_prefix="ingest"
+)
+
+
+async def run_ingest(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    # run_in_executor does not carry context variables over (e.g. the request profile).
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_INGEST_EXECUTOR, functools.partial(context.run, fn, *args, **kwargs))
+
+
+__all__ = [
+    "AdmissionController",
+    "AdmissionRejected",
+    "ingest_admission",
+    "run_ingest",
+]
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import hashlib
+from typing import List
+
+import environment
+from database.queries import register_query, run_query
+
+
+# With CHUNK_DEDUP, a Chunk keeps its position (file, index, section, NEXT edges) and points
+# at a ChunkContent node, keyed by the hash of its text, that holds the text and vectors:
+#
+#   (:File)-[:HAS_CHUNK]->(:Chunk)-[:HAS_CONTENT]->(:ChunkContent {hash, text, textEmbedding...})
+#
+# Readers take the text and vectors from the content node when there is one, otherwise from
+# the chunk itself, so both layouts can coexist in one database.
+CONTENT_FULLTEXT_INDEX_NAME = "pdf_chunk_contents_text"
+
+
+def dedup_enabled() -> bool:
+    return environment.CHUNK_DEDUP
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def text_of(var: str) -> str:
+    """Cypher expression for the text of the chunk bound to var, in either layout."""
+    return f"coalesce(head([({var})-[:HAS_CONTENT]->(x:ChunkContent) | x.text]), {var}.text)"
+
+
+REMOVE_ORPHAN_CONTENT = register_query(
+    "remove_orphan_content",
+    """
+    UNWIND $hashes AS hash
+    MATCH (t:ChunkContent {hash: hash})
+    WHERE NOT (t)<-[:HAS_CONTENT]-(:Chunk)
+    DELETE t
+    RETURN count(t) AS removed
+    """,
+)
+
+
+def remove_orphan_content(hashes: List[str]) -> int:
+    """Delete content nodes no chunk references any more (run after chunks are replaced or deleted)."""
+    removed = 0
+    batch_size = max(1, environment.DELETE_BATCH_SIZE)
+    for i in range(0, len(hashes), batch_size):
+        rows = run_query(REMOVE_ORPHAN_CONTENT, {"hashes": hashes[i : i + batch_size]})
+        removed += rows[0]["removed"] if rows else 0
+    return removed
+
+
+__all__ = [
+    "CONTENT_FULLTEXT_INDEX_NAME",
+    "dedup_enabled",
+    "content_hash",
+    "text_of",
+    "remove_orphan_content",
+]
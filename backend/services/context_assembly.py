@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+import environment
+from database.neo import get_kg
+from database.queries import register_query, run_query
+from services.chunk_content import text_of
+from services.embedding_scheduler import estimate_tokens
+
+
+# Chunks are split with a 400 character overlap; look a little further to be safe.
+MAX_OVERLAP_CHARS = 600
+MIN_OVERLAP_CHARS = 16
+GAP_MARKER = " … "
+
+
+def overlap_length(left: str, right: str, max_overlap: int = MAX_OVERLAP_CHARS) -> int:
+    """Length of the longest suffix of left that is also a prefix of right."""
+    for n in range(min(len(left), len(right), max_overlap), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:n]):
+            return n
+    return 0
+
+
+def merge_chunks(chunks: List[Dict[str, Any]]) -> str:
+    """Join chunks in document order, dropping the text each one repeats from its predecessor."""
+    parts: List[str] = []
+    previous: Dict[str, Any] | None = None
+    for chunk in sorted(chunks, key=lambda c: (c["filename"], c["chunk_index"])):
+        text = chunk["text"] or ""
+        if previous is None:
+            parts.append(text)
+        elif previous["filename"] == chunk["filename"] and chunk["chunk_index"] == previous["chunk_index"] + 1:
+            parts.append(text[overlap_length(previous["text"] or "", text):])
+        else:
+            parts.append(GAP_MARKER + text)
+        previous = chunk
+    return "".join(parts)
+
+
+def _neighborhoods_query(hops: int) -> str:
+    hops = max(0, hops)
+    neighbor_match = ""
+    neighbor_return = "[] AS before, [] AS after"
+    if hops:
+        neighbor_match = f"""
+        OPTIONAL MATCH p = (c)-[:NEXT*1..{hops}]->(n:Chunk)
+        WITH f, c, collect({{id: n.id, chunk_index: n.chunk_index, section: n.section, text: {text_of('n')}, distance: length(p)}}) AS after
+        OPTIONAL MATCH q = (m:Chunk)-[:NEXT*1..{hops}]->(c)
+        WITH f, c, after, collect({{id: m.id, chunk_index: m.chunk_index, section: m.section, text: {text_of('m')}, distance: length(q)}}) AS before
+        """
+        neighbor_return = "before, after"
+    return f"""
+        UNWIND $ids AS id
+        MATCH (f:File)-[:HAS_CHUNK]->(c:Chunk {{id: id}})
+        {neighbor_match}
+        RETURN c.id AS id, {text_of('c')} AS text, c.chunk_index AS chunk_index, c.section AS section,
+               f.filename AS filename, f.source AS source, f.user_id AS user_id,
+               {neighbor_return}
+        """
+
+
+# Hop count is configuration, so the rendered text is stable per process.
+CHUNK_NEIGHBORHOODS = register_query(
+    "chunk_neighborhoods", lambda: _neighborhoods_query(environment.QA_CONTEXT_NEIGHBOR_HOPS)
+)
+
+
+def _load_neighborhoods(hit_ids: List[str], hops: int) -> Dict[str, Dict[str, Any]]:
+    if hops == environment.QA_CONTEXT_NEIGHBOR_HOPS:
+        rows = run_query(CHUNK_NEIGHBORHOODS, {"ids": hit_ids})
+    else:
+        rows = get_kg().query(_neighborhoods_query(hops), params={"ids": hit_ids})
+    neighborhoods: Dict[str, Dict[str, Any]] = {}
+    for r in rows or []:
+        row = dict(r)
+        for side in ("before", "after"):
+            row[side] = sorted(
+                [{**n, "filename": row["filename"]} for n in row.get(side) or [] if n.get("id")],
+                key=lambda n: n["distance"],
+            )
+        neighborhoods[row["id"]] = row
+    return neighborhoods
+
+
+def assemble_context(
+    hits: List[Dict[str, Any]],
+    token_budget: int | None = None,
+    neighbor_hops: int | None = None,
+) -> List[Document]:
+    """Build QA context from ranked hits within a token budget.
+
+    Hits sharing a file section are merged into one document. Hit chunks are taken in rank
+    order first; remaining budget is spent on NEXT neighbors, nearest first, round-robin over
+    the groups. Overlapping text between consecutive chunks is emitted once.
+    """
+    if not hits:
+        return []
+    budget = token_budget if token_budget is not None else environment.QA_CONTEXT_TOKEN_BUDGET
+    hops = neighbor_hops if neighbor_hops is not None else environment.QA_CONTEXT_NEIGHBOR_HOPS
+    neighborhoods = _load_neighborhoods([h["id"] for h in hits], hops)
+
+    groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    order: List[Tuple[str, str]] = []
+    included: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    used = 0
+
+    def cost(chunk: Dict[str, Any]) -> int:
+        text = chunk["text"] or ""
+        prev_chunk = included.get((chunk["filename"], chunk["chunk_index"] - 1))
+        next_chunk = included.get((chunk["filename"], chunk["chunk_index"] + 1))
+        shared = 0
+        if prev_chunk:
+            shared += overlap_length(prev_chunk["text"] or "", text)
+        if next_chunk:
+            shared += overlap_length(text, next_chunk["text"] or "")
+        return estimate_tokens(text[: max(0, len(text) - shared)] or " ")
+
+    def try_add(group: Dict[str, Any], chunk: Dict[str, Any], force: bool = False) -> bool:
+        nonlocal used
+        key = (chunk["filename"], chunk["chunk_index"])
+        if key in included:
+            return False
+        tokens = cost(chunk)
+        if used + tokens > budget:
+            if not force:
+                return False
+            # Always keep the best hit, trimmed to the budget.
+            chunk = {**chunk, "text": (chunk["text"] or "")[: max(1, budget - used) * 4]}
+            tokens = estimate_tokens(chunk["text"])
+        included[key] = chunk
+        group["chunks"].append(chunk)
+        used += tokens
+        return True
+
+    for hit in hits:
+        node = neighborhoods.get(hit["id"])
+        if node is None:
+            continue
+        key = (node["filename"], node["section"])
+        if key not in groups:
+            groups[key] = {"hit": hit, "node": node, "chunks": [], "members": []}
+            order.append(key)
+        groups[key]["members"].append(node)
+
+    for i, key in enumerate(order):
+        group = groups[key]
+        for member in group["members"]:
+            try_add(group, member, force=(i == 0 and not group["chunks"]))
+
+    for distance in range(1, hops + 1):
+        for key in order:
+            group = groups[key]
+            for member in group["members"]:
+                for side in ("before", "after"):
+                    for neighbor in member[side]:
+                        if neighbor["distance"] == distance:
+                            try_add(group, neighbor)
+
+    documents: List[Document] = []
+    for key in order:
+        group = groups[key]
+        if not group["chunks"]:
+            continue
+        hit, node = group["hit"], group["node"]
+        scores = {k: v for k, v in hit.items() if k not in ("id", "compact")}
+        documents.append(
+            Document(
+                page_content=merge_chunks(group["chunks"]),
+                metadata={
+                    "source": node["source"],
+                    "filename": node["filename"],
+                    "user_id": node["user_id"],
+                    "chunk_index": node["chunk_index"],
+                    "section": node["section"],
+                    "id": node["id"],
+                    "chunk_ids": [c["id"] for c in sorted(group["chunks"], key=lambda c: c["chunk_index"])],
+                    "hit_ids": [m["id"] for m in group["members"]],
+                    **scores,
+                },
+            )
+        )
+    return documents
+
+
+__all__ = [
+    "assemble_context",
+    "merge_chunks",
+    "overlap_length",
+]
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from database.queries import register_query, run_query
+from services.embedding_spaces import serving_space
+from services.embeddings import EmbeddingSpace, to_index_vector
+from services.vector_storage import dequantize
+
+
+# Chunks overlap and neighbouring chunks often say the same thing, so the top hits by relevance
+# alone tend to be near-duplicates. Retrieval oversamples candidates and keeps k of them by
+# maximal marginal relevance: each pick maximizes
+#   lambda * sim(question, chunk) - (1 - lambda) * max sim(chunk, already picked)
+
+
+def _candidate_vectors_query(space: EmbeddingSpace | None = None) -> str:
+    # The compact full-dimension copy, where there is one, is smaller to ship and more exact
+    # than the (possibly truncated) index vector.
+    space = space or serving_space()
+    prop = space.compact_property or space.vector_property
+    return f"""
+    UNWIND $ids AS id
+    MATCH (c:Chunk {{id: id}})
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH c, coalesce(shared, c) AS t
+    WHERE t.{prop} IS NOT NULL
+    RETURN c.id AS id, t.{prop} AS vector
+    """
+
+
+CANDIDATE_VECTORS = register_query("candidate_vectors", _candidate_vectors_query)
+
+
+def mmr_select(
+    query: Sequence[float], vectors: np.ndarray, k: int, lambda_mult: float
+) -> Tuple[List[int], List[float], List[float], List[float]]:
+    """Greedy maximal marginal relevance over the rows of vectors.
+
+    Returns the picked row indices in order and, per pick, its cosine similarity to the query,
+    its diversity (1 - its highest similarity to an earlier pick, 1 for the first) and its MMR
+    score. Each step is one matrix-vector product over the candidates.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2 or not len(matrix) or k <= 0:
+        return [], [], [], []
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    unit = matrix / norms
+    q = np.asarray(query, dtype=np.float32)
+    relevance = unit @ (q / (np.linalg.norm(q) or 1.0))
+    redundancy = np.zeros(len(unit), dtype=np.float32)
+    available = np.ones(len(unit), dtype=bool)
+
+    picks: List[int] = []
+    similarity: List[float] = []
+    diversity: List[float] = []
+    scores: List[float] = []
+    for _ in range(min(k, len(unit))):
+        mmr = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        mmr[~available] = -np.inf
+        i = int(np.argmax(mmr))
+        picks.append(i)
+        similarity.append(float(relevance[i]))
+        diversity.append(float(1 - redundancy[i]))
+        scores.append(float(mmr[i]))
+        available[i] = False
+        np.maximum(redundancy, unit @ unit[i], out=redundancy)
+    return picks, similarity, diversity, scores
+
+
+def diversify(
+    hits: List[Dict[str, Any]],
+    embedding: List[float],
+    k: int,
+    lambda_mult: float,
+    space: EmbeddingSpace | None = None,
+) -> List[Dict[str, Any]]:
+    """Pick k of the ranked hits by MMR, adding similarity, diversity, mmr_score and
+    retrieval_rank (the hit's rank before selection) to each.
+
+    Hits without a stored vector (not embedded yet) only fill up what MMR leaves free.
+    """
+    if not hits:
+        return []
+    space = space or serving_space()
+    rows = run_query(CANDIDATE_VECTORS, {"ids": [h["id"] for h in hits]}, space=space)
+    vectors = {r["id"]: r["vector"] for r in rows or []}
+    ranked = [(rank, hit) for rank, hit in enumerate(hits, start=1) if hit["id"] in vectors]
+    if not ranked:
+        return hits[:k]
+
+    if space.compact_property:
+        matrix = dequantize([vectors[hit["id"]] for _, hit in ranked], space.compact_dtype)
+        query = embedding
+    else:
+        matrix = np.asarray([vectors[hit["id"]] for _, hit in ranked], dtype=np.float32)
+        query = to_index_vector(embedding, space)
+
+    selected: List[Dict[str, Any]] = []
+    for i, sim, div, score in zip(*mmr_select(query, matrix, k, lambda_mult)):
+        rank, hit = ranked[i]
+        selected.append(
+            {
+                **hit,
+                "similarity": round(sim, 4),
+                "diversity": round(div, 4),
+                "mmr_score": round(score, 4),
+                "retrieval_rank": rank,
+            }
+        )
+    for rank, hit in enumerate(hits, start=1):
+        if len(selected) >= k:
+            break
+        if hit["id"] not in vectors:
+            selected.append({**hit, "retrieval_rank": rank})
+    return selected
+
+
+__all__ = [
+    "diversify",
+    "mmr_select",
+]
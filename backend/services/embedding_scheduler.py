@@ -0,0 +1,401 @@
+from __future__ import annotations
+
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# Rough characters-per-token ratio; good enough to size batches without a tokenizer.
+CHARS_PER_TOKEN = 4
+
+# Per-provider batch limits: hard caps per request and the token budget we start from.
+PROVIDER_LIMITS: Dict[str, Dict[str, int]] = {
+    "openai": {"max_items": 2048, "max_tokens": 300_000, "start_tokens": 64_000},
+    "ollama": {"max_items": 256, "max_tokens": 32_000, "start_tokens": 8_000},
+}
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+TOO_LARGE_STATUS = {413}
+
+# The provider returns one of these function shapes: vectors plus optional response headers.
+EmbedBatchFn = Callable[[List[str]], Tuple[List[List[float]], Optional[Mapping[str, str]]]]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _parse_duration(value: str | None) -> float | None:
+    """Parse provider durations such as '20ms', '1s', '6m0s' or a plain number of seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value):
+        matched = True
+        amount_f = float(amount)
+        total += {"ms": amount_f / 1000, "s": amount_f, "m": amount_f * 60, "h": amount_f * 3600}[unit]
+    return total if matched else None
+
+
+def _header(headers: Mapping[str, str] | None, name: str) -> str | None:
+    if not headers:
+        return None
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.title())
+    return value
+
+
+def _to_int(value: str | None) -> int | None:
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """Token bucket for requests and tokens per minute, steered by provider rate-limit headers."""
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self._lock = threading.Lock()
+        self._rpm = requests_per_minute
+        self._tpm = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self.throttled_seconds = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self._rpm:
+            self._requests = min(self._rpm, self._requests + elapsed * self._rpm / 60)
+        if self._tpm:
+            self._tokens = min(self._tpm, self._tokens + elapsed * self._tpm / 60)
+
+    def acquire(self, tokens: int) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = 0.0
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    if self._rpm and self._requests < 1:
+                        wait = max(wait, (1 - self._requests) * 60 / self._rpm)
+                    # A batch larger than the whole bucket only has to wait for a full bucket.
+                    need = min(tokens, self._tpm) if self._tpm else 0
+                    if self._tpm and self._tokens < need:
+                        wait = max(wait, (need - self._tokens) * 60 / self._tpm)
+                    if wait == 0.0:
+                        if self._rpm:
+                            self._requests -= 1
+                        if self._tpm:
+                            self._tokens -= min(tokens, self._tpm)
+                        return
+                self.throttled_seconds += wait
+            time.sleep(wait)
+
+    def block_for(self, seconds: float) -> None:
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def observe(self, headers: Mapping[str, str] | None) -> None:
+        """Adopt the limits and remaining budget the provider reports (OpenAI-style headers)."""
+        if not headers:
+            return
+        retry_after = _parse_duration(_header(headers, "retry-after"))
+        limit_requests = _to_int(_header(headers, "x-ratelimit-limit-requests"))
+        limit_tokens = _to_int(_header(headers, "x-ratelimit-limit-tokens"))
+        remaining_requests = _to_int(_header(headers, "x-ratelimit-remaining-requests"))
+        remaining_tokens = _to_int(_header(headers, "x-ratelimit-remaining-tokens"))
+        reset_requests = _parse_duration(_header(headers, "x-ratelimit-reset-requests"))
+        reset_tokens = _parse_duration(_header(headers, "x-ratelimit-reset-tokens"))
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A limit seen for the first time has an empty bucket behind it: start it from the
+            # reported budget (or full) rather than from zero.
+            new_requests = bool(limit_requests) and not self._rpm
+            new_tokens = bool(limit_tokens) and not self._tpm
+            if limit_requests:
+                self._rpm = limit_requests
+            if limit_tokens:
+                self._tpm = limit_tokens
+            if new_requests:
+                self._requests = float(self._rpm if remaining_requests is None else min(self._rpm, remaining_requests))
+            elif remaining_requests is not None and self._rpm:
+                self._requests = min(self._requests, float(remaining_requests))
+            if new_tokens:
+                self._tokens = float(self._tpm if remaining_tokens is None else min(self._tpm, remaining_tokens))
+            elif remaining_tokens is not None and self._tpm:
+                self._tokens = min(self._tokens, float(remaining_tokens))
+            block = 0.0
+            if retry_after:
+                block = max(block, retry_after)
+            if remaining_requests == 0 and reset_requests:
+                block = max(block, reset_requests)
+            if remaining_tokens == 0 and reset_tokens:
+                block = max(block, reset_tokens)
+            if block:
+                self._blocked_until = max(self._blocked_until, now + block)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests_per_minute": self._rpm or None,
+                "tokens_per_minute": self._tpm or None,
+                "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 3),
+                "throttled_seconds": round(self.throttled_seconds, 3),
+            }
+
+
+def _error_status(exc: Exception) -> int | None:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_headers(exc: Exception) -> Mapping[str, str] | None:
+    response = getattr(exc, "response", None)
+    return getattr(response, "headers", None)
+
+
+def _is_timeout(exc: Exception) -> bool:
+    return "timeout" in type(exc).__name__.lower() or isinstance(exc, TimeoutError)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    status = _error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    name = type(exc).__name__.lower()
+    return _is_timeout(exc) or "connect" in name or isinstance(exc, (ConnectionError, OSError))
+
+
+def _is_too_large(exc: Exception) -> bool:
+    if _error_status(exc) in TOO_LARGE_STATUS:
+        return True
+    message = str(exc).lower()
+    return "maximum context length" in message or "too many inputs" in message or "too large" in message
+
+
+class EmbeddingScheduler:
+    """Splits texts into token-sized batches and embeds them with bounded concurrency.
+
+    Batches are retried with jittered exponential backoff, paced by a header-driven
+    rate limiter, and the batch token budget adapts: it grows while batches succeed
+    and halves on timeouts or "request too large" errors.
+    """
+
+    def __init__(
+        self,
+        embed_batch: EmbedBatchFn,
+        provider: str,
+        max_in_flight: int = 4,
+        max_retries: int = 6,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        batch_tokens: int | None = None,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+    ):
+        limits = PROVIDER_LIMITS.get(provider, PROVIDER_LIMITS["ollama"])
+        self.provider = provider
+        self._embed_batch = embed_batch
+        self.max_items = limits["max_items"]
+        self.max_tokens = limits["max_tokens"]
+        self.min_tokens = 512
+        self.batch_tokens = min(self.max_tokens, batch_tokens or limits["start_tokens"])
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._recent: deque = deque(maxlen=200)
+        self._totals = {"batches": 0, "items": 0, "tokens": 0, "retries": 0, "failures": 0, "splits": 0}
+        self._busy_seconds = 0.0
+
+    # --- batching -------------------------------------------------------
+
+    def plan_batches(self, texts: Sequence[str]) -> List[Tuple[int, int]]:
+        """Return [start, end) ranges over texts that respect the current token and item budget."""
+        budget = self.batch_tokens
+        batches: List[Tuple[int, int]] = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            t = estimate_tokens(text)
+            if i > start and (tokens + t > budget or i - start >= self.max_items):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += t
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _grow(self) -> None:
+        with self._lock:
+            self.batch_tokens = min(self.max_tokens, int(self.batch_tokens * 1.25) + 1)
+
+    def _shrink(self) -> None:
+        with self._lock:
+            self.batch_tokens = max(self.min_tokens, self.batch_tokens // 2)
+
+    # --- execution ------------------------------------------------------
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": uniform in [0, min(cap, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _run_batch(self, texts: List[str]) -> List[List[float]]:
+        tokens = sum(estimate_tokens(t) for t in texts)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            with self._slots:
+                with self._lock:
+                    self._in_flight += 1
+                started = time.perf_counter()
+                try:
+                    vectors, headers = self._embed_batch(texts)
+                    error = None
+                except Exception as e:
+                    vectors, headers, error = None, None, e
+                finally:
+                    elapsed = time.perf_counter() - started
+                    with self._lock:
+                        self._in_flight -= 1
+                        self._busy_seconds += elapsed
+
+            if error is None:
+                self.limiter.observe(headers)
+                self._record(len(texts), tokens, elapsed, attempt)
+                self._grow()
+                return vectors
+
+            self.limiter.observe(_error_headers(error))
+            if _is_too_large(error) and len(texts) > 1:
+                self._shrink()
+                with self._lock:
+                    self._totals["splits"] += 1
+                mid = len(texts) // 2
+                return self._run_batch(texts[:mid]) + self._run_batch(texts[mid:])
+            if attempt >= self.max_retries or not _is_retryable(error):
+                with self._lock:
+                    self._totals["failures"] += 1
+                raise error
+            if _is_timeout(error):
+                self._shrink()
+            delay = self._backoff(attempt)
+            logger.warning(
+                f"Embedding batch of {len(texts)} failed ({type(error).__name__}: {error}); "
+                f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+            )
+            with self._lock:
+                self._totals["retries"] += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def _record(self, items: int, tokens: int, elapsed: float, retries: int) -> None:
+        with self._lock:
+            self._totals["batches"] += 1
+            self._totals["items"] += items
+            self._totals["tokens"] += tokens
+            self._recent.append(
+                {
+                    "items": items,
+                    "estimated_tokens": tokens,
+                    "latency_ms": round(elapsed * 1000, 1),
+                    "items_per_second": round(items / elapsed, 2) if elapsed else None,
+                    "tokens_per_second": round(tokens / elapsed, 1) if elapsed else None,
+                    "retries": retries,
+                    "finished_at": time.time(),
+                }
+            )
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = self.plan_batches(texts)
+        if len(batches) == 1:
+            return self._run_batch(texts)
+        futures = [self._executor.submit(self._run_batch, texts[s:e]) for s, e in batches]
+        vectors: List[List[float]] = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
+
+    def embed_one(self, text: str) -> List[float]:
+        return self._run_batch([text])[0]
+
+    # --- reporting ------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = list(self._recent)
+            totals = dict(self._totals)
+            busy = self._busy_seconds
+            in_flight = self._in_flight
+            batch_tokens = self.batch_tokens
+        latencies = sorted(b["latency_ms"] for b in recent)
+
+        def pct(p: float) -> float | None:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        window = 0.0
+        if len(recent) > 1:
+            window = recent[-1]["finished_at"] - recent[0]["finished_at"]
+        window_items = sum(b["items"] for b in recent[1:]) if window else 0
+        return {
+            "provider": self.provider,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": in_flight,
+            "batch_tokens": batch_tokens,
+            "max_items_per_batch": self.max_items,
+            "totals": totals,
+            "busy_seconds": round(busy, 3),
+            "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": latencies[-1] if latencies else None},
+            "recent_items_per_second": round(window_items / window, 2) if window else None,
+            "rate_limiter": self.limiter.snapshot(),
+            "recent_batches": recent[-20:],
+        }
+
+
+__all__ = [
+    "EmbeddingScheduler",
+    "RateLimiter",
+    "estimate_tokens",
+]
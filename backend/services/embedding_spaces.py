@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from database.neo import get_kg
+from database.queries import register_query, run_query
+from services.chunk_content import dedup_enabled
+from services.embeddings import EmbeddingSpace, configured_space, embed_documents, to_stored_vectors
+from services.leases import LEASE_FENCE, FileLease, LeaseLost
+
+
+# The active space is the one QA reads from. It only changes when a re-embedding
+# migration to the configured space completes (see services.reembedding).
+_SERVING_TTL_SECONDS = 15.0
+_serving: Dict[str, Any] = {"space": None, "loaded_at": 0.0}
+_lock = threading.Lock()
+
+ACTIVE_SPACE = register_query(
+    "active_embedding_space",
+    """
+    MATCH (s:EmbeddingSpace {status: 'active'})
+    RETURN s.definition AS definition
+    ORDER BY s.activated_at DESC
+    LIMIT 1
+    """,
+)
+ACTIVATE_SPACE = register_query(
+    "activate_embedding_space",
+    """
+    OPTIONAL MATCH (old:EmbeddingSpace {status: 'active'})
+    WHERE old.vector_property <> $vector_property
+    SET old.status = 'retired', old.retired_at = datetime()
+    WITH count(old) AS retired
+    MERGE (s:EmbeddingSpace {vector_property: $vector_property})
+    SET s.definition = $definition,
+        s.index_name = $index_name,
+        s.status = 'active',
+        s.activated_at = datetime()
+    RETURN retired
+    """,
+)
+
+
+def _baseline_space() -> EmbeddingSpace:
+    # Databases from before embedding spaces were recorded hold full vectors of the configured
+    # model in textEmbedding{dims}, indexed by pdf_chunks_{dims}.
+    configured = configured_space()
+    return EmbeddingSpace(configured.provider, configured.model, configured.native_dims, configured.native_dims, None, True)
+
+
+def _legacy_vectors_query(space: EmbeddingSpace | None = None) -> str:
+    space = space or _baseline_space()
+    return f"""
+    MATCH (c:Chunk)
+    WHERE c.{space.vector_property} IS NOT NULL
+    RETURN c.id AS id
+    LIMIT 1
+    """
+
+
+LEGACY_VECTORS = register_query("legacy_vectors", _legacy_vectors_query)
+
+
+def space_to_json(space: EmbeddingSpace) -> str:
+    return json.dumps(space._asdict(), sort_keys=True)
+
+
+def space_from_json(definition: str) -> EmbeddingSpace:
+    fields = json.loads(definition)
+    # Definitions stored before property names carried the model key.
+    fields.setdefault("legacy_names", True)
+    return EmbeddingSpace(**fields)
+
+
+def activate_space(space: EmbeddingSpace) -> None:
+    run_query(
+        ACTIVATE_SPACE,
+        {
+            "vector_property": space.vector_property,
+            "index_name": space.index_name,
+            "definition": space_to_json(space),
+        },
+    )
+    with _lock:
+        _serving.update(space=space, loaded_at=time.monotonic())
+
+
+def serving_space(refresh: bool = False) -> EmbeddingSpace:
+    """Space used to embed questions and score chunks. A database without one adopts the
+    configured space, unless it already holds unrecorded vectors under the dimension-only
+    names; those are adopted as they are, and target_space() then migrates away from them."""
+    with _lock:
+        cached = _serving["space"]
+        fresh = time.monotonic() - _serving["loaded_at"] < _SERVING_TTL_SECONDS
+    if cached is not None and fresh and not refresh:
+        return cached
+    rows = run_query(ACTIVE_SPACE)
+    if rows and rows[0].get("definition"):
+        space = space_from_json(rows[0]["definition"])
+        with _lock:
+            _serving.update(space=space, loaded_at=time.monotonic())
+        return space
+    space = _adopted_space()
+    activate_space(space)
+    return space
+
+
+def _adopted_space() -> EmbeddingSpace:
+    legacy = _baseline_space()
+    if vector_index_state(legacy)["state"] is not None:
+        return legacy
+    if run_query(LEGACY_VECTORS, space=legacy):
+        return legacy
+    return configured_space()
+
+
+def target_space() -> EmbeddingSpace:
+    """The configured space, or the serving space when it holds the same vectors under the
+    older dimension-only names (so upgrading does not start a pointless migration)."""
+    serving = serving_space()
+    configured = configured_space()
+    if serving.legacy_names and serving._replace(legacy_names=False) == configured:
+        return serving
+    return configured
+
+
+def write_spaces() -> List[EmbeddingSpace]:
+    """Spaces new chunks must be embedded into: the serving one, plus the configured one
+    while a migration towards it is pending, so the migration never falls behind."""
+    serving = serving_space()
+    target = target_space()
+    if target == serving:
+        return [serving]
+    return [serving, target]
+
+
+def _set_vectors_query(space: EmbeddingSpace | None = None, content: bool = False) -> str:
+    space = space or configured_space()
+    match = "(c:ChunkContent {hash: row.id})" if content else "(c:Chunk {id: row.id})"
+    compact_set = f", c.{space.compact_property} = row.compact" if space.compact_property else ""
+    return f"""
+    UNWIND $rows AS row
+    MATCH {match}
+    SET c.{space.vector_property} = row.embedding{compact_set}
+    """
+
+
+SET_VECTORS = register_query("set_vectors", _set_vectors_query)
+
+
+def _set_file_vectors_query(space: EmbeddingSpace | None = None, content: bool = False) -> str:
+    # Writes made under a file's lease: only onto that file's chunks, and only while the lease is
+    # still held, since chunk ids repeat across versions of a file.
+    space = space or configured_space()
+    if content:
+        match = "MATCH (c:ChunkContent {hash: row.id}) WHERE EXISTS { MATCH (f)-[:HAS_CHUNK]->(:Chunk)-[:HAS_CONTENT]->(c) }"
+    else:
+        match = "MATCH (f)-[:HAS_CHUNK]->(c:Chunk {id: row.id})"
+    compact_set = f", c.{space.compact_property} = row.compact" if space.compact_property else ""
+    return f"""
+    MATCH (f:File {{user_id: $user_id, filename: $filename}})
+    WHERE {LEASE_FENCE}
+    UNWIND $rows AS row
+    {match}
+    SET c.{space.vector_property} = row.embedding{compact_set}
+    RETURN count(c) AS written
+    """
+
+
+SET_FILE_VECTORS = register_query("set_file_vectors", _set_file_vectors_query)
+
+
+def write_vectors(
+    space: EmbeddingSpace,
+    chunk_ids: List[str],
+    vectors: List[List[float]],
+    batch_size: int = 200,
+    content: bool = False,
+    lease: FileLease | None = None,
+) -> None:
+    """Store vectors on Chunk nodes by id, or on ChunkContent nodes by hash when content is set.
+
+    With a lease, only the leased file's chunks are written, and LeaseLost is raised once a
+    newer holder has taken the file over."""
+    rows = [{"id": chunk_id, **to_stored_vectors(vec, space)} for chunk_id, vec in zip(chunk_ids, vectors)]
+    write_vector_rows(space, rows, batch_size, content, lease)
+
+
+def write_vector_rows(
+    space: EmbeddingSpace,
+    rows: List[Dict[str, Any]],
+    batch_size: int = 200,
+    content: bool = False,
+    lease: FileLease | None = None,
+) -> None:
+    """Like write_vectors, for rows of {id, embedding, compact} already in the space's stored form."""
+    for i in range(0, len(rows), batch_size):
+        if lease is None:
+            run_query(SET_VECTORS, {"rows": rows[i : i + batch_size]}, space=space, content=content)
+            continue
+        written = run_query(
+            SET_FILE_VECTORS,
+            {
+                "rows": rows[i : i + batch_size],
+                "user_id": lease.user_id,
+                "filename": lease.filename,
+                "lease_token": lease.token,
+            },
+            space=space,
+            content=content,
+        )
+        if not (written and written[0]["written"]):
+            raise LeaseLost(f"Vectors for '{lease.filename}' were fenced off from lease token {lease.token}")
+
+
+def embed_rows(space: EmbeddingSpace, rows: List[Dict[str, Any]]) -> List[Tuple[List[str], bool, List[List[float]]]]:
+    """Embed rows of {id, text, hash}. Rows with a hash belong to shared content and are
+    embedded once per hash. Returns (keys, is_content, vectors) groups for store_embedded."""
+    by_hash: Dict[str, str] = {}
+    own: Dict[str, str] = {}
+    for row in rows:
+        if not row.get("text"):
+            continue
+        if row.get("hash"):
+            by_hash.setdefault(row["hash"], row["text"])
+        else:
+            own[row["id"]] = row["text"]
+    embedded = []
+    for targets, content in ((own, False), (by_hash, True)):
+        if targets:
+            keys = list(targets)
+            embedded.append((keys, content, embed_documents([targets[k] for k in keys], space)))
+    return embedded
+
+
+def store_embedded(
+    space: EmbeddingSpace,
+    embedded: List[Tuple[List[str], bool, List[List[float]]]],
+    lease: FileLease | None = None,
+) -> None:
+    for keys, content, vectors in embedded:
+        write_vectors(space, keys, vectors, content=content, lease=lease)
+
+
+def embed_and_store(space: EmbeddingSpace, rows: List[Dict[str, Any]]) -> int:
+    """Embed and store rows of {id, text, hash}. Returns the number of texts sent to the model."""
+    embedded = embed_rows(space, rows)
+    store_embedded(space, embedded)
+    return sum(len(keys) for keys, _, _ in embedded)
+
+
+def _create_vector_index(name: str, label: str, prop: str, dims: int) -> None:
+    get_kg().query(
+        f"""
+        CREATE VECTOR INDEX {name} IF NOT EXISTS
+        FOR (c:{label}) ON (c.{prop})
+        OPTIONS {{
+            indexConfig: {{
+                `vector.dimensions`: $dims,
+                `vector.similarity_function`: 'cosine'
+            }}
+        }}
+        """,
+        params={"dims": dims},
+    )
+
+
+def ensure_vector_index(space: EmbeddingSpace) -> None:
+    _create_vector_index(space.index_name, "Chunk", space.vector_property, space.index_dims)
+    if dedup_enabled():
+        _create_vector_index(space.content_index_name, "ChunkContent", space.vector_property, space.index_dims)
+
+
+def vector_index_state(space: EmbeddingSpace, content: bool = False) -> Dict[str, Any]:
+    rows = get_kg().query(
+        """
+        SHOW INDEXES YIELD name, state, populationPercent
+        WHERE name = $name
+        RETURN state, populationPercent
+        """,
+        params={"name": space.content_index_name if content else space.index_name},
+    )
+    return dict(rows[0]) if rows else {"state": None, "populationPercent": None}
+
+
+__all__ = [
+    "serving_space",
+    "write_spaces",
+    "activate_space",
+    "ensure_vector_index",
+    "write_vectors",
+    "write_vector_rows",
+    "embed_and_store",
+    "embed_rows",
+    "store_embedded",
+    "vector_index_state",
+    "space_to_json",
+    "space_from_json",
+    "target_space",
+]
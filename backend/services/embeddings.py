@@ -1,14 +1,27 @@
 from __future__ import annotations
 
-from typing import List, Sequence
+import hashlib
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
 
 import environment
 from langchain_openai import OpenAIEmbeddings
 from langchain_ollama import OllamaEmbeddings
 from langchain_core.embeddings import Embeddings
+from services.embedding_scheduler import EmbeddingScheduler
+from services.vector_storage import COMPACT_DTYPES, quantize, truncate
+from logger import setup_logger
+logger = setup_logger(__name__)
 
 
-_EMBEDDINGS_SINGLETON: Embeddings | None = None
+_EMBEDDINGS: Dict[Tuple[str, str], Embeddings] = {}
+_SCHEDULERS: Dict[Tuple[str, str], EmbeddingScheduler] = {}
+_WARNED: set = set()
+
+
+def _warn_once(message: str) -> None:
+    if message not in _WARNED:
+        _WARNED.add(message)
+        logger.warning(message)
 
 
 def _provider() -> str:
@@ -21,9 +34,18 @@ def _default_model() -> str:
     return environment.OPENAI_EMBEDDING_MODEL
 
 
-def embedding_dimension() -> int:
-    model = _default_model()
-    if _provider() == "ollama":
+# Models trained with Matryoshka representation learning: their leading dimensions
+# form a usable embedding on their own.
+MATRYOSHKA_MODELS = {
+    "text-embedding-3-small",
+    "text-embedding-3-large",
+    "nomic-embed-text",
+    "nomic-embed-text:latest",
+}
+
+
+def _native_dimension(provider: str, model: str) -> int:
+    if provider == "ollama":
         ollama_dims = {
             "nomic-embed-text": 768,
             "nomic-embed-text:latest": 768,
@@ -39,37 +61,212 @@ def embedding_dimension() -> int:
     return openai_dims.get(model, 1536)
 
 
-def get_embeddings() -> Embeddings:
-    global _EMBEDDINGS_SINGLETON
-    if _EMBEDDINGS_SINGLETON is None:
-        model = _default_model()
-        if _provider() == "ollama":
+class EmbeddingSpace(NamedTuple):
+    """Everything that determines where a chunk's vectors are stored and how queries are embedded.
+
+    Property and index names carry a key of the provider and model, so two models with the
+    same dimensions never share a property. Spaces activated before the key was introduced
+    keep their dimension-only names (legacy_names) so their vectors stay where they are.
+    """
+
+    provider: str
+    model: str
+    native_dims: int
+    index_dims: int
+    compact_dtype: Optional[str] = None
+    legacy_names: bool = False
+
+    @property
+    def truncated(self) -> bool:
+        return self.index_dims < self.native_dims
+
+    @property
+    def model_key(self) -> str:
+        return hashlib.blake2b(f"{self.provider}/{self.model}".encode("utf-8"), digest_size=4).hexdigest()
+
+    @property
+    def _name_suffix(self) -> str:
+        suffix = str(self.native_dims) if self.legacy_names else f"{self.native_dims}_{self.model_key}"
+        return f"{suffix}_{self.index_dims}" if self.truncated else suffix
+
+    @property
+    def vector_property(self) -> str:
+        return f"textEmbedding{self._name_suffix}"
+
+    @property
+    def index_name(self) -> str:
+        return f"pdf_chunks_{self._name_suffix}"
+
+    @property
+    def content_index_name(self) -> str:
+        return f"{self.index_name}_content"
+
+    @property
+    def compact_property(self) -> Optional[str]:
+        if not self.compact_dtype:
+            return None
+        if self.legacy_names:
+            return f"textEmbedding{self.native_dims}_{self.compact_dtype}"
+        return f"textEmbedding{self.native_dims}_{self.model_key}_{self.compact_dtype}"
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            **self._asdict(),
+            "storage_mode": "truncated" if self.truncated else "full",
+            "model_key": self.model_key,
+            "vector_property": self.vector_property,
+            "index_name": self.index_name,
+            "compact_property": self.compact_property,
+        }
+
+
+def configured_space() -> EmbeddingSpace:
+    """The embedding space described by the environment (the target for new vectors)."""
+    provider, model = _provider(), _default_model()
+    native = _native_dimension(provider, model)
+    index_dims = native
+    mode = (environment.EMBEDDING_STORAGE_MODE or "full").strip().lower()
+    if mode == "truncated":
+        dims = int(environment.EMBEDDING_INDEX_DIM or 0)
+        if model not in MATRYOSHKA_MODELS:
+            _warn_once(f"Model {model} is not Matryoshka-capable; storing full vectors")
+        elif not 0 < dims < native:
+            _warn_once(f"EMBEDDING_INDEX_DIM={environment.EMBEDDING_INDEX_DIM!r} is not a valid truncation; storing full vectors")
+        else:
+            index_dims = dims
+    dtype = (environment.EMBEDDING_RESCORE_DTYPE or "none").strip().lower()
+    return EmbeddingSpace(provider, model, native, index_dims, dtype if dtype in COMPACT_DTYPES else None)
+
+
+def native_embedding_dimension() -> int:
+    return configured_space().native_dims
+
+
+def storage_mode() -> str:
+    return "truncated" if configured_space().truncated else "full"
+
+
+def embedding_dimension() -> int:
+    """Dimension of the stored, indexed vector (truncated in "truncated" storage mode)."""
+    return configured_space().index_dims
+
+
+def embedding_property() -> str:
+    return configured_space().vector_property
+
+
+def vector_index_name() -> str:
+    return configured_space().index_name
+
+
+def compact_dtype() -> str | None:
+    return configured_space().compact_dtype
+
+
+def compact_property() -> str | None:
+    return configured_space().compact_property
+
+
+def to_index_vector(vector: Sequence[float], space: EmbeddingSpace | None = None) -> List[float]:
+    space = space or configured_space()
+    if space.truncated:
+        return truncate(vector, space.index_dims)
+    return list(vector)
+
+
+def to_stored_vectors(vector: Sequence[float], space: EmbeddingSpace | None = None) -> Dict[str, Any]:
+    """Property values to write for one full embedding: index vector and optional compact copy."""
+    space = space or configured_space()
+    return {
+        "embedding": to_index_vector(vector, space),
+        "compact": quantize(vector, space.compact_dtype) if space.compact_dtype else None,
+    }
+
+
+def get_embeddings(space: EmbeddingSpace | None = None) -> Embeddings:
+    space = space or configured_space()
+    key = (space.provider, space.model)
+    if key not in _EMBEDDINGS:
+        if space.provider == "ollama":
             base_url = environment.OLLAMA_BASE_URL
             if base_url:
-                _EMBEDDINGS_SINGLETON = OllamaEmbeddings(model=model, base_url=base_url)
+                _EMBEDDINGS[key] = OllamaEmbeddings(model=space.model, base_url=base_url)
             else:
-                _EMBEDDINGS_SINGLETON = OllamaEmbeddings(model=model)
+                _EMBEDDINGS[key] = OllamaEmbeddings(model=space.model)
         else:
             # Rely on environment for API key by default; pass explicitly if present
-            kwargs = {"model": model}
+            kwargs = {"model": space.model}
             kwargs["api_key"] = environment.OPENAI_API_KEY
-            _EMBEDDINGS_SINGLETON = OpenAIEmbeddings(**kwargs)
-    return _EMBEDDINGS_SINGLETON
+            _EMBEDDINGS[key] = OpenAIEmbeddings(**kwargs)
+    return _EMBEDDINGS[key]
+
+
+def _batch_embedder(embeddings: Embeddings):
+    def embed_batch(texts: List[str]) -> Tuple[List[List[float]], Optional[Mapping[str, str]]]:
+        if isinstance(embeddings, OpenAIEmbeddings) and hasattr(embeddings.client, "with_raw_response"):
+            # Go through the raw response so the rate limiter can see x-ratelimit-* headers.
+            kwargs: Dict[str, Any] = {"input": texts, "model": embeddings.model}
+            if embeddings.dimensions:
+                kwargs["dimensions"] = embeddings.dimensions
+            raw = embeddings.client.with_raw_response.create(**kwargs)
+            data = sorted(raw.parse().data, key=lambda d: d.index)
+            return [d.embedding for d in data], raw.headers
+        return embeddings.embed_documents(texts), None
+
+    return embed_batch
+
+
+def get_scheduler(space: EmbeddingSpace | None = None) -> EmbeddingScheduler:
+    space = space or configured_space()
+    key = (space.provider, space.model)
+    if key not in _SCHEDULERS:
+        batch_tokens = environment.EMBEDDINGS_BATCH_TOKENS
+        _SCHEDULERS[key] = EmbeddingScheduler(
+            _batch_embedder(get_embeddings(space)),
+            provider=space.provider,
+            max_in_flight=environment.EMBEDDINGS_MAX_IN_FLIGHT,
+            max_retries=environment.EMBEDDINGS_MAX_RETRIES,
+            backoff_base=environment.EMBEDDINGS_BACKOFF_BASE_SECONDS,
+            backoff_max=environment.EMBEDDINGS_BACKOFF_MAX_SECONDS,
+            batch_tokens=int(batch_tokens) if batch_tokens else None,
+            requests_per_minute=environment.EMBEDDINGS_REQUESTS_PER_MINUTE,
+            tokens_per_minute=environment.EMBEDDINGS_TOKENS_PER_MINUTE,
+        )
+    return _SCHEDULERS[key]
+
+
+def embed_text(text: str, space: EmbeddingSpace | None = None) -> List[float]:
+    return get_scheduler(space).embed_one(text)
 
 
-def embed_text(text: str) -> List[float]:
-    return get_embeddings().embed_query(text)
+def embed_documents(texts: Sequence[str], space: EmbeddingSpace | None = None) -> List[List[float]]:
+    return get_scheduler(space).embed(texts)
 
 
-def embed_documents(texts: Sequence[str]) -> List[List[float]]:
-    return get_embeddings().embed_documents(list(texts))
+def embedding_stats() -> Dict[str, Any]:
+    """Scheduler stats per provider/model (more than one while re-embedding to a new model)."""
+    if not _SCHEDULERS:
+        get_scheduler()
+    return {f"{provider}/{model}": scheduler.stats() for (provider, model), scheduler in list(_SCHEDULERS.items())}
 
 
 __all__ = [
+    "EmbeddingSpace",
+    "configured_space",
     "get_embeddings",
+    "get_scheduler",
     "embed_text",
     "embed_documents",
     "embedding_dimension",
+    "native_embedding_dimension",
+    "storage_mode",
+    "embedding_property",
+    "vector_index_name",
+    "compact_dtype",
+    "compact_property",
+    "to_index_vector",
+    "to_stored_vectors",
+    "embedding_stats",
 ]
 
 
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import re
+from collections import Counter
+from typing import Any, Dict, List
+
+from database.queries import register_query, run_query
+from services.leases import LEASE_FENCE, FileLease, LeaseLost
+
+
+# Lightweight, CPU-only extraction: regexes for identifiers, quantities, acronyms and
+# capitalized spans, plus the most frequent content words as keywords. Entity nodes are
+# per user (id = "{user_id}::{key}"), so lookups never touch other tenants' mentions.
+_IDENTIFIER = re.compile(
+    r"\b(?:[A-Za-z0-9]+(?:[-_./:][A-Za-z0-9]+)+|(?=[A-Za-z]*\d)(?=\d*[A-Za-z])[A-Za-z0-9]{2,})\b"
+)
+_QUANTITY = re.compile(
+    r"(?<![\w\-./:])\d+(?:[.,]\d+)?\s?(?:%|[kMGT]?B|[mµn]?g|kg|[kcm]?m|[mµn]?s|min|h|[kMG]?Hz|[mk]?V|[kMG]?W|[mk]?A|k?N|°[CF]|USD|EUR|GBP)(?![A-Za-z0-9])"
+)
+_ACRONYM = re.compile(r"\b[A-Z]{2,6}s?\b")
+_CAPITALIZED_SPAN = re.compile(r"\b[A-Z][a-z]+(?:\s+(?:of|the|and|for|de|van|von)?\s*[A-Z][a-z]+){1,3}\b")
+_PLAIN_NUMBER = re.compile(r"^\d+(?:[.,]\d+)?$")
+_LEADING_ARTICLE = re.compile(r"^(?:The|A|An)\s+")
+_WORD = re.compile(r"\b[a-z]{5,}\b")
+
+_STOPWORDS = frozenset(
+    """
+    about above after again against among because before being below between could doing
+    during every further having other ought their theirs there these those through under
+    until where which while whose would should shall might which within without however
+    therefore thus also into onto upon than then them they what when with from this that
+    have been were will your yours page image text
+    """.split()
+)
+
+MAX_ENTITIES_PER_CHUNK = 30
+MAX_KEYWORDS = 5
+
+
+def _entity(kind: str, name: str) -> Dict[str, str]:
+    name = " ".join(name.split())
+    return {"key": name.lower(), "name": name, "kind": kind}
+
+
+def extract_entities(text: str, min_keyword_count: int = 2) -> List[Dict[str, Any]]:
+    """Entities in text as {key, name, kind, count}, most specific kinds first.
+
+    Each stretch of text counts once, for the first kind that matches it: "IEC-60034" is an
+    identifier, not also an IEC acronym, and "230V" a quantity, not also an identifier.
+    Keywords need min_keyword_count occurrences (use 1 for short texts such as questions).
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    taken = bytearray(len(text))
+
+    def add(entity: Dict[str, str], match: re.Match) -> None:
+        start, end = match.span()
+        if len(entity["key"]) < 2 or any(taken[start:end]):
+            return
+        taken[start:end] = b"\x01" * (end - start)
+        existing = found.get(entity["key"])
+        if existing:
+            existing["count"] += 1
+        else:
+            found[entity["key"]] = {**entity, "count": 1}
+
+    for match in _QUANTITY.finditer(text):
+        add(_entity("quantity", match.group().replace(" ", "")), match)
+    for match in _IDENTIFIER.finditer(text):
+        if not _PLAIN_NUMBER.match(match.group()):
+            add(_entity("identifier", match.group()), match)
+    for match in _ACRONYM.finditer(text):
+        add(_entity("acronym", match.group()), match)
+    for match in _CAPITALIZED_SPAN.finditer(text):
+        add(_entity("name", _LEADING_ARTICLE.sub("", match.group())), match)
+
+    words = Counter(w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS)
+    for word, count in words.most_common(MAX_KEYWORDS):
+        if count >= min_keyword_count and word not in found:
+            found[word] = {"key": word, "name": word, "kind": "keyword", "count": count}
+
+    return list(found.values())[:MAX_ENTITIES_PER_CHUNK]
+
+
+def entity_id(user_id: str, key: str) -> str:
+    return f"{user_id}::{key}"
+
+
+# Chunk ids are deterministic, so a stalled lease holder would otherwise write its version's
+# mentions onto the chunks of whoever took the file over.
+WRITE_MENTIONS = register_query(
+    "write_mentions",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})
+    WHERE """
+    + LEASE_FENCE
+    + """
+    UNWIND $rows AS row
+    MATCH (f)-[:HAS_CHUNK]->(c:Chunk {id: row.id})
+    UNWIND row.entities AS entity
+    MERGE (e:Entity {id: entity.id})
+    ON CREATE SET e.user_id = $user_id,
+                  e.key = entity.key,
+                  e.name = entity.name,
+                  e.kind = entity.kind
+    MERGE (c)-[m:MENTIONS]->(e)
+    SET m.count = entity.count
+    RETURN count(DISTINCT c) AS written
+    """,
+)
+ENTITY_CANDIDATES = register_query(
+    "entity_candidates",
+    """
+    UNWIND $entity_ids AS entity_id
+    MATCH (e:Entity {id: entity_id})<-[m:MENTIONS]-(c:Chunk)<-[:HAS_CHUNK]-(f:File {user_id: $user_id})
+    WHERE $filenames IS NULL OR f.filename IN $filenames
+    WITH c, count(DISTINCT e) AS matches, sum(m.count) AS mentions
+    RETURN c.id AS id, matches + mentions / (mentions + 10.0) AS score
+    ORDER BY score DESC
+    LIMIT $limit
+    """,
+)
+
+
+def write_mentions(
+    user_id: str, filename: str, chunk_ids: List[str], texts: List[str], lease: FileLease | None = None
+) -> int:
+    rows = []
+    for chunk_id, text in zip(chunk_ids, texts):
+        entities = extract_entities(text or "")
+        if entities:
+            rows.append(
+                {
+                    "id": chunk_id,
+                    "entities": [{**e, "id": entity_id(user_id, e["key"])} for e in entities],
+                }
+            )
+    if rows:
+        written = run_query(
+            WRITE_MENTIONS,
+            {"rows": rows, "user_id": user_id, "filename": filename, "lease_token": lease.token if lease else None},
+        )
+        if lease is not None and not (written and written[0]["written"]):
+            raise LeaseLost(f"Mentions for '{filename}' were fenced off from lease token {lease.token}")
+    return sum(len(r["entities"]) for r in rows)
+
+
+def entity_candidates(
+    user_id: str, question: str, filenames: List[str] | None, limit: int
+) -> List[Dict[str, Any]]:
+    """Chunks mentioning the question's entities, ranked by how many distinct ones they mention."""
+    entities = extract_entities(question, min_keyword_count=1)
+    if not entities:
+        return []
+    rows = run_query(
+        ENTITY_CANDIDATES,
+        {
+            "entity_ids": [entity_id(user_id, e["key"]) for e in entities],
+            "user_id": user_id,
+            "filenames": filenames or None,
+            "limit": limit,
+        },
+    )
+    return [dict(r) for r in rows or []]
+
+
+__all__ = [
+    "extract_entities",
+    "entity_id",
+    "write_mentions",
+    "entity_candidates",
+]
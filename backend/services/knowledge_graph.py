@@ -1,53 +1,49 @@
 from __future__ import annotations
 
+import contextvars
 import os
 import re
-from typing import Any, Dict, List
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Tuple
 
 import httpx
-from database.neo import get_neo4j_connection
-from environment import NEO4J_URI, NEO4J_USER, NEO4J_PASS
+from database.neo import get_kg
+from database.queries import register_query, run_query
 from langchain.chains import RetrievalQAWithSourcesChain
-from langchain_community.vectorstores import Neo4jVector
 from langchain_openai import ChatOpenAI
 from langchain_ollama import ChatOllama
 import environment
-from services.embeddings import get_embeddings, embed_text, embedding_dimension
-from utils.extract_text_from_image import extract_text_from_image
-from utils.extract_text_from_pdf import extract_text_from_pdf
+from services.embeddings import (
+    EmbeddingSpace,
+    configured_space,
+    embed_documents,
+    embedding_dimension,
+    native_embedding_dimension,
+    storage_mode,
+)
+from services.admission import run_ingest
+from services.chunk_content import CONTENT_FULLTEXT_INDEX_NAME, content_hash, dedup_enabled, remove_orphan_content
+from services.embedding_spaces import embed_rows, ensure_vector_index, serving_space, store_embedded, write_spaces
+from services.entities import write_mentions
+from services.leases import LEASE_FENCE, FileLease, LeaseBusy, LeaseLost, file_lease
+from services.pipeline import Stage, run_pipeline_sync
+from services.similarity import schedule_similarity
+from services.retention import delete_file_chunks
+from services.statistics import list_files_page, record_ingest, user_statistics
+from services.retrieval import FULLTEXT_INDEX_NAME, ChunkRetriever, StaticRetriever, retrieve_documents
+from services.vector_storage import compare_modes
+from utils.extract_text_from_image import iter_image_text
+from utils.extract_text_from_pdf import iter_pdf_text
 
 
-# Lazy connection - only connect when needed
-_kg_connection = None
-
-def get_kg():
-    global _kg_connection
-    if _kg_connection is None:
-        _kg_connection = get_neo4j_connection()
-    return _kg_connection
-
 MAX_TOTAL_BYTES: int = 100 * 1024 * 1024  # 100 MB
 
 
-def list_files(user_id: str) -> List[Dict[str, Any]]:
-    result = get_kg().query(
-        """
-        MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)
-        RETURN f.filename AS filename,
-               f.total_chunks AS total_chunks,
-               f.processed_date AS processed_date
-        ORDER BY f.filename
-        """,
-        params={"user_id": user_id},
-    )
-    return [
-        {
-            "filename": r.get("filename"),
-            "total_chunks": r.get("total_chunks"),
-            "processed_date": r.get("processed_date"),
-        }
-        for r in (result or [])
-    ]
+def list_files(
+    user_id: str, offset: int = 0, limit: int = 100, sort: str = "filename", descending: bool = False
+) -> List[Dict[str, Any]]:
+    return list_files_page(user_id, offset, limit, sort, descending)
 
 
 def ingest_text_file(user_id: str, filename: str, contents: bytes) -> Dict[str, Any]:
@@ -77,35 +73,60 @@ async def ingest_url(user_id: str, url: str) -> Dict[str, Any]:
             text = content_bytes.decode("utf-8", errors="ignore")
         except Exception:
             text = content_bytes.decode(errors="ignore")
-        plain = _strip_html(text)
-        return _create_file_knowledge_graph(
-            user_id=user_id,
-            filename=url,
-            file_contents=plain.encode("utf-8"),
-            content_type="text/plain",
-        )
+    plain = await run_ingest(_strip_html, text)
+    return await run_ingest(
+        _create_file_knowledge_graph,
+        user_id=user_id,
+        filename=url,
+        file_contents=plain.encode("utf-8"),
+        content_type="text/plain",
+    )
 
 
+GRAPH_FILES = register_query(
+    "graph_files",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)
+    OPTIONAL MATCH (f)-[:HAS_CHUNK]->(c:Chunk)
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH f, c, shared, coalesce(shared, c) AS t
+    RETURN f.filename AS filename,
+           f.file_type AS file_type,
+           f.size AS file_size,
+           f.processed_date AS processed_date,
+           collect({
+               id: c.id,
+               idx: c.chunk_index,
+               text: substring(t.text, 0, 100),
+               text_length: size(t.text),
+               section: c.section,
+               content_hash: shared.hash,
+               content_refs: size([(shared)<-[:HAS_CONTENT]-(o:Chunk) WHERE o.user_id = $user_id | o])
+           }) AS chunks
+    """,
+)
+GRAPH_NEXT_EDGES = register_query(
+    "graph_next_edges",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c1:Chunk)-[:NEXT]->(c2:Chunk)
+    RETURN c1.id AS source,
+           c2.id AS target,
+           c1.chunk_index AS source_idx,
+           c2.chunk_index AS target_idx
+    """,
+)
+GRAPH_SIMILAR_EDGES = register_query(
+    "graph_similar_edges",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c1:Chunk)-[r:SIMILAR_TO]->(c2:Chunk)
+    RETURN c1.id AS source,
+           c2.id AS target,
+           r.score AS score
+    """,
+)
 def get_graph(user_id: str) -> Dict[str, Any]:
     # Enhanced query to get more detailed node information
-    data = get_kg().query(
-        """
-        MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)
-        OPTIONAL MATCH (f)-[:HAS_CHUNK]->(c:Chunk)
-        RETURN f.filename AS filename, 
-               f.file_type AS file_type,
-               f.size AS file_size,
-               f.processed_date AS processed_date,
-               collect({
-                   id: c.id, 
-                   idx: c.chunk_index,
-                   text: substring(c.text, 0, 100),
-                   text_length: size(c.text),
-                   section: c.section
-               }) AS chunks
-        """,
-        params={"user_id": user_id},
-    )
+    data = run_query(GRAPH_FILES, {"user_id": user_id})
     nodes: List[Dict[str, Any]] = []
     edges: List[Dict[str, Any]] = []
 
@@ -142,7 +163,9 @@ def get_graph(user_id: str) -> Dict[str, Any]:
                     "text_preview": ch.get("text", "")[:100] + ("..." if len(ch.get("text", "")) > 100 else ""),
                     "text_length": ch.get("text_length", 0),
                     "section": ch.get("section", ""),
-                    "parent_file": row["filename"]
+                    "parent_file": row["filename"],
+                    "content_hash": ch.get("content_hash"),
+                    "content_refs": ch.get("content_refs") or 1
                 }
             }
             nodes.append(chunk_node)
@@ -160,15 +183,7 @@ def get_graph(user_id: str) -> Dict[str, Any]:
             edges.append(edge)
 
     # Enhanced next relationships query
-    next_rows = get_kg().query(
-        """
-        MATCH (c1:Chunk)-[:NEXT]->(c2:Chunk)
-        RETURN c1.id AS source, 
-               c2.id AS target,
-               c1.chunk_index AS source_idx,
-               c2.chunk_index AS target_idx
-        """
-    )
+    next_rows = run_query(GRAPH_NEXT_EDGES, {"user_id": user_id})
     for r in next_rows or []:
         if r.get("source") and r.get("target"):
             edge = {
@@ -183,27 +198,39 @@ def get_graph(user_id: str) -> Dict[str, Any]:
             }
             edges.append(edge)
 
+    # Precomputed kNN edges (see services.similarity)
+    similar_rows = run_query(GRAPH_SIMILAR_EDGES, {"user_id": user_id})
+    for r in similar_rows or []:
+        if r.get("source") and r.get("target"):
+            edges.append(
+                {
+                    "source": r["source"],
+                    "target": r["target"],
+                    "type": "SIMILAR_TO",
+                    "properties": {
+                        "relationship": "similar",
+                        "score": r.get("score"),
+                    },
+                }
+            )
+
     # Get additional graph statistics
-    stats = get_kg().query(
-        """
-        MATCH (u:User {user_id: $user_id})
-        OPTIONAL MATCH (u)-[:UPLOADED]->(f:File)
-        OPTIONAL MATCH (f)-[:HAS_CHUNK]->(c:Chunk)
-        RETURN count(DISTINCT f) AS file_count,
-               count(DISTINCT c) AS chunk_count,
-               sum(f.size) AS total_size
-        """,
-        params={"user_id": user_id}
-    )
-    
-    graph_stats = {}
-    if stats:
-        stat_row = stats[0]
-        graph_stats = {
-            "file_count": stat_row.get("file_count", 0),
-            "chunk_count": stat_row.get("chunk_count", 0),
-            "total_size": stat_row.get("total_size", 0)
-        }
+    # Totals come from the User counters; only the shared-content count needs the chunk rows
+    # this function has already fetched.
+    stats = user_statistics(user_id)
+    contents = {
+        ch.get("content_hash") or ch["id"]
+        for row in data or []
+        for ch in row.get("chunks", []) or []
+        if ch and ch.get("id") is not None
+    }
+    graph_stats = {
+        "file_count": stats["file_count"],
+        "chunk_count": stats["chunk_count"],
+        "unique_content_count": len(contents),
+        "total_size": stats["total_size"],
+        "embedded_chunks": stats["embedded_chunks"],
+    }
 
     unique_nodes = {n["id"]: n for n in nodes}.values()
     return {
@@ -214,6 +241,55 @@ def get_graph(user_id: str) -> Dict[str, Any]:
     }
 
 
+SAMPLE_CHUNK_TEXTS = register_query(
+    "sample_chunk_texts",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c:Chunk)
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH DISTINCT coalesce(shared, c) AS t
+    WHERE t.text IS NOT NULL AND t.text <> ''
+    RETURN t.text AS text
+    ORDER BY rand()
+    LIMIT $limit
+    """,
+)
+
+
+def embedding_storage_report(
+    user_id: str,
+    questions: List[str] | None = None,
+    sample_size: int = 500,
+    k: int = 10,
+    dims: List[int] | None = None,
+) -> Dict[str, Any]:
+    """Compare recall and search latency of the vector storage modes on a sample of the user's chunks.
+
+    Sampled chunks are re-embedded at full dimension and exact full-vector search is the
+    ground truth. Without explicit questions, the opening of sampled chunks is used as queries.
+    """
+    rows = run_query(SAMPLE_CHUNK_TEXTS, {"user_id": user_id, "limit": sample_size})
+    texts = [r["text"] for r in rows or []]
+    if not texts:
+        raise ValueError("No chunks to sample for this user")
+    query_texts = questions or [t[:200] for t in texts[: min(50, len(texts))]]
+    vectors = embed_documents(texts + query_texts)
+    corpus, queries = vectors[: len(texts)], vectors[len(texts) :]
+
+    native = native_embedding_dimension()
+    options = set(dims or [native // 2, native // 4, native // 8])
+    if storage_mode() == "truncated":
+        options.add(embedding_dimension())
+    return {
+        "native_dimension": native,
+        "configured_mode": storage_mode(),
+        "configured_index_dimension": embedding_dimension(),
+        "sampled_chunks": len(texts),
+        "queries": len(queries),
+        "k": k,
+        "modes": compare_modes(corpus, queries, sorted(options), k=k, oversample=environment.EMBEDDING_RESCORE_OVERSAMPLE),
+    }
+
+
 def health() -> Dict[str, Any]:
     return {"ok": get_kg().query("RETURN 1 AS ok")}
 
@@ -222,6 +298,9 @@ def _ensure_constraints():
     constraints = {
         "unique_user": "CREATE CONSTRAINT unique_user IF NOT EXISTS FOR (u:User) REQUIRE u.user_id IS UNIQUE",
         "unique_chunk": "CREATE CONSTRAINT unique_chunk IF NOT EXISTS FOR (c:Chunk) REQUIRE c.id IS UNIQUE",
+        "unique_entity": "CREATE CONSTRAINT unique_entity IF NOT EXISTS FOR (e:Entity) REQUIRE e.id IS UNIQUE",
+        "unique_chunk_content": "CREATE CONSTRAINT unique_chunk_content IF NOT EXISTS FOR (t:ChunkContent) REQUIRE t.hash IS UNIQUE",
+        "entity_user": "CREATE INDEX entity_user IF NOT EXISTS FOR (e:Entity) ON (e.user_id)",
     }
     for _, query in constraints.items():
         try:
@@ -242,285 +321,453 @@ def _split_text(text: str, chunk_size: int = 2000, chunk_overlap: int = 400) ->
     return splitter.split_text(text)
 
 
-def _create_or_get_user(user_id: str, name: str | None = None, email: str | None = None) -> str:
+MERGE_USER = register_query(
+    "merge_user",
+    """
+    MERGE (u:User {user_id: $user_id})
+    SET u.name = COALESCE($name, u.name),
+        u.email = COALESCE($email, u.email),
+        u.created_date = COALESCE(u.created_date, datetime()),
+        u.last_activity = datetime()
+    """,
+)
+
+
+def create_or_get_user(user_id: str, name: str | None = None, email: str | None = None) -> str:
     _ensure_constraints()
-    get_kg().query(
-        """
-        MERGE (u:User {user_id: $user_id})
-        SET u.name = COALESCE($name, u.name),
-            u.email = COALESCE($email, u.email),
-            u.created_date = COALESCE(u.created_date, datetime()),
-            u.last_activity = datetime()
-        """,
-        params={"user_id": user_id, "name": name, "email": email},
-    )
+    run_query(MERGE_USER, {"user_id": user_id, "name": name, "email": email})
     return user_id
 
 
-def _create_or_update_file_node(filename: str, user_id: str, chunks: List[str], metadata: Dict[str, Any]):
-    _ensure_constraints()
-    get_kg().query(
-        """
-        MERGE (f:File {user_id: $user_id, filename: $filename})
-        SET f.source = $source,
-            f.processed_date = datetime(),
-            f.total_chunks = $total_chunks,
-            f.pages_processed = $metadata.pages_processed,
-            f.images_processed = $metadata.images_processed,
-            f.successful_ocr = $metadata.successful_ocr,
-            f.failed_ocr = $metadata.failed_ocr,
-            f.extraction_errors = $metadata.extraction_errors
-        """,
-        params={
+MERGE_FILE = register_query(
+    "merge_file",
+    """
+    WITH $user_id AS user_id
+    WHERE """
+    + LEASE_FENCE
+    + """
+    MERGE (f:File {user_id: $user_id, filename: $filename})
+    SET f.source = $source,
+        f.processed_date = datetime(),
+        f.total_chunks = $total_chunks,
+        f.pages_processed = $metadata.pages_processed,
+        f.images_processed = $metadata.images_processed,
+        f.successful_ocr = $metadata.successful_ocr,
+        f.failed_ocr = $metadata.failed_ocr,
+        f.extraction_errors = $metadata.extraction_errors,
+        f.extraction_mode = $metadata.extraction_mode,
+        f.pages_rasterized = $metadata.pages_rasterized
+    RETURN count(f) AS updated
+    """,
+)
+LINK_USER_FILE = register_query(
+    "link_user_file",
+    """
+    MATCH (u:User {user_id: $user_id})
+    MATCH (f:File {user_id: $user_id, filename: $filename})
+    MERGE (u)-[:UPLOADED]->(f)
+    """,
+)
+
+
+def _merge_file_node(
+    filename: str, user_id: str, total_chunks: int, metadata: Dict[str, Any], lease: FileLease | None = None
+):
+    rows = run_query(
+        MERGE_FILE,
+        {
             "user_id": user_id,
             "filename": filename,
             "source": filename,
-            "total_chunks": len(chunks),
+            "total_chunks": total_chunks,
             "metadata": metadata,
+            "lease_token": lease.token if lease else None,
         },
     )
-    get_kg().query(
-        """
-        MATCH (u:User {user_id: $user_id})
-        MATCH (f:File {user_id: $user_id, filename: $filename})
-        MERGE (u)-[:UPLOADED]->(f)
-        """,
-        params={"user_id": user_id, "filename": filename},
-    )
-    get_kg().query(
-        """
-        MATCH (f:File {user_id: $user_id, filename: $filename})-[:HAS_CHUNK]->(c:Chunk)
-        DETACH DELETE c
-        """,
-        params={"user_id": user_id, "filename": filename},
-    )
+    # The lease was taken over by a newer holder.
+    if lease is not None and not (rows and rows[0]["updated"]):
+        raise LeaseLost(f"File '{filename}' was claimed by a newer lease than token {lease.token}")
 
 
-def _store_chunks(chunks: List[str], filename: str, user_id: str):
-    batch_size = 50
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i : i + batch_size]
-        params = [
-            {
-                "id": f"{user_id}_{filename}_chunk_{i+j}",
-                "text": chunk,
-                "chunk_index": i + j,
-                "section": f"{user_id}_{filename}_section_{(i+j)//10}",
-                "length": len(chunk),
-                "user_id": user_id,
-                "filename": filename,
-            }
-            for j, chunk in enumerate(batch)
-        ]
-        get_kg().query(
-            """
-            MATCH (f:File {user_id: $user_id, filename: $filename})
-            UNWIND $params AS param
-            CREATE (c:Chunk {id: param.id})
-            SET c.text = param.text,
-                c.chunk_index = param.chunk_index,
-                c.section = param.section,
-                c.length = param.length,
-                c.user_id = param.user_id,
-                c.filename = param.filename
-            MERGE (f)-[:HAS_CHUNK]->(c)
-            """,
-            params={"params": params, "user_id": user_id, "filename": filename},
-        )
+def _create_or_update_file_node(
+    filename: str, user_id: str, chunks: List[str], metadata: Dict[str, Any], lease: FileLease | None = None
+) -> List[str]:
+    """Create or refresh the File node and drop its old chunks. Returns the content hashes the
+    old chunks referenced, to be garbage-collected once the new chunks are stored."""
+    _ensure_constraints()
+    _merge_file_node(filename, user_id, len(chunks), metadata, lease)
+    run_query(LINK_USER_FILE, {"user_id": user_id, "filename": filename})
+    return delete_file_chunks(user_id, filename)["hashes"]
 
 
-def _create_chunk_relationships(filename: str | None = None):
-    if filename:
-        query = """
-        MATCH (f:File {filename: $filename})-[:HAS_CHUNK]->(c1:Chunk)
-        MATCH (f)-[:HAS_CHUNK]->(c2:Chunk)
-        WHERE c1.chunk_index = c2.chunk_index - 1
-        MERGE (c1)-[:NEXT]->(c2)
-        """
-        get_kg().query(query, params={"filename": filename})
-    else:
-        query = """
-        MATCH (f:File)-[:HAS_CHUNK]->(c1:Chunk)
-        MATCH (f)-[:HAS_CHUNK]->(c2:Chunk)
-        WHERE c1.chunk_index = c2.chunk_index - 1
-        MERGE (c1)-[:NEXT]->(c2)
-        """
-        get_kg().query(query)
+CREATE_CHUNKS = register_query(
+    "create_chunks",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})
+    WHERE """
+    + LEASE_FENCE
+    + """
+    UNWIND $params AS param
+    CREATE (c:Chunk {id: param.id})
+    SET c.text = param.text,
+        c.chunk_index = param.chunk_index,
+        c.section = param.section,
+        c.length = param.length,
+        c.user_id = param.user_id,
+        c.filename = param.filename
+    MERGE (f)-[:HAS_CHUNK]->(c)
+    RETURN count(c) AS created
+    """,
+)
+CREATE_DEDUP_CHUNKS = register_query(
+    "create_dedup_chunks",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})
+    WHERE """
+    + LEASE_FENCE
+    + """
+    UNWIND $params AS param
+    CREATE (c:Chunk {id: param.id})
+    SET c.chunk_index = param.chunk_index,
+        c.section = param.section,
+        c.length = param.length,
+        c.user_id = param.user_id,
+        c.filename = param.filename,
+        c.content_hash = param.hash
+    MERGE (t:ChunkContent {hash: param.hash})
+    ON CREATE SET t.text = param.text,
+                  t.length = param.length,
+                  t.created_at = datetime()
+    MERGE (f)-[:HAS_CHUNK]->(c)
+    MERGE (c)-[:HAS_CONTENT]->(t)
+    RETURN count(c) AS created
+    """,
+)
+# Links a freshly stored batch to its predecessor and within itself.
+LINK_CHUNK_RANGE = register_query(
+    "link_chunk_range",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})-[:HAS_CHUNK]->(c1:Chunk)
+    WHERE c1.chunk_index >= $start - 1 AND c1.chunk_index < $end - 1
+    MATCH (f)-[:HAS_CHUNK]->(c2:Chunk {chunk_index: c1.chunk_index + 1})
+    MERGE (c1)-[:NEXT]->(c2)
+    """,
+)
+
+
+def chunk_params(start: int, chunks: List[str], filename: str, user_id: str, dedup: bool) -> List[Dict[str, Any]]:
+    """CREATE_CHUNKS / CREATE_DEDUP_CHUNKS rows for chunks numbered from start."""
+    return [
+        {
+            "id": f"{user_id}_{filename}_chunk_{start+j}",
+            "text": chunk,
+            "chunk_index": start + j,
+            "section": f"{user_id}_{filename}_section_{(start+j)//10}",
+            "length": len(chunk),
+            "user_id": user_id,
+            "filename": filename,
+            "hash": content_hash(chunk) if dedup else None,
+        }
+        for j, chunk in enumerate(chunks)
+    ]
 
 
-def _create_vector_index_and_embeddings(filename: str | None = None):
-    dims = embedding_dimension()
-    prop = f"textEmbedding{dims}"
-    index_name = f"pdf_chunks_{dims}"
+def _store_chunk_batch(
+    start: int, chunks: List[str], filename: str, user_id: str, dedup: bool, lease: FileLease | None = None
+) -> List[str]:
+    params = chunk_params(start, chunks, filename, user_id, dedup)
+    rows = run_query(
+        CREATE_DEDUP_CHUNKS if dedup else CREATE_CHUNKS,
+        {"params": params, "user_id": user_id, "filename": filename, "lease_token": lease.token if lease else None},
+    )
+    # Nothing is created once a newer holder has taken the lease over.
+    if lease is not None and params and not (rows and rows[0]["created"]):
+        raise LeaseLost(f"Chunks for '{filename}' were fenced off from lease token {lease.token}")
+    run_query(LINK_CHUNK_RANGE, {"user_id": user_id, "filename": filename, "start": start, "end": start + len(chunks)})
+    return [param["id"] for param in params]
+
+
+def _missing_embedding_query(space: EmbeddingSpace | None = None) -> str:
+    prop = (space or configured_space()).vector_property
+    return f"""
+    UNWIND $ids AS id
+    MATCH (c:Chunk {{id: id}})
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH c, coalesce(shared, c) AS t
+    WHERE t.{prop} IS NULL
+    RETURN c.id AS id, t.text AS text, t.hash AS hash
+    """
+
+
+CHUNKS_MISSING_EMBEDDING = register_query("chunks_missing_embedding", _missing_embedding_query)
+
+
+def ensure_search_indexes(spaces: List[EmbeddingSpace]):
+    """Create the full-text indexes and the vector indexes of spaces where missing."""
     get_kg().query(
         f"""
-        CREATE VECTOR INDEX {index_name} IF NOT EXISTS
-        FOR (c:Chunk) ON (c.{prop})
-        OPTIONS {{
-            indexConfig: {{
-                `vector.dimensions`: $dims,
-                `vector.similarity_function`: 'cosine'
-            }}
-        }}
-        """,
-        params={"dims": dims},
+        CREATE FULLTEXT INDEX {FULLTEXT_INDEX_NAME} IF NOT EXISTS
+        FOR (c:Chunk) ON EACH [c.text]
+        """
     )
-    if filename:
-        chunks = get_kg().query(
-            f"""
-            MATCH (f:File {{filename: $filename}})-[:HAS_CHUNK]->(c:Chunk)
-            WHERE c.{prop} IS NULL 
-            RETURN c.id AS id, c.text AS text, f.filename AS filename
-            """,
-            params={"filename": filename},
-        )
-    else:
-        chunks = get_kg().query(
+    if dedup_enabled():
+        get_kg().query(
             f"""
-            MATCH (f:File)-[:HAS_CHUNK]->(c:Chunk)
-            WHERE c.{prop} IS NULL 
-            RETURN c.id AS id, c.text AS text, f.filename AS filename
+            CREATE FULLTEXT INDEX {CONTENT_FULLTEXT_INDEX_NAME} IF NOT EXISTS
+            FOR (t:ChunkContent) ON EACH [t.text]
             """
         )
-    for chunk in chunks:
-        vec = embed_text(chunk["text"]) if chunk.get("text") else None
-        if vec is None:
-            continue
-        get_kg().query(
-            f"MATCH (c:Chunk {{id: $id}}) SET c.{prop} = $embedding",
-            params={"id": chunk["id"], "embedding": vec},
-        )
+    for space in spaces:
+        ensure_vector_index(space)
+
 
+class _ChunkBatcher:
+    """Splits streamed text into chunks and groups them into (start_index, chunks) batches.
 
-def _process_text_file(text: str, filename: str, user_id: str, metadata: Dict[str, Any]) -> int:
-    chunks = _split_text(text)
-    _create_or_update_file_node(filename, user_id, chunks, metadata)
-    _store_chunks(chunks, filename, user_id)
-    _create_chunk_relationships(filename)
-    _create_vector_index_and_embeddings(filename)
-    return len(chunks)
+    Text is split once a window of several chunks has accumulated; the last chunk of each
+    window is held back and re-split with the text that follows, so chunk boundaries and
+    overlap match splitting the whole text up to small differences at window edges.
+    """
+
+    def __init__(self, batch_size: int, chunk_size: int = 2000, window_chunks: int = 8):
+        self.batch_size = max(1, batch_size)
+        self.window = chunk_size * window_chunks
+        self.buffer = ""
+        self.pending: List[str] = []
+        self.total = 0
+
+    def _batches(self, final: bool) -> List[Tuple[int, List[str]]]:
+        batches = []
+        while len(self.pending) >= self.batch_size or (final and self.pending):
+            batch, self.pending = self.pending[: self.batch_size], self.pending[self.batch_size :]
+            batches.append((self.total, batch))
+            self.total += len(batch)
+        return batches
+
+    def feed(self, text: str) -> List[Tuple[int, List[str]]]:
+        self.buffer = f"{self.buffer} {text}" if self.buffer else text
+        if len(self.buffer) >= self.window:
+            chunks = _split_text(self.buffer)
+            self.pending.extend(chunks[:-1])
+            self.buffer = chunks[-1] if chunks else ""
+        return self._batches(final=False)
+
+    def flush(self) -> List[Tuple[int, List[str]]]:
+        if self.buffer:
+            self.pending.extend(_split_text(self.buffer))
+            self.buffer = ""
+        return self._batches(final=True)
+
+
+def _process_text_file(
+    segments: Iterable[str],
+    filename: str,
+    user_id: str,
+    metadata: Dict[str, Any] | Callable[[], Dict[str, Any]],
+    size: int | None = None,
+    file_type: str | None = None,
+    lease: FileLease | None = None,
+) -> Dict[str, Any]:
+    """Chunk, store and embed a file as a pipeline: while one batch is embedded, the previous
+    one is written and the next one is extracted and split. segments may be a lazy source
+    (e.g. PDF pages); metadata may be a callable evaluated once the source is exhausted.
+    With a lease, every stage stops once the lease is lost, and every write is fenced by its token."""
+    started = time.monotonic()
+    replaced_hashes = _create_or_update_file_node(filename, user_id, [], {}, lease)
+    # While a re-embedding migration is pending, new chunks go into both spaces.
+    spaces = write_spaces()
+    ensure_search_indexes(spaces)
+    dedup = dedup_enabled()
+    batcher = _ChunkBatcher(environment.INGEST_BATCH_SIZE)
+
+    def check_lease() -> None:
+        if lease is not None:
+            lease.check()
+
+    def store(batch: Tuple[int, List[str]]) -> List[Tuple[List[str], List[str]]]:
+        start, chunks = batch
+        return [(_store_chunk_batch(start, chunks, filename, user_id, dedup, lease), chunks)]
+
+    def mentions(stored: Tuple[List[str], List[str]]) -> List[List[str]]:
+        check_lease()
+        chunk_ids, chunks = stored
+        write_mentions(user_id, filename, chunk_ids, chunks, lease)
+        return [chunk_ids]
+
+    def embed(chunk_ids: List[str]) -> List[Tuple[EmbeddingSpace, Any]]:
+        # Shared content that is already embedded (e.g. the same PDF uploaded elsewhere) is skipped.
+        check_lease()
+        embedded = []
+        for space in spaces:
+            rows = run_query(CHUNKS_MISSING_EMBEDDING, {"ids": chunk_ids}, space=space)
+            vectors = embed_rows(space, rows)
+            if vectors:
+                embedded.append((space, vectors))
+        return embedded
+
+    def write(item: Tuple[EmbeddingSpace, Any]) -> List[Any]:
+        space, vectors = item
+        check_lease()
+        store_embedded(space, vectors, lease)
+        return [item]
+
+    report = run_pipeline_sync(
+        segments,
+        [
+            Stage("split", batcher.feed, batcher.flush),
+            Stage("store", store),
+            Stage("entities", mentions),
+            Stage("embed", embed),
+            Stage("write", write),
+        ],
+        queue_size=environment.INGEST_QUEUE_SIZE,
+    )
+    _merge_file_node(filename, user_id, batcher.total, metadata() if callable(metadata) else metadata, lease)
+    remove_orphan_content(replaced_hashes)
+    record_ingest(user_id, filename, batcher.total, time.monotonic() - started, size, file_type)
+    schedule_similarity(user_id, filename)
+    return {"chunks": batcher.total, "pipeline": report}
 
 
 def _create_file_knowledge_graph(
     user_id: str, filename: str, file_contents: bytes, content_type: str | None = None
 ) -> Dict[str, Any]:
     try:
-        _create_or_get_user(user_id)
-        text: str | None = None
-        file_type: str | None = None
-
-        if filename.lower().endswith(".pdf") or (content_type and "pdf" in content_type.lower()):
-            temp_pdf_path = f"/tmp/{filename}"
-            with open(temp_pdf_path, "wb") as f:
-                f.write(file_contents)
-            try:
-                pdf_text, stats = extract_text_from_pdf(temp_pdf_path, languages=["eng"])
-                metadata = {
+        create_or_get_user(user_id)
+        # Serializes ingests (and deletes) of this file across every replica and worker.
+        with file_lease(user_id, filename) as lease:
+            return _ingest_file(user_id, filename, file_contents, content_type, lease)
+    except LeaseBusy:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"Error processing file '{filename}': {str(e)}", "error": str(e)}
+
+
+def _ingest_file(
+    user_id: str, filename: str, file_contents: bytes, content_type: str | None, lease: FileLease
+) -> Dict[str, Any]:
+    text: str | None = None
+    file_type: str | None = None
+
+    if filename.lower().endswith(".pdf") or (content_type and "pdf" in content_type.lower()):
+        temp_pdf_path = f"/tmp/{filename}"
+        with open(temp_pdf_path, "wb") as f:
+            f.write(file_contents)
+        try:
+            stats: Dict[str, Any] = {}
+            pages = iter_pdf_text(
+                temp_pdf_path,
+                languages=["eng"],
+                statistics=stats,
+                mode=environment.PDF_EXTRACTION_MODE,
+                sparse_chars=environment.PDF_SPARSE_TEXT_CHARS,
+                scan_coverage=environment.PDF_SCAN_IMAGE_COVERAGE,
+            )
+
+            def metadata() -> Dict[str, Any]:
+                return {
                     "pages_processed": stats["total_pages"],
                     "images_processed": stats["total_images"],
                     "successful_ocr": stats["successful_ocr"],
                     "failed_ocr": stats["failed_ocr"],
                     "extraction_errors": len(stats["errors"]),
+                    "extraction_mode": stats["extraction_mode"],
+                    "pages_rasterized": stats["pages_rasterized"],
                 }
-                chunks_count = _process_text_file(pdf_text, filename, user_id, metadata)
+
+            result = _process_text_file(pages, filename, user_id, metadata, len(file_contents), "pdf", lease)
+            os.remove(temp_pdf_path)
+            extraction = {
+                key: stats[key]
+                for key in ("extraction_mode", "decisions", "pages_rasterized", "images_skipped",
+                            "successful_ocr", "failed_ocr", "page_decisions")
+            }
+            return {
+                "status": "success",
+                "processed_filename": filename,
+                **result,
+                "file_type": "pdf",
+                "extraction": extraction,
+            }
+        except Exception as e:
+            if os.path.exists(temp_pdf_path):
                 os.remove(temp_pdf_path)
-                return {"status": "success", "processed_filename": filename, "chunks": chunks_count, "file_type": "pdf"}
-            except Exception as e:
-                if os.path.exists(temp_pdf_path):
-                    os.remove(temp_pdf_path)
-                raise e
-        elif filename.lower().endswith((".png", ".jpg", ".jpeg", ".tiff", ".bmp", ".gif")) or (
-            content_type and "image" in content_type.lower()
-        ):
-            text = extract_text_from_image(file_contents)
+            raise e
+    elif filename.lower().endswith((".png", ".jpg", ".jpeg", ".tiff", ".bmp", ".gif")) or (
+        content_type and "image" in content_type.lower()
+    ):
+        image_stats: Dict[str, Any] = {}
+        frames = iter_image_text(file_contents, languages=["eng"], statistics=image_stats)
+
+        def image_metadata() -> Dict[str, Any]:
+            return {
+                "pages_processed": image_stats["frames"],
+                "images_processed": image_stats["frames"],
+                "successful_ocr": image_stats["successful_ocr"],
+                "failed_ocr": image_stats["failed_ocr"],
+                "extraction_errors": len(image_stats["errors"]),
+            }
+
+        result = _process_text_file(frames, filename, user_id, image_metadata, len(file_contents), "image", lease)
+        extraction = {key: image_stats[key] for key in ("frames", "frames_reduced", "successful_ocr", "failed_ocr")}
+        return {
+            "status": "success",
+            "processed_filename": filename,
+            **result,
+            "file_type": "image",
+            "extraction": extraction,
+        }
+    else:
+        try:
+            text = file_contents.decode("utf-8")
             metadata = {
                 "pages_processed": 1,
-                "images_processed": 1,
-                "successful_ocr": 1 if text else 0,
-                "failed_ocr": 0 if text else 1,
+                "images_processed": 0,
+                "successful_ocr": 1,
+                "failed_ocr": 0,
                 "extraction_errors": 0,
             }
-            chunks_count = _process_text_file(text or "", filename, user_id, metadata)
-            return {"status": "success", "processed_filename": filename, "chunks": chunks_count, "file_type": "image"}
-        else:
-            try:
-                text = file_contents.decode("utf-8")
-                metadata = {
-                    "pages_processed": 1,
-                    "images_processed": 0,
-                    "successful_ocr": 1,
-                    "failed_ocr": 0,
-                    "extraction_errors": 0,
-                }
-                file_type = "text"
-            except Exception:
-                text = None
-                file_type = "other"
-                metadata = None
-
-        if text:
-            chunks_count = _process_text_file(text, filename, user_id, metadata or {})
-            return {"status": "success", "processed_filename": filename, "chunks": chunks_count, "file_type": file_type}
-        else:
-            return {"status": "success", "message": f"File '{filename}' registered (unprocessed)", "file_type": file_type}
-    except Exception as e:
-        return {"status": "error", "message": f"Error processing file '{filename}': {str(e)}", "error": str(e)}
-
+            file_type = "text"
+        except Exception:
+            text = None
+            file_type = "other"
+            metadata = None
 
-def _build_retriever(user_id: str, filenames: List[str] | None):
-    dims = embedding_dimension()
-    prop = f"textEmbedding{dims}"
-    index_name = f"pdf_chunks_{dims}"
-    if filenames:
-        filenames_str = ", ".join([f'"{f}"' for f in filenames])
-        file_filter = f"AND f.filename IN [{filenames_str}]"
+    if text:
+        result = _process_text_file(
+            [text], filename, user_id, metadata or {}, len(file_contents), file_type, lease
+        )
+        return {"status": "success", "processed_filename": filename, **result, "file_type": file_type}
     else:
-        file_filter = ""
-
-    retrieval_query = f"""
-    MATCH (u:User {{user_id: '{user_id}'}})-[:UPLOADED]->(f:File)-[:HAS_CHUNK]->(c:Chunk)
-    WHERE c.{prop} IS NOT NULL {file_filter}
-    WITH f, c, gds.similarity.cosine(c.{prop}, $embedding) AS score
-    WITH f, c, score WHERE score > 0.7
-    ORDER BY score DESC
-    LIMIT 5
-    MATCH (f)-[:HAS_CHUNK]->(context:Chunk)
-    WHERE context.section = c.section
-    WITH f, c, score, COLLECT(DISTINCT context.text) as contextTexts
-    RETURN 
-        c.text + '\n\n' + apoc.text.join(contextTexts, ' ') AS text,
-        score,
-        {{
-            source: f.source,
-            filename: f.filename,
-            user_id: f.user_id,
-            chunk_index: c.chunk_index,
-            section: c.section,
-            id: c.id
-        }} AS metadata
-    ORDER BY score DESC
-    """
-
-    vector_store = Neo4jVector.from_existing_index(
-        embedding=get_embeddings(),
-        url=NEO4J_URI,
-        username=NEO4J_USER,
-        password=NEO4J_PASS,
-        index_name=index_name,
-        text_node_property="text",
-        retrieval_query=retrieval_query,
+        return {"status": "success", "message": f"File '{filename}' registered (unprocessed)", "file_type": file_type}
+
+
+def _build_retriever(
+    user_id: str,
+    filenames: List[str] | None,
+    mode: str | None = None,
+    k: int | None = None,
+    mmr_lambda: float | None = None,
+):
+    return ChunkRetriever(
+        user_id=user_id,
+        filenames=filenames,
+        k=k or environment.QA_TOP_K,
+        score_threshold=0.7,
+        mode=mode,
+        mmr_lambda=mmr_lambda,
     )
-    return vector_store.as_retriever(search_kwargs={"k": 5, "score_threshold": 0.7})
 
 
-def ask_question(user_id: str, question: str, filenames: List[str] | None = None) -> Dict[str, Any]:
-    retriever = _build_retriever(user_id, filenames)
+def _build_llm():
     if environment.EMBEDDINGS_PROVIDER.strip().lower() == "ollama":
         if ChatOllama is None:
             raise RuntimeError("Ollama chat model not available in current environment")
-        llm = ChatOllama(model=environment.OLLAMA_CHAT_MODEL, temperature=0, base_url=environment.OLLAMA_BASE_URL)
-    else:
-        llm = ChatOpenAI(temperature=0)
+        return ChatOllama(model=environment.OLLAMA_CHAT_MODEL, temperature=0, base_url=environment.OLLAMA_BASE_URL)
+    return ChatOpenAI(temperature=0)
+
+
+def _run_qa_chain(llm, retriever, question: str) -> Dict[str, Any]:
     qa_chain = RetrievalQAWithSourcesChain.from_chain_type(
         llm,
         chain_type="stuff",
@@ -538,6 +785,9 @@ def ask_question(user_id: str, question: str, filenames: List[str] | None = None
                 "section": doc.metadata.get("section", "Unknown"),
                 "chunk_index": doc.metadata.get("chunk_index", "Unknown"),
                 "chunk_id": doc.metadata.get("id", "Unknown"),
+                # Set when retrieval ran the MMR diversity stage.
+                "similarity": doc.metadata.get("similarity"),
+                "diversity": doc.metadata.get("diversity"),
             }
         )
 
@@ -548,3 +798,84 @@ def ask_question(user_id: str, question: str, filenames: List[str] | None = None
         "sources": sources,
         "total_sources": len(sources),
     }
+
+
+def ask_question(
+    user_id: str,
+    question: str,
+    filenames: List[str] | None = None,
+    mode: str | None = None,
+    k: int | None = None,
+    mmr_lambda: float | None = None,
+) -> Dict[str, Any]:
+    retriever = _build_retriever(user_id, filenames, mode, k, mmr_lambda)
+    return _run_qa_chain(_build_llm(), retriever, question)
+
+
+def ask_questions(user_id: str, questions: List[str], filenames: List[str] | None = None) -> Dict[str, Any]:
+    """Answer many questions at once.
+
+    All questions are embedded in one embed_documents call, retrievals run concurrently over
+    the shared Neo4j driver, and generation fans out to the LLM with at most
+    QA_BATCH_LLM_CONCURRENCY calls in flight. Each result has the ask_question shape, or
+    {"status": "error", "question", "error"} for questions that failed.
+    """
+    if len(questions) > environment.QA_BATCH_MAX_QUESTIONS:
+        raise ValueError(f"At most {environment.QA_BATCH_MAX_QUESTIONS} questions per batch")
+    results: List[Dict[str, Any] | None] = [None] * len(questions)
+    pending = []
+    for i, question in enumerate(questions):
+        if not isinstance(question, str) or not question.strip():
+            results[i] = {"status": "error", "question": question, "error": "Question cannot be empty"}
+        else:
+            pending.append(i)
+
+    timings: Dict[str, float] = {}
+    started = time.monotonic()
+    space = serving_space()
+    vectors = embed_documents([questions[i] for i in pending], space) if pending else []
+    timings["embed_seconds"] = round(time.monotonic() - started, 3)
+
+    def retrieve(i: int, vector: List[float]):
+        return retrieve_documents(
+            user_id, questions[i], vector, filenames, k=environment.QA_TOP_K, score_threshold=0.7, space=space
+        )
+
+    started = time.monotonic()
+    documents: Dict[int, Any] = {}
+    with ThreadPoolExecutor(max_workers=environment.QA_BATCH_RETRIEVAL_CONCURRENCY, thread_name_prefix="qa-retrieve") as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, retrieve, i, vector): i for i, vector in zip(pending, vectors)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                documents[i] = future.result()
+            except Exception as e:
+                results[i] = {"status": "error", "question": questions[i], "error": f"Retrieval failed: {e}"}
+    timings["retrieval_seconds"] = round(time.monotonic() - started, 3)
+
+    started = time.monotonic()
+    llm = _build_llm()
+    with ThreadPoolExecutor(max_workers=environment.QA_BATCH_LLM_CONCURRENCY, thread_name_prefix="qa-generate") as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, _run_qa_chain, llm, StaticRetriever(documents=docs), questions[i]): i
+            for i, docs in documents.items()
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = {"status": "error", "question": questions[i], "error": f"Generation failed: {e}"}
+    timings["generation_seconds"] = round(time.monotonic() - started, 3)
+
+    failed = sum(1 for r in results if r and r["status"] == "error")
+    return {
+        "status": "success",
+        "results": results,
+        "total": len(questions),
+        "succeeded": len(questions) - failed,
+        "failed": failed,
+        "timings": timings,
+    }
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import environment
+from database.queries import register_query, run_query
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# One FileLease node per (user_id, filename) serializes ingest and deletion of that file across
+# replicas and workers. Expiry uses the Neo4j server clock (timestamp()), so replicas' clocks do
+# not need to agree. Every acquisition increments the node's token, and writes carry the token
+# they were issued: once a lease expires and is taken over, the old holder's writes no longer
+# match (fencing). Lease nodes are never deleted, so tokens only ever grow.
+
+# Guard for writes on behalf of a lease: true when $lease_token is still the current token of
+# the lease on ($user_id, $filename), or when the write is not made under a lease at all.
+LEASE_FENCE = """(
+        $lease_token IS NULL
+        OR EXISTS { MATCH (fence:FileLease {user_id: $user_id, filename: $filename}) WHERE fence.token = $lease_token }
+    )"""
+
+# Setting _lock first takes the node's write lock, so the expiry check and the takeover cannot
+# interleave with another replica's.
+ACQUIRE_FILE_LEASE = register_query(
+    "acquire_file_lease",
+    """
+    MERGE (l:FileLease {user_id: $user_id, filename: $filename})
+    SET l._lock = true
+    WITH l, timestamp() AS now
+    WITH l, now, (l.expires_at IS NULL OR l.expires_at <= now) AS free
+    SET l.token = CASE WHEN free THEN coalesce(l.token, 0) + 1 ELSE l.token END,
+        l.owner = CASE WHEN free THEN $owner ELSE l.owner END,
+        l.acquired_at = CASE WHEN free THEN now ELSE l.acquired_at END,
+        l.expires_at = CASE WHEN free THEN now + $ttl_ms ELSE l.expires_at END
+    REMOVE l._lock
+    RETURN free AS acquired, l.token AS token, l.owner AS owner, l.expires_at - now AS remaining_ms
+    """,
+)
+# Renewing needs only the token to be unchanged: an expired lease nobody has taken over is
+# still safe to extend.
+RENEW_FILE_LEASE = register_query(
+    "renew_file_lease",
+    """
+    MATCH (l:FileLease {user_id: $user_id, filename: $filename})
+    SET l._lock = true
+    WITH l, l.token = $token AS held
+    SET l.expires_at = CASE WHEN held THEN timestamp() + $ttl_ms ELSE l.expires_at END
+    REMOVE l._lock
+    RETURN held
+    """,
+)
+RELEASE_FILE_LEASE = register_query(
+    "release_file_lease",
+    """
+    MATCH (l:FileLease {user_id: $user_id, filename: $filename})
+    WHERE l.token = $token
+    SET l.expires_at = 0, l.owner = null
+    """,
+)
+ACTIVE_FILE_LEASES = register_query(
+    "active_file_leases",
+    """
+    MATCH (l:FileLease)
+    WHERE l.expires_at > timestamp() AND ($user_id IS NULL OR l.user_id = $user_id)
+    RETURN l.user_id AS user_id, l.filename AS filename, l.owner AS owner, l.token AS token,
+           l.acquired_at AS acquired_at, l.expires_at - timestamp() AS remaining_ms
+    ORDER BY l.user_id, l.filename
+    """,
+)
+
+_constraint_ready = False
+
+
+def _ensure_lease_constraint() -> None:
+    # Without it, two replicas creating the lease for a new file could both MERGE a node.
+    global _constraint_ready
+    if _constraint_ready:
+        return
+    from database.neo import get_kg
+
+    try:
+        get_kg().query(
+            "CREATE CONSTRAINT unique_file_lease IF NOT EXISTS "
+            "FOR (l:FileLease) REQUIRE (l.user_id, l.filename) IS UNIQUE"
+        )
+        _constraint_ready = True
+    except Exception:
+        pass
+
+
+class LeaseBusy(Exception):
+    """Raised when another process holds a file's lease for longer than the caller would wait."""
+
+    def __init__(self, user_id: str, filename: str, owner: str | None, retry_after: int):
+        super().__init__(f"File '{filename}' is being processed by {owner or 'another worker'}")
+        self.user_id = user_id
+        self.filename = filename
+        self.owner = owner
+        self.retry_after = retry_after
+
+
+class LeaseLost(Exception):
+    """Raised when a lease expired and was taken over while its holder was still working."""
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class FileLease:
+    """A held lease. A daemon thread renews it every ttl/3 seconds; if a renewal finds the
+    token changed, the lease is marked lost and check() raises from then on."""
+
+    def __init__(self, user_id: str, filename: str, owner: str, token: int, ttl: float, heartbeat: bool = True):
+        self.user_id = user_id
+        self.filename = filename
+        self.owner = owner
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._released = threading.Event()
+        self._heartbeat: threading.Thread | None = None
+        if heartbeat:
+            self._heartbeat = threading.Thread(target=self._renew_loop, name=f"lease-{filename}", daemon=True)
+            self._heartbeat.start()
+
+    def _params(self) -> Dict[str, Any]:
+        return {"user_id": self.user_id, "filename": self.filename, "token": self.token}
+
+    def renew(self) -> bool:
+        rows = run_query(RENEW_FILE_LEASE, {**self._params(), "ttl_ms": int(self.ttl * 1000)})
+        if not rows or not rows[0]["held"]:
+            self.lost = True
+        return not self.lost
+
+    def _renew_loop(self) -> None:
+        while not self._released.wait(self.ttl / 3):
+            try:
+                if not self.renew():
+                    logger.warning(f"Lease on {self.user_id}/{self.filename} (token {self.token}) was taken over")
+                    return
+            except Exception as e:
+                # Transient: the lease stays valid until its expiry, and the next round retries.
+                logger.warning(f"Could not renew lease on {self.user_id}/{self.filename}: {e}")
+
+    def check(self) -> None:
+        if self.lost:
+            raise LeaseLost(f"Lease on '{self.filename}' (token {self.token}) was lost")
+
+    def release(self) -> None:
+        self._released.set()
+        if self.lost:
+            return
+        try:
+            run_query(RELEASE_FILE_LEASE, self._params())
+        except Exception as e:
+            # The lease then simply expires after its TTL.
+            logger.warning(f"Could not release lease on {self.user_id}/{self.filename}: {e}")
+
+
+def acquire_file_lease(
+    user_id: str,
+    filename: str,
+    ttl: float | None = None,
+    wait: float | None = None,
+    heartbeat: bool = True,
+) -> FileLease:
+    """Take the lease for a file, polling for up to wait seconds while someone else holds it."""
+    ttl = ttl or environment.FILE_LEASE_TTL_SECONDS
+    wait = environment.FILE_LEASE_WAIT_SECONDS if wait is None else wait
+    _ensure_lease_constraint()
+    owner = _owner()
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            rows = run_query(
+                ACQUIRE_FILE_LEASE,
+                {"user_id": user_id, "filename": filename, "owner": owner, "ttl_ms": int(ttl * 1000)},
+            )
+        except Exception as e:
+            # Two first-time MERGEs of the same lease race on the constraint; the loser retries.
+            if "ConstraintValidationFailed" not in str(e) or time.monotonic() >= deadline:
+                raise
+            continue
+        row = rows[0]
+        if row["acquired"]:
+            return FileLease(user_id, filename, owner, row["token"], ttl, heartbeat)
+        remaining = max(0.0, (row["remaining_ms"] or 0) / 1000)
+        if time.monotonic() >= deadline:
+            raise LeaseBusy(user_id, filename, row["owner"], max(1, int(remaining + 0.999)))
+        time.sleep(min(environment.FILE_LEASE_POLL_SECONDS, remaining + 0.01, max(0.0, deadline - time.monotonic())))
+
+
+@contextmanager
+def file_lease(user_id: str, filename: str, ttl: float | None = None, wait: float | None = None) -> Iterator[FileLease]:
+    lease = acquire_file_lease(user_id, filename, ttl, wait)
+    try:
+        yield lease
+    finally:
+        lease.release()
+
+
+def active_leases(user_id: str | None = None) -> List[Dict[str, Any]]:
+    return run_query(ACTIVE_FILE_LEASES, {"user_id": user_id}) or []
+
+
+__all__ = [
+    "LEASE_FENCE",
+    "FileLease",
+    "LeaseBusy",
+    "LeaseLost",
+    "acquire_file_lease",
+    "active_leases",
+    "file_lease",
+]
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+_DONE = object()
+_recent_runs: deque = deque(maxlen=20)
+_recent_lock = threading.Lock()
+
+
+class Stage:
+    """One pipeline step. fn maps an input item to a list of output items; flush, if given,
+    is called once after the last input and returns any remaining outputs."""
+
+    def __init__(self, name: str, fn: Callable[[Any], List[Any]], flush: Optional[Callable[[], List[Any]]] = None):
+        self.name = name
+        self.fn = fn
+        self.flush = flush
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+        self.waiting_input = 0.0
+        self.blocked_output = 0.0
+
+    def report(self, wall: float) -> Dict[str, Any]:
+        return {
+            "stage": self.name,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_seconds": round(self.busy, 3),
+            "waiting_input_seconds": round(self.waiting_input, 3),
+            "blocked_output_seconds": round(self.blocked_output, 3),
+            "utilization": round(self.busy / wall, 3) if wall > 0 else 0.0,
+        }
+
+
+async def _emit(items: Iterable[Any], out: asyncio.Queue | None, stats: StageStats) -> None:
+    for item in items or []:
+        stats.items_out += 1
+        if out is not None:
+            started = time.monotonic()
+            await out.put(item)
+            stats.blocked_output += time.monotonic() - started
+
+
+async def _produce(source: Iterable[Any], out: asyncio.Queue, stats: StageStats) -> None:
+    # The source may block (e.g. parsing the next PDF page), so it is advanced on a worker thread.
+    iterator = iter(source)
+    while True:
+        started = time.monotonic()
+        item = await asyncio.to_thread(next, iterator, _DONE)
+        stats.busy += time.monotonic() - started
+        if item is _DONE:
+            break
+        await _emit([item], out, stats)
+    await out.put(_DONE)
+
+
+async def _work(stage: Stage, inbox: asyncio.Queue, out: asyncio.Queue | None, stats: StageStats) -> None:
+    while True:
+        started = time.monotonic()
+        item = await inbox.get()
+        stats.waiting_input += time.monotonic() - started
+        if item is _DONE:
+            if stage.flush is not None:
+                started = time.monotonic()
+                results = await asyncio.to_thread(stage.flush)
+                stats.busy += time.monotonic() - started
+                await _emit(results, out, stats)
+            if out is not None:
+                await out.put(_DONE)
+            return
+        stats.items_in += 1
+        started = time.monotonic()
+        results = await asyncio.to_thread(stage.fn, item)
+        stats.busy += time.monotonic() - started
+        await _emit(results, out, stats)
+
+
+async def run_pipeline(
+    source: Iterable[Any], stages: List[Stage], queue_size: int = 4, source_name: str = "extract"
+) -> Dict[str, Any]:
+    """Run source -> stages[0] -> ... -> stages[-1], one worker per stage, connected by bounded
+    queues. A slow stage fills its inbox and blocks the stages before it (backpressure).
+
+    Returns per-stage busy/wait times; utilization is busy time over wall time, so the stage
+    closest to 1.0 is the bottleneck.
+    """
+    queues = [asyncio.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    stats = [StageStats(source_name)] + [StageStats(stage.name) for stage in stages]
+    started = time.monotonic()
+    tasks = [asyncio.create_task(_produce(source, queues[0], stats[0]))]
+    for i, stage in enumerate(stages):
+        out = queues[i + 1] if i + 1 < len(stages) else None
+        tasks.append(asyncio.create_task(_work(stage, queues[i], out, stats[i + 1])))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    wall = time.monotonic() - started
+    reports = [s.report(wall) for s in stats]
+    run = {
+        "wall_seconds": round(wall, 3),
+        "queue_size": queue_size,
+        "stages": reports,
+        "bottleneck": max(reports, key=lambda r: r["utilization"])["stage"] if reports else None,
+    }
+    with _recent_lock:
+        _recent_runs.append(run)
+    return run
+
+
+def run_pipeline_sync(
+    source: Iterable[Any], stages: List[Stage], queue_size: int = 4, source_name: str = "extract"
+) -> Dict[str, Any]:
+    """Blocking wrapper for callers without an event loop; from inside a running loop the
+    pipeline gets its own loop on a helper thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run_pipeline(source, stages, queue_size, source_name))
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline") as pool:
+        context = contextvars.copy_context()
+        return pool.submit(context.run, asyncio.run, run_pipeline(source, stages, queue_size, source_name)).result()
+
+
+def recent_pipeline_runs() -> List[Dict[str, Any]]:
+    with _recent_lock:
+        return list(_recent_runs)
+
+
+__all__ = [
+    "Stage",
+    "run_pipeline",
+    "run_pipeline_sync",
+    "recent_pipeline_runs",
+]
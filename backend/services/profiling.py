@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+import environment
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# Opt-in per-request profiling. A profiled request gets:
+#   - a stack-sampling profile of every thread running application code while it is in
+#     flight (the request's work hops between the event loop, the shared threadpool, the ingest
+#     executor and the embedding scheduler, which a per-thread cProfile would miss), with each
+#     sample attributed to neo4j, embedding, llm or python;
+#   - the timing of each Cypher query it ran, and with plans=True its PROFILE plan.
+# Samples cover all threads, so concurrent requests show up in each other's profiles.
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_QUERIES_PER_PROFILE = 500
+MAX_STACKS = 50
+MAX_STACK_DEPTH = 40
+
+_current: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+_profiles: deque = deque(maxlen=20)
+_profiles_lock = threading.Lock()
+_sampler_lock = threading.Lock()
+
+
+def _is_app(frame: Any) -> bool:
+    path = frame.f_code.co_filename
+    return path.startswith(APP_ROOT) and "site-packages" not in path and frame.f_code.co_name != "<module>"
+
+
+def _category(frames: List[Any]) -> str:
+    """Where a sample's time goes, judged from its innermost recognizable frame."""
+    for frame in frames:
+        path = frame.f_code.co_filename.replace("\\", "/")
+        if "/neo4j/" in path:
+            return "neo4j"
+        if "chat_models" in path or "/langchain_core/language_models/" in path:
+            return "llm"
+        if "embedding" in path:
+            return "embedding"
+    return "python"
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of all threads every interval seconds.
+
+    Only stacks that pass through application code (under APP_ROOT) count, which leaves out
+    idle pool workers and the event loop waiting in select().
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+        self.started = time.monotonic()
+        self.rounds = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.functions: Counter = Counter()
+        self.categories: Counter = Counter()
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        self.started = time.monotonic()
+        while not self._stopped.wait(self.interval):
+            self.rounds += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    self._record(frame)
+
+    def _record(self, frame: Any) -> None:
+        frames: List[Any] = []
+        while frame is not None and len(frames) < MAX_STACK_DEPTH:
+            frames.append(frame)
+            frame = frame.f_back
+        if not any(_is_app(f) for f in frames):
+            return
+        names = [f"{os.path.basename(f.f_code.co_filename)}:{f.f_code.co_name}" for f in frames]
+        self.samples += 1
+        self.categories[_category(frames)] += 1
+        self.stacks[";".join(reversed(names))] += 1
+        for name in set(names):
+            self.functions[name] += 1
+
+    def stop(self) -> Dict[str, Any]:
+        self._stopped.set()
+        self.join()
+        wall = time.monotonic() - self.started
+        # Rounds run late under GIL contention, so one round stands for wall/rounds seconds
+        # rather than the nominal interval.
+        per_round = wall / self.rounds if self.rounds else 0.0
+
+        def seconds(n: int) -> float:
+            return round(n * per_round, 3)
+
+        return {
+            "interval_ms": round(self.interval * 1000, 3),
+            "wall_seconds": round(wall, 3),
+            "rounds": self.rounds,
+            "samples": self.samples,
+            "categories": {
+                name: {"samples": n, "seconds": seconds(n), "share": round(n / self.samples, 3)}
+                for name, n in self.categories.most_common()
+            },
+            "top_functions": [
+                {"function": name, "samples": n, "seconds": seconds(n)}
+                for name, n in self.functions.most_common(MAX_STACKS)
+            ],
+            # Collapsed stacks ("outer;...;inner count"), the input format of flamegraph tools.
+            "stacks": [f"{stack} {n}" for stack, n in self.stacks.most_common(MAX_STACKS)],
+        }
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, plans: bool, reason: str):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.plans = plans
+        self.reason = reason
+        self.started_at = time.time()
+        self.duration: float | None = None
+        self.status_code: int | None = None
+        self.queries: List[Dict[str, Any]] = []
+        self.dropped_queries = 0
+        self.python: Dict[str, Any] | None = None
+        self._lock = threading.Lock()
+
+    def record_query(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            if len(self.queries) >= MAX_QUERIES_PER_PROFILE:
+                self.dropped_queries += 1
+            else:
+                self.queries.append(entry)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            queries = list(self.queries)
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration, 3) if self.duration is not None else None,
+            "query_count": len(queries) + self.dropped_queries,
+            "query_seconds": round(sum(q["seconds"] for q in queries), 3),
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            queries = list(self.queries)
+        by_name: Dict[str, Dict[str, Any]] = {}
+        for q in queries:
+            entry = by_name.setdefault(q["name"], {"name": q["name"], "calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] = round(entry["seconds"] + q["seconds"], 4)
+        return {
+            **self.summary(),
+            "plans": self.plans,
+            "python": self.python,
+            "queries_by_name": sorted(by_name.values(), key=lambda e: e["seconds"], reverse=True),
+            "queries": queries,
+            "dropped_queries": self.dropped_queries,
+        }
+
+
+def current_profile() -> RequestProfile | None:
+    return _current.get()
+
+
+def profile_decision(header: str | None) -> tuple[bool, bool, str]:
+    """(profile?, with Cypher plans?, reason) for a request with the given X-Profile header."""
+    value = (header or "").strip().lower()
+    if value in ("1", "true", "yes", "plans"):
+        return True, value == "plans" or environment.PROFILE_CYPHER_PLANS, "header"
+    if environment.PROFILE_SAMPLE_RATE > 0 and random.random() < environment.PROFILE_SAMPLE_RATE:
+        return True, environment.PROFILE_CYPHER_PLANS, "sampled"
+    return False, False, ""
+
+
+def start_profile(method: str, path: str, plans: bool, reason: str):
+    """Begin profiling the current request; returns (profile, token, sampler or None)."""
+    profile = RequestProfile(method, path, plans, reason)
+    token = _current.set(profile)
+    sampler = None
+    # One sampler at a time: overlapping profiled requests still get their query timings.
+    if _sampler_lock.acquire(blocking=False):
+        sampler = StackSampler(environment.PROFILE_SAMPLE_INTERVAL_MS / 1000.0)
+        sampler.start()
+    return profile, token, sampler
+
+
+def finish_profile(profile: RequestProfile, token: Any, sampler: StackSampler | None, status_code: int | None) -> None:
+    profile.duration = time.time() - profile.started_at
+    profile.status_code = status_code
+    if sampler is not None:
+        try:
+            profile.python = sampler.stop()
+        finally:
+            _sampler_lock.release()
+    else:
+        profile.python = {"skipped": "another profiled request was being sampled"}
+    _current.reset(token)
+    with _profiles_lock:
+        _profiles.append(profile)
+    logger.info(
+        f"Profiled {profile.method} {profile.path} ({profile.profile_id}): "
+        f"{profile.duration:.3f}s, {len(profile.queries)} queries"
+    )
+
+
+def recent_profiles() -> List[Dict[str, Any]]:
+    with _profiles_lock:
+        profiles = list(_profiles)
+    return [p.summary() for p in reversed(profiles)]
+
+
+def get_profile(profile_id: str) -> Dict[str, Any] | None:
+    with _profiles_lock:
+        for profile in _profiles:
+            if profile.profile_id == profile_id:
+                return profile.describe()
+    return None
+
+
+def compact_plan(plan: Any, depth: int = 0) -> Dict[str, Any] | None:
+    """Operator tree of a PROFILE plan with rows and db hits per operator."""
+    if not plan or depth > 50:
+        return None
+    args = plan.get("args") or {}
+    return {
+        "operator": plan.get("operatorType"),
+        "rows": plan.get("rows", args.get("Rows")),
+        "db_hits": plan.get("dbHits", args.get("DbHits")),
+        "details": args.get("Details"),
+        "children": [c for c in (compact_plan(child, depth + 1) for child in plan.get("children") or []) if c],
+    }
+
+
+__all__ = [
+    "current_profile",
+    "profile_decision",
+    "start_profile",
+    "finish_profile",
+    "recent_profiles",
+    "get_profile",
+    "compact_plan",
+]
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import environment
+from database.queries import register_query, run_query
+from services.embedding_spaces import (
+    activate_space,
+    embed_and_store,
+    ensure_vector_index,
+    serving_space,
+    space_to_json,
+    target_space,
+    vector_index_state,
+)
+from services.chunk_content import dedup_enabled
+from services.embeddings import EmbeddingSpace, configured_space
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# Identifies this process as the owner of a migration; another replica may take over
+# once the owner's heartbeat is older than STALE_SECONDS.
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+STALE_SECONDS = 300
+INDEX_POLL_SECONDS = 10
+
+_job: Optional["ReembeddingJob"] = None
+_job_lock = threading.Lock()
+
+
+def _migration_key(space: EmbeddingSpace) -> str:
+    return space.vector_property + (f"+{space.compact_property}" if space.compact_property else "")
+
+
+def _missing_clause(space: EmbeddingSpace, var: str = "t") -> str:
+    clause = f"{var}.{space.vector_property} IS NULL"
+    if space.compact_property:
+        clause += f" OR {var}.{space.compact_property} IS NULL"
+    return clause
+
+
+def _pending_chunks_query(space: EmbeddingSpace | None = None) -> str:
+    # Walks chunks in id order (backed by the unique_chunk constraint index) from the checkpoint.
+    # Vectors live on the chunk's shared content node when it has one.
+    space = space or configured_space()
+    return f"""
+    MATCH (c:Chunk)
+    WHERE c.id > $cursor
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH c, coalesce(shared, c) AS t
+    WHERE t.text IS NOT NULL AND t.text <> ''
+      AND ({_missing_clause(space)})
+    RETURN c.id AS id, t.text AS text, t.hash AS hash
+    ORDER BY c.id
+    LIMIT $limit
+    """
+
+
+def _progress_query(space: EmbeddingSpace | None = None) -> str:
+    space = space or configured_space()
+    return f"""
+    MATCH (c:Chunk)
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH coalesce(shared, c) AS t
+    WHERE t.text IS NOT NULL AND t.text <> ''
+    RETURN count(t) AS total, count(t.{space.vector_property}) AS embedded
+    """
+
+
+PENDING_CHUNKS = register_query("reembed_pending_chunks", _pending_chunks_query)
+EMBEDDING_PROGRESS = register_query("reembed_progress", _progress_query)
+CLAIM_MIGRATION = register_query(
+    "reembed_claim",
+    """
+    MERGE (m:EmbeddingMigration {key: $key})
+    ON CREATE SET m.cursor = '',
+                  m.embedded = 0,
+                  m.status = 'running',
+                  m.definition = $definition,
+                  m.created_at = datetime()
+    WITH m
+    WHERE m.owner IS NULL OR m.owner = $owner
+       OR m.heartbeat_at < datetime() - duration({seconds: $stale_seconds})
+    SET m.owner = $owner,
+        m.heartbeat_at = datetime(),
+        m.status = CASE WHEN m.status = 'complete' THEN 'complete' ELSE 'running' END,
+        m.error = null
+    RETURN m.cursor AS cursor, m.status AS status, m.definition AS definition
+    """,
+)
+CHECKPOINT_MIGRATION = register_query(
+    "reembed_checkpoint",
+    """
+    MATCH (m:EmbeddingMigration {key: $key, owner: $owner})
+    SET m.cursor = $cursor,
+        m.embedded = m.embedded + $count,
+        m.heartbeat_at = datetime(),
+        m.updated_at = datetime()
+    RETURN m.cursor AS cursor
+    """,
+)
+SET_MIGRATION_STATUS = register_query(
+    "reembed_set_status",
+    """
+    MATCH (m:EmbeddingMigration {key: $key})
+    WHERE m.owner = $owner OR $owner IS NULL
+    SET m.status = $status,
+        m.error = $error,
+        m.owner = CASE WHEN $status IN ['running'] THEN m.owner ELSE null END,
+        m.updated_at = datetime(),
+        m.completed_at = CASE WHEN $status = 'complete' THEN datetime() ELSE m.completed_at END
+    """,
+)
+MIGRATION_STATE = register_query(
+    "reembed_state",
+    """
+    MATCH (m:EmbeddingMigration {key: $key})
+    RETURN m {
+        .key, .cursor, .embedded, .status, .owner, .error,
+        created_at: toString(m.created_at),
+        updated_at: toString(m.updated_at),
+        heartbeat_at: toString(m.heartbeat_at),
+        completed_at: toString(m.completed_at)
+    } AS migration
+    """,
+)
+
+
+def _set_status(key: str, status: str, error: str | None = None, owner: str | None = OWNER_ID) -> None:
+    run_query(SET_MIGRATION_STATUS, {"key": key, "status": status, "error": error, "owner": owner})
+
+
+class ReembeddingJob(threading.Thread):
+    """Re-embeds every chunk into a target space in throttled, checkpointed batches.
+
+    The checkpoint (last chunk id written) lives on an EmbeddingMigration node, so a job
+    restarted by any replica continues where the previous one stopped. QA keeps using the
+    serving space until the pass is complete and the target index is online.
+    """
+
+    def __init__(self, space: EmbeddingSpace):
+        super().__init__(name="reembedding", daemon=True)
+        self.space = space
+        self.key = _migration_key(space)
+        self.batch_size = max(1, environment.REEMBED_BATCH_SIZE)
+        self.max_per_minute = max(0, environment.REEMBED_MAX_CHUNKS_PER_MINUTE)
+        self._stop_event = threading.Event()
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.embedded = 0
+        self.batches = 0
+        self.state = "starting"
+        self.error: str | None = None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        try:
+            self._run()
+        except Exception as e:
+            self.state, self.error = "failed", str(e)
+            logger.error(f"Re-embedding into {self.key} failed: {e}")
+            try:
+                _set_status(self.key, "failed", str(e))
+            except Exception:
+                pass
+        finally:
+            self.finished_at = time.time()
+
+    def _run(self) -> None:
+        claimed = run_query(
+            CLAIM_MIGRATION,
+            {
+                "key": self.key,
+                "owner": OWNER_ID,
+                "definition": space_to_json(self.space),
+                "stale_seconds": STALE_SECONDS,
+            },
+        )
+        if not claimed:
+            self.state = "owned_elsewhere"
+            logger.info(f"Re-embedding into {self.key} is running on another replica")
+            return
+        if claimed[0]["status"] == "complete":
+            self.state = "complete"
+            return
+
+        ensure_vector_index(self.space)
+        cursor = claimed[0]["cursor"] or ""
+        self.state = "running"
+        logger.info(f"Re-embedding into {self.key} from checkpoint {cursor!r}")
+        while not self._stop_event.is_set():
+            batch_started = time.monotonic()
+            rows = run_query(PENDING_CHUNKS, {"cursor": cursor, "limit": self.batch_size}, space=self.space)
+            if not rows:
+                if cursor:
+                    # One more pass from the start picks up anything skipped (e.g. chunks
+                    # rewritten behind the cursor by a concurrent re-ingest).
+                    cursor = ""
+                    continue
+                if self._cut_over():
+                    return
+                self._stop_event.wait(INDEX_POLL_SECONDS)
+                continue
+
+            embed_and_store(self.space, rows)
+            cursor = rows[-1]["id"]
+            if not run_query(
+                CHECKPOINT_MIGRATION, {"key": self.key, "owner": OWNER_ID, "cursor": cursor, "count": len(rows)}
+            ):
+                self.state = "lost_ownership"
+                logger.warning(f"Re-embedding into {self.key} was taken over by another replica")
+                return
+            self.embedded += len(rows)
+            self.batches += 1
+
+            if self.max_per_minute:
+                budget = len(rows) * 60.0 / self.max_per_minute
+                self._stop_event.wait(max(0.0, budget - (time.monotonic() - batch_started)))
+
+        self.state = "paused"
+        _set_status(self.key, "paused")
+
+    def _cut_over(self) -> bool:
+        states = [vector_index_state(self.space)]
+        if dedup_enabled():
+            states.append(vector_index_state(self.space, content=True))
+        if any(index.get("state") != "ONLINE" for index in states):
+            self.state = "waiting_for_index"
+            return False
+        activate_space(self.space)
+        _set_status(self.key, "complete")
+        self.state = "complete"
+        logger.info(f"Re-embedding complete; QA now serves from {self.space.index_name}")
+        return True
+
+    def describe(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "state": self.state,
+            "error": self.error,
+            "alive": self.is_alive(),
+            "embedded_this_run": self.embedded,
+            "batches_this_run": self.batches,
+            "elapsed_seconds": round(elapsed, 1),
+            "chunks_per_minute": round(self.embedded * 60 / elapsed, 1) if elapsed > 0 else None,
+            "max_chunks_per_minute": self.max_per_minute or None,
+        }
+
+
+def start_migration(space: EmbeddingSpace | None = None) -> Dict[str, Any]:
+    global _job
+    space = space or target_space()
+    serving = serving_space(refresh=True)
+    if space == serving:
+        return {"status": "not_needed", "serving": space.describe()}
+    if space.vector_property == serving.vector_property or space.index_name == serving.index_name:
+        # Re-embedding into the serving property would find nothing missing and cut over at once.
+        raise ValueError(
+            f"Target space {space.provider}/{space.model} maps to the serving property {serving.vector_property}"
+        )
+    with _job_lock:
+        if _job is not None and _job.is_alive():
+            if _job.space == space:
+                return {"status": "already_running", "job": _job.describe()}
+            _job.stop()
+        _job = ReembeddingJob(space)
+        _job.start()
+    return {"status": "started", "target": space.describe()}
+
+
+def pause_migration() -> Dict[str, Any]:
+    with _job_lock:
+        job = _job
+    if job is None or not job.is_alive():
+        return {"status": "not_running"}
+    job.stop()
+    job.join(timeout=30)
+    return {"status": "paused", "job": job.describe()}
+
+
+def migration_status() -> Dict[str, Any]:
+    serving = serving_space(refresh=True)
+    target = target_space()
+    with _job_lock:
+        job = _job
+    if job is not None:
+        target = job.space
+    status: Dict[str, Any] = {
+        "serving": serving.describe(),
+        "target": target.describe(),
+        "migration_needed": target != serving,
+        "job": job.describe() if job is not None else None,
+    }
+    if target == serving:
+        return status
+
+    rows = run_query(MIGRATION_STATE, {"key": _migration_key(target)})
+    status["checkpoint"] = rows[0]["migration"] if rows else None
+    progress = run_query(EMBEDDING_PROGRESS, space=target)
+    total = progress[0]["total"] if progress else 0
+    embedded = progress[0]["embedded"] if progress else 0
+    rate = job.describe()["chunks_per_minute"] if job is not None and job.is_alive() else None
+    status["progress"] = {
+        "total_chunks": total,
+        "embedded_chunks": embedded,
+        "percent": round(100.0 * embedded / total, 2) if total else 100.0,
+        "eta_seconds": round((total - embedded) * 60 / rate) if rate else None,
+    }
+    status["target_index"] = vector_index_state(target)
+    return status
+
+
+def resume_migrations() -> None:
+    """On startup: continue an interrupted migration, or start one for a changed
+    configuration when REEMBED_AUTOSTART is set. Explicitly paused migrations stay paused."""
+    try:
+        target = target_space()
+        if target == serving_space(refresh=True):
+            return
+        rows = run_query(MIGRATION_STATE, {"key": _migration_key(target)})
+        state = rows[0]["migration"] if rows else None
+        if state is not None and state.get("status") == "paused":
+            logger.info(f"Re-embedding into {state['key']} is paused; resume via /embeddings/migration/start")
+            return
+        if state is not None or environment.REEMBED_AUTOSTART:
+            start_migration(target)
+    except Exception as e:
+        logger.error(f"Could not resume re-embedding: {e}")
+
+
+__all__ = [
+    "ReembeddingJob",
+    "start_migration",
+    "pause_migration",
+    "migration_status",
+    "resume_migrations",
+]
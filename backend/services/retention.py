@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List
+
+import environment
+from database.queries import register_query, run_query
+from services.chunk_content import remove_orphan_content
+from services.leases import LeaseBusy, file_lease
+from services.statistics import refresh_user_stats
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# Deletes run as rounds of CALL { } IN TRANSACTIONS, so no single transaction holds more than
+# DELETE_BATCH_SIZE rows (Neo4j's heap is 1 GB in docker-compose.yaml) and progress can be
+# reported between rounds. Removing a node also removes its vector and full-text index entries;
+# DETACH DELETE removes its NEXT, MENTIONS, HAS_CONTENT and SIMILAR_TO edges.
+ROUND_BATCHES = 10
+
+DELETE_FILE_CHUNKS_ROUND = register_query(
+    "delete_file_chunks_round",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})-[:HAS_CHUNK]->(c:Chunk)
+    WITH c LIMIT $round_size
+    CALL {
+        WITH c
+        OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+        WITH c, shared.hash AS hash
+        DETACH DELETE c
+        RETURN hash
+    } IN TRANSACTIONS OF $batch_size ROWS
+    RETURN count(*) AS deleted, collect(DISTINCT hash) AS hashes
+    """,
+)
+DELETE_ORPHAN_ENTITIES = register_query(
+    "delete_orphan_entities",
+    """
+    MATCH (e:Entity {user_id: $user_id})
+    WHERE NOT (e)<-[:MENTIONS]-()
+    CALL {
+        WITH e
+        DELETE e
+    } IN TRANSACTIONS OF $batch_size ROWS
+    RETURN count(*) AS deleted
+    """,
+)
+DELETE_FILE_NODE = register_query(
+    "delete_file_node",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})
+    DETACH DELETE f
+    RETURN count(*) AS deleted
+    """,
+)
+DELETE_USER_NODE = register_query(
+    "delete_user_node",
+    """
+    MATCH (u:User {user_id: $user_id})
+    DETACH DELETE u
+    RETURN count(*) AS deleted
+    """,
+)
+FILE_EXISTS = register_query(
+    "file_exists",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})
+    RETURN count(f) > 0 AS exists
+    """,
+)
+USER_FILES = register_query(
+    "user_files",
+    """
+    MATCH (f:File {user_id: $user_id})
+    RETURN f.filename AS filename
+    """,
+)
+EXPIRED_FILES = register_query(
+    "expired_files",
+    """
+    MATCH (f:File)
+    WHERE f.processed_date < datetime() - duration({days: $max_age_days})
+      AND ($user_id IS NULL OR f.user_id = $user_id)
+    RETURN f.user_id AS user_id, f.filename AS filename
+    ORDER BY f.processed_date
+    """,
+)
+
+
+def _batch_size() -> int:
+    return max(1, environment.DELETE_BATCH_SIZE)
+
+
+def delete_file_chunks(
+    user_id: str, filename: str, on_progress: Callable[[int], None] | None = None
+) -> Dict[str, Any]:
+    """Delete a file's chunks in bounded transactions. Returns the number deleted and the
+    content hashes they referenced (shared content is only removed once unreferenced)."""
+    batch_size = _batch_size()
+    deleted = 0
+    hashes: set = set()
+    while True:
+        rows = run_query(
+            DELETE_FILE_CHUNKS_ROUND,
+            {
+                "user_id": user_id,
+                "filename": filename,
+                "round_size": batch_size * ROUND_BATCHES,
+                "batch_size": batch_size,
+            },
+        )
+        row = rows[0] if rows else {"deleted": 0, "hashes": []}
+        if not row["deleted"]:
+            break
+        deleted += row["deleted"]
+        hashes.update(row["hashes"])
+        if on_progress:
+            on_progress(row["deleted"])
+    return {"chunks": deleted, "hashes": sorted(hashes)}
+
+
+def delete_orphan_entities(user_id: str) -> int:
+    rows = run_query(DELETE_ORPHAN_ENTITIES, {"user_id": user_id, "batch_size": _batch_size()})
+    return rows[0]["deleted"] if rows else 0
+
+
+class DeletionJob(threading.Thread):
+    """Deletes a list of files (and optionally their user) in the background, recording progress."""
+
+    def __init__(self, kind: str, files: List[Dict[str, str]], delete_users: List[str] | None = None):
+        super().__init__(name=f"delete-{kind}", daemon=True)
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.files = files
+        self.delete_users = delete_users or []
+        self.status = "queued"
+        self.error: str | None = None
+        self.files_done = 0
+        self.chunks_deleted = 0
+        self.contents_deleted = 0
+        self.entities_deleted = 0
+        self.files_skipped: List[str] = []
+        self.current: str | None = None
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+
+    def _progress(self, chunks: int) -> None:
+        self.chunks_deleted += chunks
+
+    def run(self) -> None:
+        self.status = "running"
+        try:
+            users = set()
+            for file in self.files:
+                self.current = file["filename"]
+                try:
+                    # Waits for an ingest of the same file on any replica to finish first.
+                    with file_lease(file["user_id"], file["filename"]):
+                        result = delete_file_chunks(file["user_id"], file["filename"], self._progress)
+                        self.contents_deleted += remove_orphan_content(result["hashes"])
+                        run_query(DELETE_FILE_NODE, {"user_id": file["user_id"], "filename": file["filename"]})
+                except LeaseBusy as e:
+                    logger.warning(f"Deletion job {self.job_id} skipped {file['filename']}: {e}")
+                    self.files_skipped.append(file["filename"])
+                    continue
+                users.add(file["user_id"])
+                self.files_done += 1
+            self.current = None
+            if self.delete_users and self.files_skipped:
+                raise RuntimeError(
+                    f"{len(self.files_skipped)} files are still being ingested; delete the user again once they finish"
+                )
+            for user_id in sorted(users | set(self.delete_users)):
+                self.entities_deleted += delete_orphan_entities(user_id)
+            for user_id in self.delete_users:
+                run_query(DELETE_USER_NODE, {"user_id": user_id})
+            for user_id in sorted(users - set(self.delete_users)):
+                refresh_user_stats(user_id)
+            self.status = "complete"
+        except Exception as e:
+            self.status, self.error = "failed", str(e)
+            logger.error(f"Deletion job {self.job_id} failed: {e}")
+        finally:
+            self.finished_at = time.time()
+
+    def describe(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "files_total": len(self.files),
+            "files_done": self.files_done,
+            "files_skipped": self.files_skipped,
+            "current_file": self.current,
+            "chunks_deleted": self.chunks_deleted,
+            "contents_deleted": self.contents_deleted,
+            "entities_deleted": self.entities_deleted,
+            "users_deleted": self.delete_users if self.status == "complete" else [],
+            "elapsed_seconds": round(elapsed, 1),
+        }
+
+
+_jobs: Dict[str, DeletionJob] = {}
+_jobs_lock = threading.Lock()
+_MAX_JOBS = 50
+
+
+def _start(job: DeletionJob) -> Dict[str, Any]:
+    with _jobs_lock:
+        if len(_jobs) >= _MAX_JOBS:
+            for job_id in [j.job_id for j in _jobs.values() if not j.is_alive()][: len(_jobs) - _MAX_JOBS + 1]:
+                _jobs.pop(job_id, None)
+        _jobs[job.job_id] = job
+    job.start()
+    return job.describe()
+
+
+def delete_file(user_id: str, filename: str) -> Dict[str, Any] | None:
+    """Start deleting one file; None when the user has no such file."""
+    rows = run_query(FILE_EXISTS, {"user_id": user_id, "filename": filename})
+    if not rows or not rows[0]["exists"]:
+        return None
+    return _start(DeletionJob("file", [{"user_id": user_id, "filename": filename}]))
+
+
+def delete_user(user_id: str) -> Dict[str, Any]:
+    files = [{"user_id": user_id, "filename": r["filename"]} for r in run_query(USER_FILES, {"user_id": user_id}) or []]
+    return _start(DeletionJob("user", files, delete_users=[user_id]))
+
+
+def apply_retention(max_age_days: int, user_id: str | None = None) -> Dict[str, Any]:
+    """Delete files processed more than max_age_days ago (optionally for one user only)."""
+    rows = run_query(EXPIRED_FILES, {"max_age_days": max_age_days, "user_id": user_id})
+    files = [{"user_id": r["user_id"], "filename": r["filename"]} for r in rows or []]
+    return _start(DeletionJob("retention", files))
+
+
+def deletion_jobs() -> List[Dict[str, Any]]:
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return [job.describe() for job in sorted(jobs, key=lambda j: j.started_at, reverse=True)]
+
+
+def deletion_job(job_id: str) -> Dict[str, Any] | None:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    return job.describe() if job else None
+
+
+__all__ = [
+    "delete_file_chunks",
+    "delete_orphan_entities",
+    "delete_file",
+    "delete_user",
+    "apply_retention",
+    "deletion_jobs",
+    "deletion_job",
+]
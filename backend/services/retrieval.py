@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import environment
+from database.queries import register_query, run_query
+from services.chunk_content import CONTENT_FULLTEXT_INDEX_NAME, dedup_enabled
+from services.context_assembly import assemble_context
+from services.diversity import diversify
+from services.embedding_spaces import serving_space
+from services.entities import entity_candidates
+from services.embeddings import EmbeddingSpace, embed_text, to_index_vector
+from services.vector_storage import rescore
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+FULLTEXT_INDEX_NAME = "pdf_chunks_text"
+
+RETRIEVAL_MODES = {"vector", "hybrid", "prefilter", "entity"}
+
+# Characters with a meaning in Lucene query syntax.
+_LUCENE_SPECIAL = re.compile(r'([+\-!(){}\[\]^"~*?:\\/&|])')
+_MAX_QUERY_TERMS = 32
+
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+
+def retrieval_mode() -> str:
+    mode = (environment.RETRIEVAL_MODE or "hybrid").strip().lower()
+    return mode if mode in RETRIEVAL_MODES else "hybrid"
+
+
+def lucene_query(text: str) -> str:
+    """Turn a question into an OR query. Identifier-like tokens (digits or inner punctuation,
+    e.g. part numbers and clause IDs) become boosted phrases so their pieces must be adjacent.
+    Other tokens are lowercased (the analyzer lowercases anyway), so a literal AND, OR or NOT
+    in the question is a search term rather than an operator."""
+    clauses: List[str] = []
+    seen = set()
+    for token in text.split():
+        token = token.strip(".,;:!?()[]{}\"'")
+        if len(token) < 2 or token.lower() in seen:
+            continue
+        seen.add(token.lower())
+        if re.search(r"\d", token) or re.search(r"\w[\-_./]\w", token):
+            clauses.append('"' + token.replace("\\", "\\\\").replace('"', '\\"') + '"^2')
+        else:
+            clauses.append(_LUCENE_SPECIAL.sub(r"\\\1", token.lower()))
+        if len(clauses) >= _MAX_QUERY_TERMS:
+            break
+    return " OR ".join(clauses)
+
+
+def _vector_candidates_query(by_ids: bool, space: EmbeddingSpace | None = None) -> str:
+    space = space or serving_space()
+    prop = space.vector_property
+    compact = space.compact_property
+    compact_return = f", t.{compact} AS compact" if compact else ""
+    if by_ids:
+        match = """
+        UNWIND $chunk_ids AS chunk_id
+        MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)-[:HAS_CHUNK]->(c:Chunk {id: chunk_id})
+        """
+    else:
+        match = """
+        MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)-[:HAS_CHUNK]->(c:Chunk)
+        """
+    # Shared content (CHUNK_DEDUP) carries the vectors for every chunk that references it.
+    return match + f"""
+        WHERE $filenames IS NULL OR f.filename IN $filenames
+        OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+        WITH c, coalesce(shared, c) AS t
+        WHERE t.{prop} IS NOT NULL
+        WITH c, t, gds.similarity.cosine(t.{prop}, $embedding) AS score
+        WHERE score > $score_threshold
+        RETURN c.id AS id, score{compact_return}
+        ORDER BY score DESC
+        LIMIT $limit
+        """
+
+
+VECTOR_CANDIDATES = register_query(
+    "vector_candidates", lambda space=None: _vector_candidates_query(by_ids=False, space=space)
+)
+VECTOR_CANDIDATES_BY_IDS = register_query(
+    "vector_candidates_by_ids", lambda space=None: _vector_candidates_query(by_ids=True, space=space)
+)
+KEYWORD_CANDIDATES_WITH_CONTENT = register_query(
+    "keyword_candidates_with_content",
+    """
+    CALL {
+        CALL db.index.fulltext.queryNodes($index_name, $query) YIELD node, score
+        RETURN node AS c, score
+        UNION ALL
+        CALL db.index.fulltext.queryNodes($content_index_name, $query) YIELD node, score
+        MATCH (c:Chunk)-[:HAS_CONTENT]->(node)
+        RETURN c, score
+    }
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)-[:HAS_CHUNK]->(c)
+    WHERE $filenames IS NULL OR f.filename IN $filenames
+    RETURN c.id AS id, score
+    ORDER BY score DESC
+    LIMIT $limit
+    """,
+)
+KEYWORD_CANDIDATES = register_query(
+    "keyword_candidates",
+    """
+    CALL db.index.fulltext.queryNodes($index_name, $query) YIELD node AS c, score
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)-[:HAS_CHUNK]->(c)
+    WHERE $filenames IS NULL OR f.filename IN $filenames
+    RETURN c.id AS id, score
+    ORDER BY score DESC
+    LIMIT $limit
+    """,
+)
+
+
+def vector_candidates(
+    user_id: str,
+    embedding: List[float],
+    filenames: List[str] | None,
+    limit: int,
+    score_threshold: float,
+    chunk_ids: List[str] | None = None,
+    space: EmbeddingSpace | None = None,
+) -> List[Dict[str, Any]]:
+    """Exact cosine scan over the user's chunks using the stored index vector.
+
+    With chunk_ids only those chunks are scored (keyword prefiltering).
+    """
+    space = space or serving_space()
+    rows = run_query(
+        VECTOR_CANDIDATES if chunk_ids is None else VECTOR_CANDIDATES_BY_IDS,
+        {
+            "user_id": user_id,
+            "filenames": filenames or None,
+            "embedding": to_index_vector(embedding, space),
+            "score_threshold": score_threshold,
+            "limit": limit,
+            "chunk_ids": chunk_ids or [],
+        },
+        space=space,
+    )
+    return [dict(r) for r in rows or []]
+
+
+def keyword_candidates(
+    user_id: str, question: str, filenames: List[str] | None, limit: int
+) -> List[Dict[str, Any]]:
+    """Lucene full-text search over chunk text, scoped to the user's files."""
+    query = lucene_query(question)
+    if not query:
+        return []
+    try:
+        rows = run_query(
+            KEYWORD_CANDIDATES_WITH_CONTENT if dedup_enabled() else KEYWORD_CANDIDATES,
+            {
+                "index_name": FULLTEXT_INDEX_NAME,
+                "content_index_name": CONTENT_FULLTEXT_INDEX_NAME,
+                "query": query,
+                "user_id": user_id,
+                "filenames": filenames or None,
+                "limit": limit,
+            },
+        )
+    except Exception as e:
+        if "ParseException" in str(e):
+            logger.error(f"Full-text query {query!r} could not be parsed, using vector results only: {e}")
+        else:
+            # The full-text index is created on ingest; older databases may not have it yet.
+            logger.warning(f"Full-text search unavailable, using vector results only: {e}")
+        return []
+    return [dict(r) for r in rows or []]
+
+
+def rescore_candidates(
+    embedding: List[float],
+    candidates: List[Dict[str, Any]],
+    score_threshold: float,
+    space: EmbeddingSpace | None = None,
+) -> List[Dict[str, Any]]:
+    """Replace index scores with exact scores from the compact full-dimension copy, where present."""
+    dtype = (space or serving_space()).compact_dtype
+    with_compact = [c for c in candidates if c.get("compact")]
+    if not dtype or not with_compact:
+        return candidates
+    exact = rescore(embedding, [c["compact"] for c in with_compact], dtype)
+    for candidate, score in zip(with_compact, exact):
+        candidate["index_score"] = candidate["score"]
+        candidate["score"] = score
+    rescored = [c for c in candidates if c["score"] > score_threshold]
+    return sorted(rescored, key=lambda c: c["score"], reverse=True)
+
+
+def reciprocal_rank_fusion(
+    ranked: Dict[str, List[Dict[str, Any]]], rrf_k: int = 60, limit: int | None = None
+) -> List[Dict[str, Any]]:
+    """Merge ranked candidate lists: score(d) = sum over lists of 1 / (rrf_k + rank(d))."""
+    fused: Dict[str, Dict[str, Any]] = {}
+    for name, candidates in ranked.items():
+        for rank, candidate in enumerate(candidates, start=1):
+            hit = fused.setdefault(candidate["id"], {"id": candidate["id"], "score": 0.0})
+            hit["score"] += 1.0 / (rrf_k + rank)
+            hit[f"{name}_score"] = candidate["score"]
+            hit[f"{name}_rank"] = rank
+    hits = sorted(fused.values(), key=lambda h: h["score"], reverse=True)
+    return hits[:limit] if limit else hits
+
+
+def _ranked_hits(
+    user_id: str,
+    question: str,
+    embedding: List[float],
+    filenames: List[str] | None,
+    k: int,
+    score_threshold: float,
+    mode: str,
+    space: EmbeddingSpace,
+) -> List[Dict[str, Any]]:
+    pool = max(k, environment.RETRIEVAL_CANDIDATES)
+    vector_limit = k * max(1, environment.EMBEDDING_RESCORE_OVERSAMPLE) if space.compact_property else k
+    if mode != "vector":
+        vector_limit = max(vector_limit, pool)
+
+    def vector_search(chunk_ids: List[str] | None = None) -> List[Dict[str, Any]]:
+        candidates = vector_candidates(user_id, embedding, filenames, vector_limit, score_threshold, chunk_ids, space)
+        return rescore_candidates(embedding, candidates, score_threshold, space)
+
+    if mode == "vector":
+        return vector_search()[:k]
+
+    if mode in ("prefilter", "entity"):
+        # Narrow the vector scan to chunks matching the question's terms (full-text) or its
+        # extracted entities (MENTIONS lookups).
+        search = keyword_candidates if mode == "prefilter" else entity_candidates
+        narrowed = search(user_id, question, filenames, environment.RETRIEVAL_PREFILTER_CANDIDATES)
+        if len(narrowed) >= k:
+            vector = vector_search([c["id"] for c in narrowed])
+            return reciprocal_rank_fusion(
+                {"vector": vector, "keyword" if mode == "prefilter" else "entity": narrowed[:pool]},
+                environment.RETRIEVAL_RRF_K,
+                limit=k,
+            )
+        # Too few matches to narrow the scan: fall back to hybrid over all chunks.
+
+    keyword_future = _SEARCH_POOL.submit(
+        contextvars.copy_context().run, keyword_candidates, user_id, question, filenames, pool
+    )
+    vector = vector_search()
+    keyword = keyword_future.result()
+    return reciprocal_rank_fusion({"vector": vector, "keyword": keyword}, environment.RETRIEVAL_RRF_K, limit=k)
+
+
+def retrieve_hits(
+    user_id: str,
+    question: str,
+    embedding: List[float],
+    filenames: List[str] | None = None,
+    k: int = 5,
+    score_threshold: float = 0.7,
+    mode: str | None = None,
+    space: EmbeddingSpace | None = None,
+    mmr_lambda: float | None = None,
+) -> List[Dict[str, Any]]:
+    """Ranked chunk ids with scores, before any text is loaded.
+
+    With MMR (RETRIEVAL_MMR, or an explicit mmr_lambda) k * RETRIEVAL_MMR_OVERSAMPLE
+    candidates are ranked and k of them kept by maximal marginal relevance. embedding must
+    come from the serving embedding space (or the given space).
+    """
+    mode = mode or retrieval_mode()
+    space = space or serving_space()
+    if mmr_lambda is None and not environment.RETRIEVAL_MMR:
+        return _ranked_hits(user_id, question, embedding, filenames, k, score_threshold, mode, space)
+    lambda_mult = environment.RETRIEVAL_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    fetch_k = k * max(1, environment.RETRIEVAL_MMR_OVERSAMPLE)
+    candidates = _ranked_hits(user_id, question, embedding, filenames, fetch_k, score_threshold, mode, space)
+    return diversify(candidates, embedding, k, lambda_mult, space)
+
+
+def retrieve_documents(
+    user_id: str,
+    question: str,
+    embedding: List[float],
+    filenames: List[str] | None = None,
+    k: int = 5,
+    score_threshold: float = 0.7,
+    mode: str | None = None,
+    space: EmbeddingSpace | None = None,
+    mmr_lambda: float | None = None,
+) -> List[Document]:
+    hits = retrieve_hits(user_id, question, embedding, filenames, k, score_threshold, mode, space, mmr_lambda)
+    return assemble_context(hits)
+
+
+class ChunkRetriever(BaseRetriever):
+    """Retriever over a user's chunks, scoped to optional filenames."""
+
+    user_id: str
+    filenames: Optional[List[str]] = None
+    k: int = 5
+    score_threshold: float = 0.7
+    mode: Optional[str] = None
+    mmr_lambda: Optional[float] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        space = serving_space()
+        return retrieve_documents(
+            self.user_id,
+            query,
+            embed_text(query, space),
+            self.filenames,
+            self.k,
+            self.score_threshold,
+            self.mode,
+            space,
+            self.mmr_lambda,
+        )
+
+
+class StaticRetriever(BaseRetriever):
+    """Returns documents retrieved ahead of time (e.g. for a batch of questions)."""
+
+    documents: List[Document] = []
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.documents
+
+
+__all__ = [
+    "FULLTEXT_INDEX_NAME",
+    "ChunkRetriever",
+    "StaticRetriever",
+    "lucene_query",
+    "retrieval_mode",
+    "vector_candidates",
+    "keyword_candidates",
+    "rescore_candidates",
+    "reciprocal_rank_fusion",
+    "retrieve_hits",
+    "retrieve_documents",
+]
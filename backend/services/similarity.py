@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import environment
+from database.queries import register_query, run_query
+from services.chunk_content import text_of
+from services.embedding_spaces import serving_space
+from services.embeddings import EmbeddingSpace
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# SIMILAR_TO edges are computed with GDS kNN over the serving vectors, one user at a time so
+# edges never cross tenants. New chunks carry the SimilarityPending label until a filtered kNN
+# run has linked them to their nearest neighbors among all of the user's chunks.
+PENDING_LABEL = "SimilarityPending"
+
+_queue: "queue.Queue[Tuple[str, bool]]" = queue.Queue()
+_queued: set = set()
+_lock = threading.Lock()
+_worker: threading.Thread | None = None
+_status: Dict[str, Any] = {"running": None, "runs": 0, "failures": 0, "last_run": None, "last_error": None}
+
+
+MARK_FILE_PENDING = register_query(
+    "similarity_mark_file_pending",
+    f"""
+    MATCH (f:File {{user_id: $user_id, filename: $filename}})-[:HAS_CHUNK]->(c:Chunk)
+    SET c:{PENDING_LABEL}
+    """,
+)
+COUNT_PENDING = register_query(
+    "similarity_count_pending",
+    f"""
+    MATCH (u:User {{user_id: $user_id}})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c:{PENDING_LABEL})
+    RETURN count(c) AS pending
+    """,
+)
+CLEAR_PENDING = register_query(
+    "similarity_clear_pending",
+    f"""
+    MATCH (u:User {{user_id: $user_id}})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c:{PENDING_LABEL})
+    WHERE c.id IN $chunk_ids
+    REMOVE c:{PENDING_LABEL}
+    """,
+)
+CLEAR_ALL_PENDING = register_query(
+    "similarity_clear_all_pending",
+    f"""
+    MATCH (u:User {{user_id: $user_id}})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c:{PENDING_LABEL})
+    REMOVE c:{PENDING_LABEL}
+    """,
+)
+DELETE_USER_SIMILARITIES = register_query(
+    "similarity_delete_user_edges",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(:Chunk)-[r:SIMILAR_TO]->()
+    DELETE r
+    """,
+)
+
+
+def _project_query(space: EmbeddingSpace | None = None) -> str:
+    prop = (space or serving_space()).vector_property
+    return f"""
+    MATCH (u:User {{user_id: $user_id}})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c:Chunk)
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH c, coalesce(shared, c) AS t
+    WITH c, t.{prop} AS embedding
+    WHERE embedding IS NOT NULL
+    WITH gds.graph.project($graph_name, c, null, {{
+        sourceNodeLabels: CASE WHEN c:{PENDING_LABEL} THEN ['Chunk', '{PENDING_LABEL}'] ELSE ['Chunk'] END,
+        sourceNodeProperties: {{embedding: embedding}}
+    }}) AS g,
+    collect(CASE WHEN c:{PENDING_LABEL} THEN c.id END) AS pending_ids
+    RETURN g.nodeCount AS node_count, pending_ids
+    """
+
+
+PROJECT_USER_CHUNKS = register_query("similarity_project_user_chunks", _project_query)
+KNN_WRITE = register_query(
+    "similarity_knn_write",
+    """
+    CALL gds.knn.write($graph_name, {
+        nodeProperties: {embedding: 'COSINE'},
+        topK: $top_k,
+        similarityCutoff: $cutoff,
+        writeRelationshipType: 'SIMILAR_TO',
+        writeProperty: 'score'
+    })
+    YIELD relationshipsWritten, nodesCompared
+    RETURN relationshipsWritten, nodesCompared
+    """,
+)
+KNN_FILTERED_WRITE = register_query(
+    "similarity_knn_filtered_write",
+    f"""
+    CALL gds.knn.filtered.write($graph_name, {{
+        nodeProperties: {{embedding: 'COSINE'}},
+        sourceNodeFilter: '{PENDING_LABEL}',
+        topK: $top_k,
+        similarityCutoff: $cutoff,
+        writeRelationshipType: 'SIMILAR_TO',
+        writeProperty: 'score'
+    }})
+    YIELD relationshipsWritten, nodesCompared
+    RETURN relationshipsWritten, nodesCompared
+    """,
+)
+DROP_GRAPH = register_query(
+    "similarity_drop_graph",
+    "CALL gds.graph.drop($graph_name, false) YIELD graphName RETURN graphName",
+)
+RELATED_CHUNKS = register_query(
+    "related_chunks",
+    f"""
+    MATCH (u:User {{user_id: $user_id}})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c:Chunk {{id: $chunk_id}})
+    MATCH (c)-[r:SIMILAR_TO]-(o:Chunk)<-[:HAS_CHUNK]-(f:File)<-[:UPLOADED]-(u)
+    WITH o, f, max(r.score) AS score
+    RETURN o.id AS id,
+           f.filename AS filename,
+           o.chunk_index AS chunk_index,
+           o.section AS section,
+           substring({text_of('o')}, 0, 200) AS text_preview,
+           score
+    ORDER BY score DESC
+    LIMIT $limit
+    """,
+)
+
+
+def compute_similarities(user_id: str, full: bool = False) -> Dict[str, Any]:
+    """Write SIMILAR_TO edges for a user's chunks.
+
+    Incremental (default): only chunks labelled SimilarityPending get new out-edges, to their
+    topK nearest among all the user's chunks. full: all of the user's edges are recomputed.
+    """
+    started = time.monotonic()
+    if not full:
+        pending = run_query(COUNT_PENDING, {"user_id": user_id})
+        if not pending or not pending[0]["pending"]:
+            return {"user_id": user_id, "mode": "incremental", "pending": 0, "relationships_written": 0}
+
+    space = serving_space()
+    graph_name = f"similarity_{uuid.uuid4().hex[:12]}"
+    params = {
+        "graph_name": graph_name,
+        "user_id": user_id,
+        "top_k": environment.SIMILARITY_TOP_K,
+        "cutoff": environment.SIMILARITY_CUTOFF,
+    }
+    try:
+        projected = run_query(PROJECT_USER_CHUNKS, params, space=space)
+        node_count = projected[0]["node_count"] if projected else 0
+        # Only pending chunks that made it into the projection (i.e. have vectors) get linked.
+        pending_ids = projected[0]["pending_ids"] if projected else []
+        if node_count < 2:
+            return {"user_id": user_id, "mode": "full" if full else "incremental", "nodes": node_count, "relationships_written": 0}
+        if full:
+            run_query(DELETE_USER_SIMILARITIES, {"user_id": user_id})
+            linked = None
+            result = run_query(KNN_WRITE, params)
+            run_query(CLEAR_ALL_PENDING, {"user_id": user_id})
+        else:
+            linked = pending_ids
+            if not linked:
+                return {"user_id": user_id, "mode": "incremental", "nodes": node_count, "relationships_written": 0}
+            result = run_query(KNN_FILTERED_WRITE, params)
+            run_query(CLEAR_PENDING, {"user_id": user_id, "chunk_ids": linked})
+    finally:
+        try:
+            run_query(DROP_GRAPH, {"graph_name": graph_name})
+        except Exception as e:
+            logger.warning(f"Could not drop projection {graph_name}: {e}")
+
+    row = result[0] if result else {}
+    return {
+        "user_id": user_id,
+        "mode": "full" if full else "incremental",
+        "nodes": node_count,
+        "linked_chunks": len(linked) if linked is not None else node_count,
+        "relationships_written": row.get("relationshipsWritten", 0),
+        "nodes_compared": row.get("nodesCompared", 0),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def _work() -> None:
+    while True:
+        user_id, full = _queue.get()
+        with _lock:
+            _queued.discard((user_id, full))
+            _status["running"] = user_id
+        try:
+            run = compute_similarities(user_id, full=full)
+            with _lock:
+                _status["runs"] += 1
+                _status["last_run"] = run
+        except Exception as e:
+            logger.error(f"Similarity update for {user_id} failed: {e}")
+            with _lock:
+                _status["failures"] += 1
+                _status["last_error"] = {"user_id": user_id, "error": str(e)}
+        finally:
+            with _lock:
+                _status["running"] = None
+            _queue.task_done()
+
+
+def schedule_similarity(user_id: str, filename: str | None = None, full: bool = False) -> bool:
+    """Queue a similarity update for the user, after marking the file's chunks as pending.
+    Returns False when similarity edges are disabled."""
+    global _worker
+    if not environment.SIMILARITY_ENABLED:
+        return False
+    if filename:
+        run_query(MARK_FILE_PENDING, {"user_id": user_id, "filename": filename})
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="similarity", daemon=True)
+            _worker.start()
+        if (user_id, full) in _queued:
+            return True
+        _queued.add((user_id, full))
+    _queue.put((user_id, full))
+    return True
+
+
+def similarity_status() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "enabled": environment.SIMILARITY_ENABLED,
+            "top_k": environment.SIMILARITY_TOP_K,
+            "cutoff": environment.SIMILARITY_CUTOFF,
+            "queued": len(_queued),
+            **_status,
+        }
+
+
+def related_chunks(user_id: str, chunk_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    rows = run_query(RELATED_CHUNKS, {"user_id": user_id, "chunk_id": chunk_id, "limit": limit})
+    return [dict(r) for r in rows or []]
+
+
+__all__ = [
+    "compute_similarities",
+    "schedule_similarity",
+    "similarity_status",
+    "related_chunks",
+]
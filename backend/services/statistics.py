@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+from database.queries import register_query, run_query
+from services.embedding_spaces import serving_space
+from services.embeddings import EmbeddingSpace
+
+
+# Counters are written when a file is ingested or deleted, so listing files and reading a
+# user's totals only touch File/User nodes, never their chunks:
+#
+#   File: total_chunks, size (bytes uploaded), embedded_chunks, last_ingest_seconds
+#   User: file_count, chunk_count, total_size, embedded_chunks, last_ingest_seconds, last_ingest_at
+FILE_SORT_FIELDS = {
+    "filename": "filename",
+    "processed_date": "processed_date",
+    "total_chunks": "total_chunks",
+    "size": "size",
+    "embedded_chunks": "embedded_chunks",
+    "last_ingest_seconds": "last_ingest_seconds",
+}
+
+
+def _embedded_count_query(space: EmbeddingSpace | None = None) -> str:
+    prop = (space or serving_space()).vector_property
+    return f"""
+    MATCH (f:File {{user_id: $user_id, filename: $filename}})-[:HAS_CHUNK]->(c:Chunk)
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH coalesce(shared, c) AS t
+    RETURN count(t.{prop}) AS embedded
+    """
+
+
+FILE_EMBEDDED_COUNT = register_query("file_embedded_count", _embedded_count_query)
+SET_FILE_STATS = register_query(
+    "set_file_stats",
+    """
+    MATCH (f:File {user_id: $user_id, filename: $filename})
+    SET f.total_chunks = $chunks,
+        f.size = coalesce($size, f.size),
+        f.file_type = coalesce($file_type, f.file_type),
+        f.embedded_chunks = $embedded,
+        f.last_ingest_seconds = $seconds
+    """,
+)
+REFRESH_USER_STATS = register_query(
+    "refresh_user_stats",
+    """
+    MATCH (u:User {user_id: $user_id})
+    OPTIONAL MATCH (u)-[:UPLOADED]->(f:File)
+    WITH u,
+         count(f) AS files,
+         sum(coalesce(f.total_chunks, 0)) AS chunks,
+         sum(coalesce(f.size, 0)) AS size,
+         sum(coalesce(f.embedded_chunks, 0)) AS embedded
+    SET u.file_count = files,
+        u.chunk_count = chunks,
+        u.total_size = size,
+        u.embedded_chunks = embedded,
+        u.last_ingest_seconds = coalesce($seconds, u.last_ingest_seconds),
+        u.last_ingest_at = CASE WHEN $seconds IS NULL THEN u.last_ingest_at ELSE datetime() END
+    """,
+)
+USER_STATISTICS = register_query(
+    "user_statistics",
+    """
+    MATCH (u:User {user_id: $user_id})
+    RETURN coalesce(u.file_count, 0) AS file_count,
+           coalesce(u.chunk_count, 0) AS chunk_count,
+           coalesce(u.total_size, 0) AS total_size,
+           coalesce(u.embedded_chunks, 0) AS embedded_chunks,
+           u.last_ingest_seconds AS last_ingest_seconds,
+           u.last_ingest_at AS last_ingest_at
+    """,
+)
+
+
+def _files_page_query(sort: str = "filename", descending: bool = False) -> str:
+    prop = FILE_SORT_FIELDS[sort]
+    return f"""
+    MATCH (u:User {{user_id: $user_id}})-[:UPLOADED]->(f:File)
+    RETURN f.filename AS filename,
+           f.file_type AS file_type,
+           f.processed_date AS processed_date,
+           f.total_chunks AS total_chunks,
+           f.size AS size,
+           f.embedded_chunks AS embedded_chunks,
+           f.last_ingest_seconds AS last_ingest_seconds
+    ORDER BY f.{prop} {"DESC" if descending else "ASC"}, f.filename
+    SKIP $offset
+    LIMIT $limit
+    """
+
+
+FILES_PAGE = register_query("files_page", _files_page_query)
+
+
+def _rebuild_query(space: EmbeddingSpace | None = None) -> str:
+    prop = (space or serving_space()).vector_property
+    return f"""
+    MATCH (f:File)
+    WHERE $user_id IS NULL OR f.user_id = $user_id
+    CALL {{
+        WITH f
+        OPTIONAL MATCH (f)-[:HAS_CHUNK]->(c:Chunk)
+        OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+        WITH f, coalesce(shared, c) AS t
+        WITH f, count(t) AS chunks, count(t.{prop}) AS embedded
+        SET f.total_chunks = chunks, f.embedded_chunks = embedded
+    }} IN TRANSACTIONS OF 100 ROWS
+    WITH DISTINCT f.user_id AS user_id
+    RETURN collect(user_id) AS user_ids
+    """
+
+
+REBUILD_FILE_STATS = register_query("rebuild_file_stats", _rebuild_query)
+
+
+def refresh_user_stats(user_id: str, ingest_seconds: float | None = None) -> None:
+    run_query(REFRESH_USER_STATS, {"user_id": user_id, "seconds": ingest_seconds})
+
+
+def record_ingest(
+    user_id: str,
+    filename: str,
+    chunks: int,
+    seconds: float,
+    size: int | None = None,
+    file_type: str | None = None,
+) -> Dict[str, Any]:
+    """Store a finished ingest's counters on its File and re-total the User from its Files."""
+    rows = run_query(FILE_EMBEDDED_COUNT, {"user_id": user_id, "filename": filename})
+    embedded = rows[0]["embedded"] if rows else 0
+    seconds = round(seconds, 3)
+    run_query(
+        SET_FILE_STATS,
+        {
+            "user_id": user_id,
+            "filename": filename,
+            "chunks": chunks,
+            "size": size,
+            "file_type": file_type,
+            "embedded": embedded,
+            "seconds": seconds,
+        },
+    )
+    refresh_user_stats(user_id, seconds)
+    return {"chunks": chunks, "size": size, "embedded_chunks": embedded, "ingest_seconds": seconds}
+
+
+def list_files_page(
+    user_id: str, offset: int = 0, limit: int = 50, sort: str = "filename", descending: bool = False
+) -> List[Dict[str, Any]]:
+    if sort not in FILE_SORT_FIELDS:
+        raise ValueError(f"Unknown sort field: {sort} (expected one of {', '.join(FILE_SORT_FIELDS)})")
+    rows = run_query(
+        FILES_PAGE,
+        {"user_id": user_id, "offset": offset, "limit": limit},
+        sort=sort,
+        descending=descending,
+    )
+    return [dict(r) for r in rows or []]
+
+
+def user_statistics(user_id: str) -> Dict[str, Any]:
+    rows = run_query(USER_STATISTICS, {"user_id": user_id})
+    if not rows:
+        return {"file_count": 0, "chunk_count": 0, "total_size": 0, "embedded_chunks": 0,
+                "last_ingest_seconds": None, "last_ingest_at": None}
+    return dict(rows[0])
+
+
+def rebuild_statistics(user_id: str | None = None) -> Dict[str, Any]:
+    """Recount chunk and embedded counters from the graph (for files ingested before the
+    counters existed, or after a re-embedding). Sizes are only known at upload and are kept."""
+    rows = run_query(REBUILD_FILE_STATS, {"user_id": user_id})
+    user_ids = rows[0]["user_ids"] if rows else []
+    for uid in user_ids:
+        refresh_user_stats(uid)
+    return {"users": len(user_ids)}
+
+
+__all__ = [
+    "FILE_SORT_FIELDS",
+    "record_ingest",
+    "refresh_user_stats",
+    "list_files_page",
+    "user_statistics",
+    "rebuild_statistics",
+]
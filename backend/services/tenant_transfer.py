@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Any, Dict, List
+
+import numpy as np
+
+import environment
+from database.queries import register_query, run_query
+from services.chunk_content import dedup_enabled, remove_orphan_content
+from services.embedding_spaces import serving_space, space_from_json, space_to_json, write_vector_rows
+from services.embeddings import EmbeddingSpace
+from services.entities import write_mentions
+from services.leases import FileLease, LeaseLost, file_lease
+from services.knowledge_graph import (
+    CREATE_CHUNKS,
+    CREATE_DEDUP_CHUNKS,
+    chunk_params,
+    create_or_get_user,
+    ensure_search_indexes,
+)
+from services.retention import delete_file_chunks
+from services.similarity import schedule_similarity
+from services.statistics import record_ingest
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# A tenant export is an uncompressed tar of column files, so an import can memory-map the
+# vectors instead of holding them in memory:
+#
+#   manifest.json       format version, source user, embedding space, row counts
+#   files.json          File node properties
+#   chunk_file.npy      int32 [n]       index into files.json
+#   chunk_index.npy     int32 [n]
+#   text_offsets.npy    int64 [n + 1]   byte offsets into texts.bin (UTF-8)
+#   texts.bin
+#   has_vector.npy      bool [n]
+#   vectors.npy         float32 [n, index_dims]   the serving space's index vectors
+#   compact.npy         int8/float16 [n, native_dims]   only for spaces with a compact copy
+#   next.npy            int64 [e, 2]    NEXT edges as (row, row)
+#
+# Chunk ids, sections and content hashes are derived, so they are rebuilt for the target user.
+FORMAT = "doc2graph-tenant"
+FORMAT_VERSION = 1
+_MEMBERS = {
+    "manifest.json", "files.json", "chunk_file.npy", "chunk_index.npy", "text_offsets.npy",
+    "texts.bin", "has_vector.npy", "vectors.npy", "compact.npy", "next.npy",
+}
+_FILE_SKIP_PROPERTIES = {"user_id", "filename", "processed_date"}
+
+
+EXPORT_FILES = register_query(
+    "export_files",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(f:File)
+    RETURN properties(f) AS props
+    ORDER BY f.filename
+    """,
+)
+COUNT_USER_CHUNKS = register_query(
+    "count_user_chunks",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c:Chunk)
+    RETURN count(c) AS chunks
+    """,
+)
+
+
+def _export_chunks_query(space: EmbeddingSpace | None = None) -> str:
+    space = space or serving_space()
+    compact = f"t.{space.compact_property}" if space.compact_property else "null"
+    return f"""
+    MATCH (u:User {{user_id: $user_id}})-[:UPLOADED]->(f:File)-[:HAS_CHUNK]->(c:Chunk)
+    WHERE c.id > $after
+    WITH f, c
+    ORDER BY c.id
+    LIMIT $limit
+    OPTIONAL MATCH (c)-[:HAS_CONTENT]->(shared:ChunkContent)
+    WITH f, c, coalesce(shared, c) AS t
+    RETURN c.id AS id,
+           f.filename AS filename,
+           c.chunk_index AS chunk_index,
+           t.text AS text,
+           t.{space.vector_property} AS embedding,
+           {compact} AS compact
+    ORDER BY c.id
+    """
+
+
+EXPORT_CHUNKS = register_query("export_chunks", _export_chunks_query)
+EXPORT_NEXT = register_query(
+    "export_next",
+    """
+    MATCH (u:User {user_id: $user_id})-[:UPLOADED]->(:File)-[:HAS_CHUNK]->(c1:Chunk)-[:NEXT]->(c2:Chunk)
+    WHERE c1.id > $after
+    RETURN c1.id AS source, c2.id AS target
+    ORDER BY c1.id
+    LIMIT $limit
+    """,
+)
+IMPORT_FILES = register_query(
+    "import_files",
+    """
+    MATCH (u:User {user_id: $user_id})
+    UNWIND $files AS file
+    MERGE (f:File {user_id: $user_id, filename: file.filename})
+    SET f += file.props,
+        f.processed_date = CASE WHEN file.processed_date IS NULL THEN datetime()
+                                ELSE datetime(file.processed_date) END
+    MERGE (u)-[:UPLOADED]->(f)
+    """,
+)
+IMPORT_NEXT = register_query(
+    "import_next",
+    """
+    UNWIND $pairs AS pair
+    MATCH (c1:Chunk {id: pair[0]})
+    MATCH (c2:Chunk {id: pair[1]})
+    MERGE (c1)-[:NEXT]->(c2)
+    """,
+)
+
+
+def _batch_size() -> int:
+    return max(1, environment.TRANSFER_BATCH_SIZE)
+
+
+def _plain(value: Any) -> Any:
+    # Neo4j temporal values become ISO strings; everything else File nodes hold is JSON-ready.
+    return value.iso_format() if hasattr(value, "iso_format") else value
+
+
+def export_tenant(user_id: str, path: str) -> Dict[str, Any]:
+    """Write user_id's files, chunks, NEXT edges and serving vectors to a tar at path.
+
+    Chunks are paged by id, so memory stays bounded; the export is not a snapshot, so avoid
+    ingesting for the user while it runs.
+    """
+    started = time.monotonic()
+    space = serving_space()
+    files = [{k: _plain(v) for k, v in r["props"].items()} for r in run_query(EXPORT_FILES, {"user_id": user_id}) or []]
+    file_index = {f["filename"]: i for i, f in enumerate(files)}
+    rows = run_query(COUNT_USER_CHUNKS, {"user_id": user_id})
+    n = rows[0]["chunks"] if rows else 0
+    compact_dtype = {"int8": np.int8, "float16": "<f2"}.get(space.compact_dtype or "")
+
+    with tempfile.TemporaryDirectory(prefix="tenant-export-") as tmp:
+        def column(name: str) -> str:
+            return os.path.join(tmp, name)
+
+        def matrix(name: str, dtype: Any, dims: int) -> np.ndarray:
+            # Vectors are written straight to disk; an empty array cannot be memory-mapped.
+            if n == 0:
+                return np.zeros((0, dims), dtype=dtype)
+            return np.lib.format.open_memmap(column(name), mode="w+", dtype=dtype, shape=(n, dims))
+
+        chunk_file = np.zeros(n, dtype=np.int32)
+        chunk_index = np.zeros(n, dtype=np.int32)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        has_vector = np.zeros(n, dtype=bool)
+        vectors = matrix("vectors.npy", np.float32, space.index_dims)
+        compact = matrix("compact.npy", compact_dtype, space.native_dims) if compact_dtype is not None else None
+        row_of: Dict[str, int] = {}
+        i = 0
+        after = ""
+        with open(column("texts.bin"), "wb") as texts:
+            while i < n:
+                page = run_query(
+                    EXPORT_CHUNKS, {"user_id": user_id, "after": after, "limit": min(_batch_size(), n - i)}, space=space
+                )
+                if not page:
+                    break
+                for r in page:
+                    encoded = (r["text"] or "").encode("utf-8")
+                    texts.write(encoded)
+                    offsets[i + 1] = offsets[i] + len(encoded)
+                    chunk_file[i] = file_index[r["filename"]]
+                    chunk_index[i] = r["chunk_index"]
+                    if r["embedding"] is not None:
+                        has_vector[i] = True
+                        vectors[i] = r["embedding"]
+                    if compact is not None and r["compact"] is not None:
+                        compact[i] = np.frombuffer(bytes(r["compact"]), dtype=compact_dtype)
+                    row_of[r["id"]] = i
+                    i += 1
+                after = page[-1]["id"]
+        for name, array in (("vectors.npy", vectors), ("compact.npy", compact)):
+            if isinstance(array, np.memmap):
+                array.flush()
+            elif array is not None:
+                np.save(column(name), array)
+
+        pairs: List[List[int]] = []
+        after = ""
+        while True:
+            page = run_query(EXPORT_NEXT, {"user_id": user_id, "after": after, "limit": _batch_size()})
+            if not page:
+                break
+            pairs.extend([row_of[r["source"]], row_of[r["target"]]] for r in page if r["source"] in row_of and r["target"] in row_of)
+            after = page[-1]["source"]
+            if len(page) < _batch_size():
+                break
+
+        np.save(column("chunk_file.npy"), chunk_file[:i])
+        np.save(column("chunk_index.npy"), chunk_index[:i])
+        np.save(column("text_offsets.npy"), offsets[: i + 1])
+        np.save(column("has_vector.npy"), has_vector[:i])
+        np.save(column("next.npy"), np.asarray(pairs, dtype=np.int64).reshape(-1, 2))
+        manifest = {
+            "format": FORMAT,
+            "version": FORMAT_VERSION,
+            "user_id": user_id,
+            "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "space": space_to_json(space),
+            "files": len(files),
+            "chunks": i,
+            "vectors": int(has_vector[:i].sum()),
+            "next_edges": len(pairs),
+        }
+        with open(column("manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        with open(column("files.json"), "w") as f:
+            json.dump(files, f)
+
+        with tarfile.open(path, "w") as tar:
+            for name in sorted(os.listdir(tmp)):
+                tar.add(column(name), arcname=name)
+
+    logger.info(f"Exported {i} chunks of {user_id} in {time.monotonic() - started:.1f}s")
+    return {**manifest, "seconds": round(time.monotonic() - started, 3), "bytes": os.path.getsize(path)}
+
+
+def _extract(path: str, target: str) -> None:
+    with tarfile.open(path, "r") as tar:
+        for member in tar.getmembers():
+            if member.name not in _MEMBERS or not member.isfile():
+                raise ValueError(f"Unexpected entry in tenant export: {member.name}")
+            source = tar.extractfile(member)
+            with open(os.path.join(target, member.name), "wb") as out:
+                shutil.copyfileobj(source, out)
+
+
+def import_tenant(user_id: str, path: str) -> Dict[str, Any]:
+    """Load an export_tenant tar into user_id, replacing files with the same names.
+
+    Vectors are written as exported, so the embedding provider is never called; this needs
+    the export's embedding space to match the serving space.
+    """
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory(prefix="tenant-import-") as tmp, ExitStack() as held:
+        _extract(path, tmp)
+
+        def column(name: str) -> str:
+            return os.path.join(tmp, name)
+
+        with open(column("manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT or manifest.get("version") != FORMAT_VERSION:
+            raise ValueError("Not a tenant export, or an unsupported version")
+        space = serving_space()
+        exported_space = space_from_json(manifest["space"])
+        if exported_space != space:
+            raise ValueError(
+                f"Export was made in embedding space {exported_space.vector_property}, "
+                f"but this database serves {space.vector_property}; import it after migrating"
+            )
+        with open(column("files.json")) as f:
+            files = json.load(f)
+
+        chunk_file = np.load(column("chunk_file.npy"))
+        chunk_index = np.load(column("chunk_index.npy"))
+        offsets = np.load(column("text_offsets.npy"))
+        has_vector = np.load(column("has_vector.npy"))
+        # Vectors and texts stay on disk and are paged in batch by batch.
+        mmap = "r" if manifest["chunks"] else None
+        vectors = np.load(column("vectors.npy"), mmap_mode=mmap)
+        compact = np.load(column("compact.npy"), mmap_mode=mmap) if os.path.exists(column("compact.npy")) else None
+        texts = np.memmap(column("texts.bin"), dtype=np.uint8, mode="r") if offsets[-1] else np.zeros(0, np.uint8)
+        next_pairs = np.load(column("next.npy"))
+
+        create_or_get_user(user_id)
+        # The same leases as an ingest, so imports and uploads of the same file never interleave.
+        # They are taken in filename order, so two overlapping imports cannot deadlock.
+        leases: Dict[str, FileLease] = {}
+        for filename in sorted({file["filename"] for file in files}):
+            leases[filename] = held.enter_context(file_lease(user_id, filename))
+        replaced: List[str] = []
+        for file in files:
+            replaced.extend(delete_file_chunks(user_id, file["filename"])["hashes"])
+        run_query(
+            IMPORT_FILES,
+            {
+                "user_id": user_id,
+                "files": [
+                    {
+                        "filename": file["filename"],
+                        "processed_date": file.get("processed_date"),
+                        "props": {k: v for k, v in file.items() if k not in _FILE_SKIP_PROPERTIES},
+                    }
+                    for file in files
+                ],
+            },
+        )
+
+        dedup = dedup_enabled()
+        batch_size = _batch_size()
+        order = np.lexsort((chunk_index, chunk_file))
+        ids = [""] * len(order)
+        for start in range(0, len(order), batch_size):
+            rows = order[start : start + batch_size]
+            by_file: Dict[int, List[Dict[str, Any]]] = {}
+            vector_rows: Dict[int, Dict[str, Dict[str, Any]]] = {}
+            for row in rows:
+                text = bytes(texts[offsets[row] : offsets[row + 1]]).decode("utf-8")
+                filename = files[chunk_file[row]]["filename"]
+                param = chunk_params(int(chunk_index[row]), [text], filename, user_id, dedup)[0]
+                by_file.setdefault(int(chunk_file[row]), []).append(param)
+                ids[row] = param["id"]
+                if has_vector[row]:
+                    key = param["hash"] if dedup else param["id"]
+                    vector_rows.setdefault(int(chunk_file[row]), {})[key] = {
+                        "id": key,
+                        "embedding": vectors[row].tolist(),
+                        "compact": compact[row].tobytes() if compact is not None else None,
+                    }
+            for file_row, params in by_file.items():
+                filename = files[file_row]["filename"]
+                lease = leases[filename]
+                created = run_query(
+                    CREATE_DEDUP_CHUNKS if dedup else CREATE_CHUNKS,
+                    {"params": params, "user_id": user_id, "filename": filename, "lease_token": lease.token},
+                )
+                if not (created and created[0]["created"]):
+                    raise LeaseLost(f"Chunks for '{filename}' were fenced off from lease token {lease.token}")
+                # Entity extraction is CPU-only, so MENTIONS are rebuilt rather than exported.
+                write_mentions(user_id, filename, [p["id"] for p in params], [p["text"] for p in params], lease)
+                if file_row in vector_rows:
+                    write_vector_rows(
+                        space, list(vector_rows[file_row].values()), len(params), content=dedup, lease=lease
+                    )
+
+        for start in range(0, len(next_pairs), batch_size):
+            pairs = [[ids[a], ids[b]] for a, b in next_pairs[start : start + batch_size]]
+            run_query(IMPORT_NEXT, {"pairs": pairs})
+
+        # Indexes this database does not have yet are created only now, so they are populated
+        # once from the loaded chunks; existing ones were kept up to date during the load.
+        ensure_search_indexes([space])
+        remove_orphan_content(sorted(set(replaced)))
+        seconds = time.monotonic() - started
+        counts = np.bincount(chunk_file, minlength=len(files)) if len(chunk_file) else np.zeros(len(files), int)
+        for i, file in enumerate(files):
+            record_ingest(user_id, file["filename"], int(counts[i]), seconds, file.get("size"), file.get("file_type"))
+        schedule_similarity(user_id, full=True)
+
+    logger.info(f"Imported {len(order)} chunks into {user_id} in {seconds:.1f}s")
+    return {
+        "user_id": user_id,
+        "source_user_id": manifest["user_id"],
+        "files": len(files),
+        "chunks": int(len(order)),
+        "vectors": int(has_vector.sum()),
+        "next_edges": int(len(next_pairs)),
+        "seconds": round(seconds, 3),
+    }
+
+
+__all__ = [
+    "export_tenant",
+    "import_tenant",
+]
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+
+# Compact encodings kept next to the (possibly truncated) index vector for exact re-scoring.
+COMPACT_DTYPES = {
+    "int8": np.int8,
+    "float16": np.float16,
+}
+
+# Neo4j stores a list of floats as 64-bit doubles.
+NEO4J_FLOAT_BYTES = 8
+
+
+def truncate(vector: Sequence[float], dims: int) -> List[float]:
+    """Keep the leading dims of a Matryoshka embedding, renormalized to unit length."""
+    arr = np.asarray(vector, dtype=np.float32)[:dims]
+    norm = float(np.linalg.norm(arr))
+    if norm > 0:
+        arr = arr / norm
+    return arr.tolist()
+
+
+def quantize(vector: Sequence[float], dtype: str) -> bytes:
+    """Encode a full vector compactly. int8 uses a per-vector symmetric scale; since scoring
+    is cosine the scale itself does not need to be stored."""
+    arr = np.asarray(vector, dtype=np.float32)
+    if dtype == "int8":
+        peak = float(np.max(np.abs(arr))) if arr.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        return np.clip(np.rint(arr / scale), -127, 127).astype(np.int8).tobytes()
+    if dtype == "float16":
+        return arr.astype("<f2").tobytes()
+    raise ValueError(f"Unsupported compact dtype: {dtype}")
+
+
+def dequantize(blobs: Sequence[bytes], dtype: str) -> np.ndarray:
+    """Decode compact blobs into a float32 matrix, one row per blob."""
+    np_dtype = "<f2" if dtype == "float16" else np.int8
+    return np.vstack([np.frombuffer(bytes(b), dtype=np_dtype) for b in blobs]).astype(np.float32)
+
+
+def cosine_scores(query: Sequence[float], matrix: np.ndarray) -> np.ndarray:
+    q = np.asarray(query, dtype=np.float32)
+    q_norm = np.linalg.norm(q) or 1.0
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    return (matrix @ q) / (norms * q_norm)
+
+
+def rescore(query: Sequence[float], blobs: Sequence[bytes], dtype: str) -> List[float]:
+    """Exact cosine between the full query vector and each candidate's compact copy."""
+    if not blobs:
+        return []
+    return cosine_scores(query, dequantize(blobs, dtype)).tolist()
+
+
+def bytes_per_vector(index_dims: int, native_dims: int, compact_dtype: str | None) -> int:
+    size = index_dims * NEO4J_FLOAT_BYTES
+    if compact_dtype:
+        size += native_dims * np.dtype(COMPACT_DTYPES[compact_dtype]).itemsize
+    return size
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def compare_modes(
+    corpus: Sequence[Sequence[float]],
+    queries: Sequence[Sequence[float]],
+    dims_options: Sequence[int],
+    k: int = 10,
+    oversample: int = 4,
+) -> List[Dict[str, Any]]:
+    """Recall@k and per-query search latency of each storage mode against exact full-vector search.
+
+    Every configuration is evaluated as a brute-force scan in NumPy, which mirrors how
+    retrieval scores a tenant's chunks.
+    """
+    full = _unit_rows(np.asarray(corpus, dtype=np.float32))
+    q_full = _unit_rows(np.asarray(queries, dtype=np.float32))
+    native = full.shape[1]
+    k = min(k, full.shape[0])
+    truth = [set(np.argsort(-(full @ q))[:k].tolist()) for q in q_full]
+
+    def run(name: str, index_dims: int, compact_dtype: str | None) -> Dict[str, Any]:
+        index = _unit_rows(full[:, :index_dims])
+        q_index = _unit_rows(q_full[:, :index_dims])
+        compact = None
+        if compact_dtype:
+            compact = _unit_rows(dequantize([quantize(row, compact_dtype) for row in full], compact_dtype))
+        latencies: List[float] = []
+        recalls: List[float] = []
+        for qi in range(len(q_full)):
+            started = time.perf_counter()
+            scores = index @ q_index[qi]
+            if compact is None:
+                top = np.argsort(-scores)[:k]
+            else:
+                pool = min(len(scores), k * oversample)
+                candidates = np.argpartition(-scores, pool - 1)[:pool]
+                exact = compact[candidates] @ q_full[qi]
+                top = candidates[np.argsort(-exact)[:k]]
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len(truth[qi].intersection(top.tolist())) / k if k else 0.0)
+        latencies.sort()
+        return {
+            "mode": name,
+            "index_dimension": index_dims,
+            "compact_dtype": compact_dtype,
+            "bytes_per_vector": bytes_per_vector(index_dims, native, compact_dtype),
+            f"recall_at_{k}": round(float(np.mean(recalls)), 4) if recalls else None,
+            "latency_ms_mean": round(float(np.mean(latencies)), 4) if latencies else None,
+            "latency_ms_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 4) if latencies else None,
+        }
+
+    report = [run("full", native, None)]
+    for dims in sorted({d for d in dims_options if 0 < d < native}, reverse=True):
+        report.append(run("truncated", dims, None))
+        for compact_dtype in COMPACT_DTYPES:
+            report.append(run(f"truncated+{compact_dtype}", dims, compact_dtype))
+    return report
+
+
+__all__ = [
+    "COMPACT_DTYPES",
+    "truncate",
+    "quantize",
+    "dequantize",
+    "rescore",
+    "cosine_scores",
+    "bytes_per_vector",
+    "compare_modes",
+]
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import services.diversity as diversity
+from services.diversity import diversify, mmr_select
+from services.embeddings import EmbeddingSpace
+
+
+QUERY = [1.0, 0.0, 0.0]
+# Row 1 nearly duplicates row 0 (cosine 0.96); row 2 is less relevant but points elsewhere.
+VECTORS = np.array(
+    [
+        [0.8, 0.6, 0.0],
+        [0.6, 0.8, 0.0],
+        [5.0, 0.0, 12.0],
+    ]
+)
+SPACE = EmbeddingSpace("test", "test-model", 3, 3)
+
+
+def test_mmr_select_prefers_diverse_picks():
+    picks, similarity, div, scores = mmr_select(QUERY, VECTORS, k=3, lambda_mult=0.5)
+    assert picks == [0, 2, 1]
+    assert similarity == pytest.approx([0.8, 5 / 13, 0.6], abs=1e-6)
+    assert div == pytest.approx([1.0, 9 / 13, 0.04], abs=1e-6)
+    assert scores == pytest.approx([0.4, 1 / 26, -0.18], abs=1e-6)
+
+
+def test_mmr_select_lambda_one_is_relevance_order():
+    picks, similarity, _, scores = mmr_select(QUERY, VECTORS, k=3, lambda_mult=1.0)
+    assert picks == [0, 1, 2]
+    assert scores == pytest.approx(similarity, abs=1e-6)
+
+
+def test_mmr_select_bounds():
+    assert len(mmr_select(QUERY, VECTORS, k=10, lambda_mult=0.5)[0]) == 3
+    assert mmr_select(QUERY, VECTORS, k=0, lambda_mult=0.5) == ([], [], [], [])
+    assert mmr_select(QUERY, np.zeros((0, 3)), k=3, lambda_mult=0.5) == ([], [], [], [])
+
+
+@pytest.fixture
+def stored_vectors(monkeypatch):
+    # Hit "b" has no vector yet (not embedded).
+    stored = {"a": VECTORS[0], "c": VECTORS[1], "d": VECTORS[2]}
+
+    def run_query(name, params, **template_args):
+        return [{"id": i, "vector": list(stored[i])} for i in params["ids"] if i in stored]
+
+    monkeypatch.setattr(diversity, "run_query", run_query)
+    return stored
+
+
+def _hits():
+    return [{"id": i, "text": i.upper()} for i in "abcd"]
+
+
+def test_diversify_annotates_picks(stored_vectors):
+    selected = diversify(_hits(), QUERY, k=3, lambda_mult=0.5, space=SPACE)
+    assert [h["id"] for h in selected] == ["a", "d", "c"]
+    assert [h["retrieval_rank"] for h in selected] == [1, 4, 3]
+    assert selected[1]["similarity"] == round(5 / 13, 4)
+    assert selected[1]["diversity"] == round(9 / 13, 4)
+    assert selected[0]["text"] == "A"
+
+
+def test_diversify_fills_up_with_hits_without_vectors(stored_vectors):
+    selected = diversify(_hits(), QUERY, k=4, lambda_mult=0.5, space=SPACE)
+    assert [h["id"] for h in selected] == ["a", "d", "c", "b"]
+    assert selected[-1]["retrieval_rank"] == 2
+    assert "similarity" not in selected[-1]
+
+
+def test_diversify_without_any_vectors(monkeypatch):
+    monkeypatch.setattr(diversity, "run_query", lambda name, params, **template_args: [])
+    assert diversify(_hits(), QUERY, k=2, lambda_mult=0.5, space=SPACE) == _hits()[:2]
+    assert diversify([], QUERY, k=2, lambda_mult=0.5, space=SPACE) == []
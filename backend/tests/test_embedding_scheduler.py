@@ -0,0 +1,238 @@
+import threading
+
+import pytest
+
+import services.embedding_scheduler as embedding_scheduler
+from services.embedding_scheduler import EmbeddingScheduler, RateLimiter, estimate_tokens
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping advances the clock instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+    time = monotonic
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.slept.append(seconds)
+            self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(embedding_scheduler, "time", fake)
+    return fake
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, message="", headers=None):
+        super().__init__(message or f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+def test_limiter_without_limits_never_waits(clock):
+    limiter = RateLimiter()
+    for _ in range(100):
+        limiter.acquire(100_000)
+    assert clock.slept == []
+
+
+def test_limiter_learns_limits_from_headers_without_draining(clock):
+    limiter = RateLimiter()
+    limiter.observe(
+        {
+            "x-ratelimit-limit-requests": "5000",
+            "x-ratelimit-remaining-requests": "4999",
+            "x-ratelimit-limit-tokens": "1000000",
+            "x-ratelimit-remaining-tokens": "990000",
+        }
+    )
+    limiter.acquire(64_000)
+    assert clock.slept == []
+    assert limiter.snapshot()["tokens_per_minute"] == 1_000_000
+
+
+def test_limiter_learned_limit_starts_full_without_remaining(clock):
+    limiter = RateLimiter()
+    limiter.observe({"x-ratelimit-limit-tokens": "120000"})
+    limiter.acquire(120_000)
+    assert clock.slept == []
+
+
+def test_limiter_waits_for_token_refill(clock):
+    limiter = RateLimiter(tokens_per_minute=60_000)
+    limiter.acquire(60_000)
+    limiter.acquire(30_000)
+    assert clock.slept == [pytest.approx(30.0)]
+
+
+def test_limiter_adopts_lower_remaining_budget(clock):
+    limiter = RateLimiter(tokens_per_minute=100_000)
+    limiter.observe({"x-ratelimit-limit-tokens": "100000", "x-ratelimit-remaining-tokens": "10000"})
+    limiter.acquire(20_000)
+    assert sum(clock.slept) == pytest.approx(6.0)
+
+
+def test_limiter_caps_batches_larger_than_the_bucket(clock):
+    limiter = RateLimiter(tokens_per_minute=1_000)
+    limiter.acquire(5_000)
+    assert clock.slept == []
+
+
+def test_limiter_request_bucket(clock):
+    limiter = RateLimiter(requests_per_minute=2)
+    limiter.acquire(1)
+    limiter.acquire(1)
+    limiter.acquire(1)
+    assert clock.slept == [pytest.approx(30.0)]
+
+
+@pytest.mark.parametrize(
+    "headers, blocked",
+    [
+        ({"retry-after": "2"}, 2.0),
+        ({"x-ratelimit-limit-tokens": "1000", "x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "6m0s"}, 360.0),
+        ({"x-ratelimit-limit-requests": "10", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "20ms"}, 0.02),
+    ],
+)
+def test_limiter_blocks_on_exhausted_budget(clock, headers, blocked):
+    limiter = RateLimiter()
+    limiter.observe(headers)
+    assert limiter.snapshot()["blocked_for_seconds"] == pytest.approx(blocked)
+    limiter.acquire(1)
+    assert clock.slept[0] == pytest.approx(blocked)
+
+
+def _echo(calls):
+    def embed_batch(texts):
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts], None
+
+    return embed_batch
+
+
+def test_plan_batches_respects_token_budget_and_item_cap():
+    scheduler = EmbeddingScheduler(_echo([]), "openai", batch_tokens=1_000)
+    texts = ["x" * 4 * 400] * 5  # 400 tokens each
+    assert scheduler.plan_batches(texts) == [(0, 2), (2, 4), (4, 5)]
+
+    scheduler.max_items = 3
+    assert scheduler.plan_batches(["short"] * 7) == [(0, 3), (3, 6), (6, 7)]
+    # A single text over budget still gets a batch of its own.
+    assert scheduler.plan_batches(["x" * 4 * 5_000]) == [(0, 1)]
+
+
+def test_embed_keeps_input_order_across_batches(clock):
+    calls = []
+    scheduler = EmbeddingScheduler(_echo(calls), "openai", batch_tokens=600)
+    texts = ["x" * 4 * (100 + i) for i in range(20)]
+    vectors = scheduler.embed(texts)
+    assert vectors == [[float(len(t))] for t in texts]
+    assert len(calls) > 1
+    assert scheduler.stats()["totals"]["items"] == 20
+    assert scheduler.embed([]) == []
+
+
+def test_retryable_errors_back_off_and_retry(clock, monkeypatch):
+    attempts = []
+
+    def embed_batch(texts):
+        attempts.append(len(texts))
+        if len(attempts) < 3:
+            raise ProviderError(429)
+        return [[1.0]] * len(texts), None
+
+    scheduler = EmbeddingScheduler(embed_batch, "openai", backoff_base=0.5, backoff_max=30.0)
+    monkeypatch.setattr(embedding_scheduler.random, "uniform", lambda low, high: high)
+    assert scheduler.embed(["a", "b"]) == [[1.0], [1.0]]
+    assert clock.slept == [0.5, 1.0]
+    assert scheduler.stats()["totals"]["retries"] == 2
+
+
+def test_backoff_is_capped(monkeypatch):
+    scheduler = EmbeddingScheduler(_echo([]), "openai", backoff_base=0.5, backoff_max=4.0)
+    monkeypatch.setattr(embedding_scheduler.random, "uniform", lambda low, high: high)
+    assert [scheduler._backoff(a) for a in range(6)] == [0.5, 1.0, 2.0, 4.0, 4.0, 4.0]
+
+
+def test_non_retryable_errors_fail_at_once(clock):
+    def embed_batch(texts):
+        raise ProviderError(401)
+
+    scheduler = EmbeddingScheduler(embed_batch, "openai")
+    with pytest.raises(ProviderError):
+        scheduler.embed(["a"])
+    assert clock.slept == []
+    assert scheduler.stats()["totals"]["failures"] == 1
+
+
+def test_retries_give_up_after_max_retries(clock):
+    calls = []
+
+    def embed_batch(texts):
+        calls.append(texts)
+        raise ProviderError(503)
+
+    scheduler = EmbeddingScheduler(embed_batch, "openai", max_retries=2)
+    with pytest.raises(ProviderError):
+        scheduler.embed(["a"])
+    assert len(calls) == 3
+
+
+def test_too_large_batches_are_split_and_budget_shrinks(clock):
+    calls = []
+
+    def embed_batch(texts):
+        calls.append(len(texts))
+        if len(texts) > 2:
+            raise ProviderError(413)
+        return [[1.0]] * len(texts), None
+
+    scheduler = EmbeddingScheduler(embed_batch, "openai", batch_tokens=8_000)
+    assert len(scheduler.embed(["a"] * 8)) == 8
+    assert calls[:3] == [8, 4, 2]
+    assert scheduler.stats()["totals"]["splits"] == 3
+    assert clock.slept == []
+
+
+def test_timeouts_shrink_and_successes_grow_the_budget(clock):
+    outcomes = [TimeoutError("read timeout"), None, None]
+
+    def embed_batch(texts):
+        error = outcomes.pop(0)
+        if error:
+            raise error
+        return [[1.0]] * len(texts), None
+
+    scheduler = EmbeddingScheduler(embed_batch, "openai", batch_tokens=8_000)
+    scheduler.embed_one("a")
+    # Halved by the timeout, then grown by 25% on success.
+    assert scheduler.batch_tokens == int(4_000 * 1.25) + 1
+    scheduler.embed_one("b")
+    assert scheduler.batch_tokens == int(5_001 * 1.25) + 1
+
+
+def test_success_headers_steer_the_limiter(clock):
+    def embed_batch(texts):
+        return [[1.0]] * len(texts), {"x-ratelimit-limit-tokens": "1000000", "x-ratelimit-remaining-tokens": "999000"}
+
+    scheduler = EmbeddingScheduler(embed_batch, "openai", batch_tokens=64_000)
+    for _ in range(5):
+        scheduler.embed_one("x" * 4 * 60_000)
+    assert clock.slept == []
+    assert scheduler.stats()["rate_limiter"]["tokens_per_minute"] == 1_000_000
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("x" * 400) == 100
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+import services.embedding_spaces as embedding_spaces
+from services.embedding_spaces import (
+    ACTIVATE_SPACE,
+    ACTIVE_SPACE,
+    LEGACY_VECTORS,
+    serving_space,
+    space_from_json,
+    space_to_json,
+    target_space,
+    write_spaces,
+)
+from services.embeddings import EmbeddingSpace
+
+
+CONFIGURED = EmbeddingSpace("openai", "text-embedding-3-small", 1536, 1536)
+
+
+class FakeDatabase:
+    """No EmbeddingSpace node yet; optionally legacy vectors and a legacy index."""
+
+    def __init__(self, legacy_vectors=False, legacy_index=False):
+        self.legacy_vectors = legacy_vectors
+        self.legacy_index = legacy_index
+        self.activated = []
+
+    def run_query(self, name, params=None, **template_args):
+        if name == ACTIVE_SPACE:
+            return [{"definition": d} for d in self.activated[-1:]]
+        if name == ACTIVATE_SPACE:
+            self.activated.append(params["definition"])
+            return [{"retired": 0}]
+        if name == LEGACY_VECTORS:
+            assert template_args["space"].vector_property == "textEmbedding1536"
+            return [{"id": "chunk"}] if self.legacy_vectors else []
+        raise AssertionError(f"unexpected query {name}")
+
+    def vector_index_state(self, space, content=False):
+        present = self.legacy_index and space.index_name == "pdf_chunks_1536"
+        return {"state": "ONLINE" if present else None, "populationPercent": 100.0 if present else None}
+
+
+@pytest.fixture
+def database(monkeypatch):
+    def install(**kwargs):
+        db = FakeDatabase(**kwargs)
+        monkeypatch.setattr(embedding_spaces, "run_query", db.run_query)
+        monkeypatch.setattr(embedding_spaces, "vector_index_state", db.vector_index_state)
+        monkeypatch.setattr(embedding_spaces, "configured_space", lambda: CONFIGURED)
+        monkeypatch.setattr(embedding_spaces, "_serving", {"space": None, "loaded_at": 0.0})
+        return db
+
+    return install
+
+
+def test_model_keyed_names_differ_for_same_dimensions():
+    other = CONFIGURED._replace(model="text-embedding-ada-002")
+    assert CONFIGURED.vector_property != other.vector_property
+    assert CONFIGURED.index_name != other.index_name
+    assert CONFIGURED.vector_property.startswith("textEmbedding1536_")
+
+
+def test_definitions_without_legacy_flag_keep_old_names():
+    stored = json.dumps({k: v for k, v in CONFIGURED._asdict().items() if k != "legacy_names"})
+    space = space_from_json(stored)
+    assert space.legacy_names
+    assert space.vector_property == "textEmbedding1536"
+    assert space.index_name == "pdf_chunks_1536"
+    assert space_from_json(space_to_json(CONFIGURED)) == CONFIGURED
+
+
+def test_new_database_adopts_configured_space(database):
+    db = database()
+    assert serving_space() == CONFIGURED
+    assert space_from_json(db.activated[0]) == CONFIGURED
+    assert write_spaces() == [CONFIGURED]
+
+
+@pytest.mark.parametrize("legacy", [{"legacy_vectors": True}, {"legacy_index": True}])
+def test_upgraded_database_keeps_legacy_vectors(database, legacy):
+    database(**legacy)
+    serving = serving_space()
+    assert serving.legacy_names
+    assert serving.vector_property == "textEmbedding1536"
+    assert serving.index_name == "pdf_chunks_1536"
+    # Same model and dimensions: the vectors stay where they are, nothing to migrate.
+    assert target_space() == serving
+    assert write_spaces() == [serving]
+
+
+def test_upgraded_database_migrates_to_changed_configuration(database, monkeypatch):
+    database(legacy_vectors=True)
+    serving = serving_space()
+    truncated = CONFIGURED._replace(index_dims=512)
+    monkeypatch.setattr(embedding_spaces, "configured_space", lambda: truncated)
+    assert target_space() == truncated
+    assert write_spaces() == [serving, truncated]
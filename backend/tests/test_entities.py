@@ -0,0 +1,41 @@
+from services.entities import entity_id, extract_entities
+
+
+def _by_key(text, **kwargs):
+    return {e["key"]: e for e in extract_entities(text, **kwargs)}
+
+
+def test_each_span_counts_once_for_the_first_kind():
+    entities = _by_key("The 3.5kW motor runs at 230V and meets IEC-60034; see IEC rules for USB-C.")
+    assert entities["3.5kw"]["kind"] == "quantity" and entities["3.5kw"]["count"] == 1
+    assert entities["230v"]["kind"] == "quantity" and entities["230v"]["count"] == 1
+    assert entities["iec-60034"]["kind"] == "identifier"
+    assert entities["usb-c"]["kind"] == "identifier"
+    # Only the standalone IEC is an acronym mention; the prefixes of identifiers are not.
+    assert entities["iec"]["count"] == 1
+    assert "usb" not in entities
+    assert "60034" not in entities
+
+
+def test_repeated_mentions_are_counted():
+    entities = _by_key("Part AB-12 replaces AB-12 at 5 kg; NASA and NASA again.")
+    assert entities["ab-12"]["count"] == 2
+    assert entities["5kg"]["kind"] == "quantity"
+    assert entities["nasa"]["count"] == 2
+
+
+def test_names_and_keywords():
+    text = "The Royal Society of London reviewed the turbine. The turbine passed."
+    entities = _by_key(text)
+    assert entities["royal society of london"]["kind"] == "name"
+    assert entities["turbine"] == {"key": "turbine", "name": "turbine", "kind": "keyword", "count": 2}
+    assert "turbine" not in _by_key("One turbine only.")
+    assert "turbine" in _by_key("One turbine only.", min_keyword_count=1)
+
+
+def test_plain_numbers_are_not_entities():
+    assert extract_entities("Chapter 12 and 4.5 percent") == []
+
+
+def test_entity_id_is_per_user():
+    assert entity_id("alice", "iec") != entity_id("bob", "iec")
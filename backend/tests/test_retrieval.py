@@ -0,0 +1,69 @@
+import pytest
+
+from services.retrieval import lucene_query, reciprocal_rank_fusion
+
+
+def test_lucene_query_joins_terms_with_or():
+    assert lucene_query("Which warranty applies?") == "which OR warranty OR applies"
+
+
+@pytest.mark.parametrize(
+    "question, expected",
+    [
+        ("valid AND transferable", "valid OR and OR transferable"),
+        ("NOT void OR expired", "not OR void OR or OR expired"),
+    ],
+)
+def test_lucene_query_keeps_operators_as_terms(question, expected):
+    assert lucene_query(question) == expected
+
+
+def test_lucene_query_quotes_and_boosts_identifiers():
+    assert lucene_query("part AB-1234 in clause 4.2") == 'part OR "AB-1234"^2 OR in OR clause OR "4.2"^2'
+
+
+def test_lucene_query_escapes_special_characters():
+    assert lucene_query("C++ && a:b || x*") == r"c\+\+ OR \&\& OR a\:b OR \|\| OR x\*"
+
+
+def test_lucene_query_skips_duplicates_and_short_tokens():
+    assert lucene_query("a Seal seal, SEAL") == "seal"
+    assert lucene_query("? a") == ""
+
+
+def test_lucene_query_caps_terms():
+    words = " ".join(f"term{chr(97 + i // 26)}{chr(97 + i % 26)}" for i in range(40))
+    assert len(lucene_query(words).split(" OR ")) == 32
+
+
+def test_reciprocal_rank_fusion_sums_reciprocal_ranks():
+    hits = reciprocal_rank_fusion(
+        {
+            "vector": [{"id": "a", "score": 0.9}, {"id": "b", "score": 0.8}],
+            "keyword": [{"id": "b", "score": 7.0}, {"id": "c", "score": 3.0}],
+        },
+        rrf_k=60,
+    )
+    assert [h["id"] for h in hits] == ["b", "a", "c"]
+    assert hits[0]["score"] == pytest.approx(1 / 62 + 1 / 61)
+    assert hits[1]["score"] == pytest.approx(1 / 61)
+    assert hits[2]["score"] == pytest.approx(1 / 62)
+
+
+def test_reciprocal_rank_fusion_records_per_list_scores_and_ranks():
+    hits = reciprocal_rank_fusion(
+        {
+            "vector": [{"id": "a", "score": 0.9}],
+            "keyword": [{"id": "b", "score": 5.0}, {"id": "a", "score": 2.0}],
+        }
+    )
+    a = next(h for h in hits if h["id"] == "a")
+    assert a["vector_score"] == 0.9 and a["vector_rank"] == 1
+    assert a["keyword_score"] == 2.0 and a["keyword_rank"] == 2
+    assert "vector_rank" not in next(h for h in hits if h["id"] == "b")
+
+
+def test_reciprocal_rank_fusion_limit():
+    ranked = {"vector": [{"id": str(i), "score": 1.0 - i / 10} for i in range(5)]}
+    assert [h["id"] for h in reciprocal_rank_fusion(ranked, limit=2)] == ["0", "1"]
+    assert reciprocal_rank_fusion({}) == []
@@ -1,11 +1,10 @@
-from tqdm import tqdm
-from PIL import Image, ImageEnhance, ImageFilter 
+from PIL import Image, ImageEnhance, ImageFilter
 import logging
-from langchain.schema import Document
 import pytesseract
 import io
+import math
 import numpy as np
-import logging
+import environment
 
 
 # Set up logging with minimal verbosity
@@ -20,22 +19,33 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 
 
-def preprocess_image(image):
+# Peak memory is bounded by a pixel budget rather than by the input: frames are decoded one at
+# a time, oversized JPEGs are decoded at a reduced scale (draft), other oversized frames are
+# reduced right after decoding, and OCR runs over horizontal strips of the result.
+DEFAULT_MAX_PIXELS = environment.IMAGE_MAX_PIXELS
+DEFAULT_STRIP_HEIGHT = environment.IMAGE_OCR_STRIP_HEIGHT
+# Frames are refused when they would still exceed this size once decoded (after any JPEG
+# draft reduction). PIL's own decompression-bomb check on open stays in place as well.
+MAX_DECODE_PIXELS = environment.IMAGE_MAX_DECODE_PIXELS
+MAX_FRAMES = environment.IMAGE_MAX_FRAMES
+
+
+def preprocess_image(image, max_pixels=None):
     """Enhanced image preprocessing for better OCR results"""
+    max_pixels = max_pixels or DEFAULT_MAX_PIXELS
     try:
-        # Convert to RGB if image is in RGBA or other formats
-        if image.mode == 'RGBA':
-            image = image.convert('RGB')
-
         # Convert to grayscale
-        image = image.convert('L')
+        if image.mode != 'L':
+            image = image.convert('L')
 
-        # Resize image if too small
+        # Resize image if too small, without growing past the pixel budget
         min_size = 1000
         if image.width < min_size or image.height < min_size:
             ratio = max(min_size/image.width, min_size/image.height)
-            new_size = (int(image.width*ratio), int(image.height*ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
+            ratio = min(ratio, (max_pixels / (image.width * image.height)) ** 0.5)
+            if ratio > 1:
+                new_size = (int(image.width*ratio), int(image.height*ratio))
+                image = image.resize(new_size, Image.Resampling.LANCZOS)
 
         # Enhance contrast
         enhancer = ImageEnhance.Contrast(image)
@@ -50,7 +60,6 @@ def preprocess_image(image):
         image = enhancer.enhance(1.5)
 
         # Apply adaptive thresholding
-        from PIL import ImageFilter
         image = image.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
 
         return image
@@ -59,57 +68,128 @@ def preprocess_image(image):
         return image
 
 
-def extract_text_from_image(image_bytes, languages=['eng']):
-    """Enhanced OCR function with better error handling and configuration"""
-    try:
-        # Convert image bytes to PIL Image
-        image = Image.open(io.BytesIO(image_bytes))
-
-        # Preprocess image
-        processed_image = preprocess_image(image)
-
-        # Configure Tesseract parameters
-        custom_config = r'--oem 3 --psm 3 -c tessedit_char_whitelist="ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!?@#$%^&*()[]{}<>-_=+|/\\ "' 
-
-        # Try different preprocessing approaches if initial OCR fails
+def _budget_size(width, height, max_pixels):
+    if width * height <= max_pixels:
+        return width, height
+    scale = (max_pixels / (width * height)) ** 0.5
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _decode_frame(image, max_pixels):
+    """Decode the current frame as a grayscale image of at most max_pixels."""
+    width, height = image.size
+    target = _budget_size(width, height, max_pixels)
+    if target != (width, height) and image.format == 'JPEG':
+        # JPEG can be decoded at 1/2, 1/4 or 1/8 scale, so the full-size frame never exists.
+        image.draft('L', target)
+    if image.width * image.height > MAX_DECODE_PIXELS:
+        raise ValueError(
+            f"Frame of {width}x{height} (decoded at {image.width}x{image.height}) "
+            f"exceeds the decode limit of {MAX_DECODE_PIXELS} pixels"
+        )
+    frame = image.convert('L') if image.mode != 'L' else image.copy()
+    if frame.width * frame.height > max_pixels:
+        factor = math.ceil((frame.width * frame.height / max_pixels) ** 0.5)
+        frame = frame.reduce(factor)
+    return frame
+
+
+def _strip_bounds(image, strip_height):
+    """Row ranges of at most strip_height rows, cut at the lightest row near each boundary so
+    strips rarely split a line of text."""
+    if image.height <= strip_height:
+        return [(0, image.height)]
+    rows = np.asarray(image, dtype=np.uint8).mean(axis=1)
+    bounds = []
+    top = 0
+    while top < image.height:
+        bottom = min(top + strip_height, image.height)
+        if bottom < image.height:
+            window = rows[top + strip_height * 3 // 4 : bottom]
+            if window.size:
+                bottom = top + strip_height * 3 // 4 + int(np.argmax(window))
+        bounds.append((top, bottom))
+        top = bottom
+    return bounds
+
+
+def _ocr_image(image, languages):
+    """Run tesseract on a preprocessed image, retrying with other settings if nothing is found."""
+    custom_config = r'--oem 3 --psm 3 -c tessedit_char_whitelist="ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!?@#$%^&*()[]{}<>-_=+|/\\ "'
+    text = pytesseract.image_to_string(image, lang='+'.join(languages), config=custom_config)
+
+    if not text.strip():
+        # Try with different preprocessing
         text = pytesseract.image_to_string(
-            processed_image,
-            lang='+'.join(languages),
-            config=custom_config
+            image.filter(ImageFilter.EDGE_ENHANCE), lang='+'.join(languages), config=custom_config
         )
 
-        if not text.strip():
-            # Try with different preprocessing
-            processed_image = processed_image.filter(ImageFilter.EDGE_ENHANCE)
-            text = pytesseract.image_to_string(
-                processed_image,
-                lang='+'.join(languages),
-                config=custom_config
-            )
-
-        if not text.strip():
-            # Try with different PSM mode
-            custom_config = r'--oem 3 --psm 6'  # Assume uniform block of text
-            text = pytesseract.image_to_string(
-                processed_image,
-                lang='+'.join(languages),
-                config=custom_config
-            )
-
-        text = text.strip()
-
-        # Basic text cleaning
-        if text:
-            # Remove non-printable characters
-            text = ''.join(char for char in text if char.isprintable())
-            # Remove excessive whitespace
-            text = ' '.join(text.split())
-            # Remove very short lines (likely noise)
-            text = '\n'.join(line for line in text.split('\n') if len(line.strip()) > 3)
-
-        return text
+    if not text.strip():
+        # Try with different PSM mode
+        text = pytesseract.image_to_string(image, lang='+'.join(languages), config=r'--oem 3 --psm 6')
+
+    return text.strip()
+
+
+def _clean(text):
+    # Remove non-printable characters
+    text = ''.join(char for char in text if char.isprintable())
+    # Remove excessive whitespace
+    text = ' '.join(text.split())
+    # Remove very short lines (likely noise)
+    return '\n'.join(line for line in text.split('\n') if len(line.strip()) > 3)
+
+
+def iter_image_text(image_bytes, languages=['eng'], statistics=None, max_pixels=None, strip_height=None):
+    """Yield the OCR text of each frame (TIFF pages, GIF frames) of an image, decoding one
+    frame at a time within the pixel budget.
+
+    statistics, if given, is updated as frames are processed.
+    """
+    max_pixels = max_pixels or DEFAULT_MAX_PIXELS
+    strip_height = strip_height or DEFAULT_STRIP_HEIGHT
+    if statistics is None:
+        statistics = {}
+    statistics.setdefault('frames', 0)
+    statistics.setdefault('frames_reduced', 0)
+    statistics.setdefault('successful_ocr', 0)
+    statistics.setdefault('failed_ocr', 0)
+    statistics.setdefault('errors', [])
+
+    image = Image.open(io.BytesIO(image_bytes))
+    frame_count = min(getattr(image, 'n_frames', 1), MAX_FRAMES)
+    for index in range(frame_count):
+        statistics['frames'] += 1
+        try:
+            image.seek(index)
+            original_size = image.size
+            frame = _decode_frame(image, max_pixels)
+            if frame.size != original_size:
+                statistics['frames_reduced'] += 1
+            pieces = []
+            for top, bottom in _strip_bounds(frame, strip_height):
+                strip = preprocess_image(frame.crop((0, top, frame.width, bottom)), max_pixels)
+                text = _ocr_image(strip, languages)
+                if text:
+                    pieces.append(text)
+            del frame
+            text = _clean(' '.join(pieces))
+            if text:
+                statistics['successful_ocr'] += 1
+                yield text if frame_count == 1 else f"[Frame {index + 1}]: {text}"
+            else:
+                statistics['failed_ocr'] += 1
+        except Exception as e:
+            statistics['failed_ocr'] += 1
+            error_msg = f"Error performing OCR on frame {index + 1}: {e}"
+            statistics['errors'].append(error_msg)
+            logger.error(error_msg)
+
 
+def extract_text_from_image(image_bytes, languages=['eng']):
+    """Enhanced OCR function with better error handling and configuration"""
+    try:
+        return '\n'.join(iter_image_text(image_bytes, languages))
     except Exception as e:
         logger.error(f"Error performing OCR: {e}")
         return ""
-
@@ -1,7 +1,6 @@
 
 import fitz  # PyMuPDF
 from tqdm import tqdm
-from PIL import Image, ImageEnhance, ImageFilter 
 import logging
 from utils.extract_text_from_image import extract_text_from_image
 
@@ -18,82 +17,159 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 
 
-def extract_text_from_pdf(pdf_path, languages=['eng']):
-    """Enhanced PDF text extraction with better image handling"""
-    statistics = {
-        'total_pages': 0,
-        'total_images': 0,
-        'successful_ocr': 0,
-        'failed_ocr': 0,
-        'errors': []
-    }
+def _clean(text):
+    return ' '.join(text.replace('\x00', '').split())
+
+
+# Extraction modes:
+#   text  - text layer only, no OCR
+#   auto  - OCR only pages whose text layer is sparse: render and OCR the whole page when
+#           images cover most of it (a scan), otherwise OCR its embedded images
+#   full  - text layer plus OCR of every embedded image on every page
+EXTRACTION_MODES = ('text', 'auto', 'full')
+MAX_PAGE_DECISIONS = 500
+
+
+def _image_coverage(page):
+    """Fraction of the page area covered by placed images (overlaps counted twice, capped at 1)."""
+    area = page.rect.width * page.rect.height
+    if not area:
+        return 0.0
+    covered = 0.0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info['bbox']) & page.rect
+        if not bbox.is_empty:
+            covered += bbox.width * bbox.height
+    return min(1.0, covered / area)
+
+
+def _decide(mode, chars, coverage, image_count, sparse_chars, scan_coverage):
+    if mode == 'text':
+        return 'text'
+    if mode == 'full':
+        return 'ocr-images' if image_count else 'text'
+    if chars >= sparse_chars:
+        return 'text'
+    if coverage >= scan_coverage:
+        return 'ocr-page'
+    if image_count:
+        return 'ocr-images'
+    return 'text' if chars else 'empty'
+
+
+def _ocr(image_bytes, languages, statistics):
+    image_text = extract_text_from_image(image_bytes, languages)
+    if image_text:
+        statistics['successful_ocr'] += 1
+    else:
+        statistics['failed_ocr'] += 1
+    return image_text
+
+
+def iter_pdf_text(pdf_path, languages=['eng'], statistics=None, mode='auto', sparse_chars=100, scan_coverage=0.5):
+    """Yield cleaned text page by page (page text, then OCR text where the mode calls for it).
+
+    statistics, if given, is updated as pages are processed, so a caller streaming the
+    text into later stages has the final counts once the generator is exhausted. It also
+    records the per-page decision: 'text', 'ocr-page' (page rendered and OCR'd), 'ocr-images'
+    (embedded images OCR'd) or 'empty'.
+    """
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown PDF extraction mode: {mode}")
+    if statistics is None:
+        statistics = {}
+    statistics.setdefault('total_pages', 0)
+    statistics.setdefault('total_images', 0)
+    statistics.setdefault('successful_ocr', 0)
+    statistics.setdefault('failed_ocr', 0)
+    statistics.setdefault('errors', [])
+    statistics['extraction_mode'] = mode
+    statistics.setdefault('decisions', {'text': 0, 'ocr-page': 0, 'ocr-images': 0, 'empty': 0})
+    statistics.setdefault('pages_rasterized', 0)
+    statistics.setdefault('images_skipped', 0)
+    statistics.setdefault('page_decisions', [])
 
     try:
         logger.info(f"Starting text extraction from: {pdf_path}")
-
-        # Open the PDF with higher resolution
         doc = fitz.open(pdf_path)
         statistics['total_pages'] = len(doc)
-        full_text = []
-
-        # Process each page
-        for page_num in tqdm(range(len(doc)), desc="Processing pages"):
-            try:
-                page = doc[page_num]
-
-                # Extract text directly from PDF
-                text = page.get_text()
-                if text.strip():
-                    full_text.append(text)
-
-                # Get images with higher resolution
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x resolution
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-                # Process images in the page
-                image_list = page.get_images(full=True)
-                statistics['total_images'] += len(image_list)
-
-                for img_index, img_info in enumerate(image_list):
-                    try:
-                        xref = img_info[0]
-                        base_image = doc.extract_image(xref)
-                        image_bytes = base_image["image"]
-
-                        # Extract text from image with multiple attempts
-                        image_text = extract_text_from_image(image_bytes, languages)
-
-                        if image_text:
-                            statistics['successful_ocr'] += 1
-                            full_text.append(
-                                f"\n[Image Text (Page {page_num + 1}, Image {img_index + 1})]:\n{image_text}"
-                            )
-                        else:
-                            statistics['failed_ocr'] += 1
-
-                    except Exception as e:
-                        statistics['failed_ocr'] += 1
-                        error_msg = f"Error processing image {img_index} on page {page_num + 1}: {str(e)}"
-                        statistics['errors'].append(error_msg)
-                        logger.error(error_msg)
-
-            except Exception as e:
-                error_msg = f"Error processing page {page_num + 1}: {str(e)}"
-                statistics['errors'].append(error_msg)
-                logger.error(error_msg)
-                continue
-
-        # Combine all extracted text
-        combined_text = ' '.join(full_text)
-
-        # Basic text cleaning
-        combined_text = combined_text.replace('\x00', '')  # Remove null bytes
-        combined_text = ' '.join(combined_text.split())  # Normalize whitespace
-
-        return combined_text, statistics
-
     except Exception as e:
         error_msg = f"Fatal error processing PDF: {str(e)}"
         statistics['errors'].append(error_msg)
         logger.error(error_msg)
         raise
+
+    # Process each page
+    for page_num in tqdm(range(len(doc)), desc="Processing pages"):
+        pieces = []
+        try:
+            page = doc[page_num]
+
+            # Extract text directly from PDF
+            text = page.get_text()
+            if text.strip():
+                pieces.append(text)
+
+            image_list = page.get_images(full=True)
+            statistics['total_images'] += len(image_list)
+            chars = len(text.strip())
+            coverage = _image_coverage(page) if mode == 'auto' and chars < sparse_chars and image_list else 0.0
+            decision = _decide(mode, chars, coverage, len(image_list), sparse_chars, scan_coverage)
+            statistics['decisions'][decision] += 1
+            if len(statistics['page_decisions']) < MAX_PAGE_DECISIONS:
+                statistics['page_decisions'].append(
+                    {'page': page_num + 1, 'chars': chars, 'images': len(image_list),
+                     'image_coverage': round(coverage, 3), 'decision': decision}
+                )
+
+            if decision == 'ocr-page':
+                # A scanned page: one render at 2x is cheaper than OCR-ing its image tiles.
+                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
+                statistics['pages_rasterized'] += 1
+                statistics['images_skipped'] += len(image_list)
+                page_text = _ocr(pix.tobytes('png'), languages, statistics)
+                if page_text:
+                    pieces.append(f"\n[Page Text (Page {page_num + 1}, OCR)]:\n{page_text}")
+            elif decision != 'ocr-images':
+                statistics['images_skipped'] += len(image_list)
+
+            for img_index, img_info in enumerate(image_list if decision == 'ocr-images' else []):
+                try:
+                    xref = img_info[0]
+                    base_image = doc.extract_image(xref)
+                    image_text = _ocr(base_image["image"], languages, statistics)
+                    if image_text:
+                        pieces.append(
+                            f"\n[Image Text (Page {page_num + 1}, Image {img_index + 1})]:\n{image_text}"
+                        )
+
+                except Exception as e:
+                    statistics['failed_ocr'] += 1
+                    error_msg = f"Error processing image {img_index} on page {page_num + 1}: {str(e)}"
+                    statistics['errors'].append(error_msg)
+                    logger.error(error_msg)
+
+        except Exception as e:
+            error_msg = f"Error processing page {page_num + 1}: {str(e)}"
+            statistics['errors'].append(error_msg)
+            logger.error(error_msg)
+
+        for piece in pieces:
+            cleaned = _clean(piece)
+            if cleaned:
+                yield cleaned
+
+
+def extract_text_from_pdf(pdf_path, languages=['eng'], mode='auto'):
+    """Enhanced PDF text extraction with better image handling"""
+    statistics = {
+        'total_pages': 0,
+        'total_images': 0,
+        'successful_ocr': 0,
+        'failed_ocr': 0,
+        'errors': []
+    }
+
+    # Combine all extracted text
+    combined_text = ' '.join(iter_pdf_text(pdf_path, languages, statistics, mode=mode))
+    return combined_text, statistics